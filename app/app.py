@@ -49,8 +49,11 @@ import asyncio
 
 from app.clients import RedisClient, PineconeClient, Neo4jClient
 from app.common.initialization import initialize_strategies
+from app.config import workmait_config
 from app.strategies import vector_strategies, graph_strategies
-from app.consumers import consume_add_nodes, consume_delete_nodes, consume_move_nodes, consume_delete_store
+from app.consumers import consume_add_nodes, consume_add_nodes_work, consume_delete_nodes, consume_move_nodes, consume_delete_store
+from app.pipelines.process_pool import ParseProcessPool
+from app.common.metrics import MetricsRegistry
 
 
 @asynccontextmanager
@@ -58,11 +61,14 @@ async def lifespan(app: FastAPI):
 
     redis_client = RedisClient()
 
-    # Initialize store clients and pipelines
-    initialize_strategies(vector_strategies=vector_strategies, graph_strategies=graph_strategies)
+    # Register pipelines, they are built on first use unless preloaded
+    initialize_strategies(vector_strategies=vector_strategies,
+                          graph_strategies=graph_strategies,
+                          materialize=workmait_config.STRATEGIES_PRELOAD)
 
     # Start consumers for each event
     add_nodes_task = asyncio.create_task(consume_add_nodes(redis_client))
+    add_nodes_work_task = asyncio.create_task(consume_add_nodes_work(redis_client))
     delete_nodes_task = asyncio.create_task(consume_delete_nodes(redis_client))
     delete_store_task = asyncio.create_task(consume_delete_store(redis_client))
     move_nodes_task = asyncio.create_task(consume_move_nodes(redis_client))
@@ -70,7 +76,7 @@ async def lifespan(app: FastAPI):
     yield
 
     # Cancel the background tasks during shutdown
-    tasks = [add_nodes_task, delete_nodes_task, delete_store_task, move_nodes_task]
+    tasks = [add_nodes_task, add_nodes_work_task, delete_nodes_task, delete_store_task, move_nodes_task]
     for task in tasks:
         task.cancel()
 
@@ -79,8 +85,9 @@ async def lifespan(app: FastAPI):
 
     PineconeClient.close()
     Neo4jClient.close()
-    
-    redis_client.close()
+    ParseProcessPool.shutdown()
+
+    await redis_client.aclose()
 
 
 
@@ -100,3 +107,9 @@ app.add_middleware(
 @app.get("/")
 async def read_root():
     return {"message": "Hello World"}
+
+
+@app.get("/metrics")
+async def read_metrics():
+    """Counters, gauges and histogram summaries of this process, including consumer lag and in-flight work."""
+    return MetricsRegistry.snapshot()
@@ -1,7 +1,17 @@
 from app.clients.store_clients import BaseStoreClient, Neo4jClient, PineconeClient
+from app.clients.store_registry import StoreRegistry
+from app.clients.graph_store import NamespaceGraphStore
 from app.clients.ai_clients import BaseAIClient, OpenAIClient, HFClient
+from app.clients.local_embedding import LocalEmbedding, LocalEmbeddingEngine
+from app.clients.cached_embedding import CachedEmbedding
 from app.clients.file_clients import RemoteFileServiceClient, S3Client
+from app.clients.file_spool import FileSpool
+from app.clients.in_memory_index import InMemoryIndex
+from app.clients.event_codec import EventCodec
 from app.clients.redis import RedisClient
+from app.clients.admission import AdmissionController, AdmissionCost
+from app.clients.node_manifest import NodeManifest
+from app.clients.fan_out import FanOutTracker
 
 
 
@@ -10,12 +20,24 @@ __all__ = [
     'BaseStoreClient',
     'PineconeClient',
     'Neo4jClient',
+    'StoreRegistry',
+    'NamespaceGraphStore',
     'BaseAIClient',
     'OpenAIClient',
     'HFClient',
+    'LocalEmbedding',
+    'LocalEmbeddingEngine',
+    'CachedEmbedding',
     'RemoteFileServiceClient',
     'S3Client',
-    'RedisClient'
+    'FileSpool',
+    'InMemoryIndex',
+    'EventCodec',
+    'RedisClient',
+    'AdmissionController',
+    'AdmissionCost',
+    'NodeManifest',
+    'FanOutTracker'
 
 
 ]
@@ -0,0 +1,137 @@
+# app/clients/admission.py
+
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from app.common.metrics import MetricsRegistry
+from app.config import workmait_config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class AdmissionCost:
+    """Estimated work of an event."""
+    files: int = 0
+    bytes: int = 0
+    tokens: int = 0
+
+
+class AdmissionController:
+    """
+    Process-wide budget of in-flight work, in files, estimated bytes and estimated tokens.
+
+    Consumers wait for the controller to be open before reading from their stream, and every dispatched event holds
+    its estimated cost until it completes. Once any budget is spent, reads pause until enough work drains, so memory
+    and API pressure stay bounded under bursts instead of growing with the backlog.
+
+    An event holds at most `max_event_share` of each budget, however large it is: its pipelines only have a bounded
+    number of files in progress at a time, and a single large payload must not close reads for every other one.
+    Reads take as many events as the budgets have room for at the mean cost of recent events. A read of events
+    costlier than the recent mean can overrun the budgets, and reads then pause until it drains. Work that is only
+    estimated once it is about to run, such as scheduled add nodes payloads, waits in `acquire` for room instead.
+    """
+    _instance: 'AdmissionController' = None
+
+    # Weight of the latest event in the mean event cost that sizes reads
+    MEAN_COST_ALPHA: float = 0.2
+
+    def __init__(self, max_files: int, max_bytes: int, max_tokens: int, max_event_share: float = 0.5):
+        self.limits = AdmissionCost(files=max_files, bytes=max_bytes, tokens=max_tokens)
+        self.event_limits = AdmissionCost(files=max(1, int(max_files * max_event_share)),
+                                          bytes=int(max_bytes * max_event_share),
+                                          tokens=int(max_tokens * max_event_share))
+        self.in_flight = AdmissionCost()
+        self._mean_cost = {'files': 1.0, 'bytes': 0.0, 'tokens': 0.0}
+        self._drained: Optional[asyncio.Event] = None
+
+    @classmethod
+    def get_instance(cls) -> 'AdmissionController':
+        """Return the controller shared by every consumer, created from the configured budgets."""
+        if cls._instance is None:
+            cls._instance = cls(max_files=workmait_config.ADMISSION_MAX_FILES,
+                                max_bytes=workmait_config.ADMISSION_MAX_BYTES,
+                                max_tokens=workmait_config.ADMISSION_MAX_TOKENS,
+                                max_event_share=workmait_config.ADMISSION_MAX_EVENT_SHARE)
+        return cls._instance
+
+    def is_open(self) -> bool:
+        """Whether every budget has room left."""
+        return (self.in_flight.files < self.limits.files
+                and self.in_flight.bytes < self.limits.bytes
+                and self.in_flight.tokens < self.limits.tokens)
+
+    def events_available(self) -> int:
+        """Number of events every budget still has room for, at the mean cost of recent events."""
+        room = [(getattr(self.limits, name) - getattr(self.in_flight, name)) / mean
+                for name, mean in self._mean_cost.items() if mean > 0]
+        return max(0, int(min(room, default=self.limits.files)))
+
+    async def wait_until_open(self) -> None:
+        """Wait until in-flight work drains below every budget."""
+        if self.is_open():
+            return
+
+        started = time.monotonic()
+        MetricsRegistry.increment('admission.pauses')
+        MetricsRegistry.set_gauge('admission.paused', 1)
+        logger.info(f"Pausing reads, in flight: {self.in_flight}")
+        while not self.is_open():
+            await self._wait_for_release()
+        MetricsRegistry.set_gauge('admission.paused', 0)
+        MetricsRegistry.observe('admission.paused_seconds', time.monotonic() - started)
+
+    def fits(self, cost: AdmissionCost) -> bool:
+        """Whether every budget has room for the cost, capped per event. Anything fits when nothing is in flight."""
+        cost = self._capped(cost)
+        return self.in_flight == AdmissionCost() or (self.in_flight.files + cost.files <= self.limits.files
+                                                     and self.in_flight.bytes + cost.bytes <= self.limits.bytes
+                                                     and self.in_flight.tokens + cost.tokens <= self.limits.tokens)
+
+    async def acquire(self, cost: AdmissionCost) -> AdmissionCost:
+        """Wait until every budget has room for the cost, then reserve it. Returns the cost held, to be released later."""
+        if not self.fits(cost):
+            started = time.monotonic()
+            MetricsRegistry.increment('admission.waits')
+            while not self.fits(cost):
+                await self._wait_for_release()
+            MetricsRegistry.observe('admission.wait_seconds', time.monotonic() - started)
+        return self.reserve(cost)
+
+    def reserve(self, cost: AdmissionCost) -> AdmissionCost:
+        """Account for a dispatched event. Returns the cost it holds, capped per event, to be released later."""
+        cost = self._capped(cost)
+        for name in self._mean_cost:
+            self._mean_cost[name] += self.MEAN_COST_ALPHA * (getattr(cost, name) - self._mean_cost[name])
+        self._update(cost, 1)
+        return cost
+
+    def release(self, cost: AdmissionCost) -> None:
+        """Account for a completed event and wake the readers waiting for room."""
+        self._update(cost, -1)
+        if self._drained is not None:
+            self._drained.set()
+
+    # ---------------------------------------------------------------------------------------------------------- #
+
+    def _capped(self, cost: AdmissionCost) -> AdmissionCost:
+        return AdmissionCost(files=min(cost.files, self.event_limits.files),
+                             bytes=min(cost.bytes, self.event_limits.bytes),
+                             tokens=min(cost.tokens, self.event_limits.tokens))
+
+    async def _wait_for_release(self) -> None:
+        if self._drained is None:
+            self._drained = asyncio.Event()
+        self._drained.clear()
+        await self._drained.wait()
+
+    def _update(self, cost: AdmissionCost, sign: int) -> None:
+        self.in_flight = AdmissionCost(files=self.in_flight.files + sign * cost.files,
+                                       bytes=self.in_flight.bytes + sign * cost.bytes,
+                                       tokens=self.in_flight.tokens + sign * cost.tokens)
+        MetricsRegistry.set_gauge('admission.in_flight.files', self.in_flight.files)
+        MetricsRegistry.set_gauge('admission.in_flight.bytes', self.in_flight.bytes)
+        MetricsRegistry.set_gauge('admission.in_flight.tokens', self.in_flight.tokens)
@@ -1,12 +1,14 @@
-from app.config import workmait_config
+import inspect
+from typing import Any, Callable, Dict, Optional
 
-# LLM
-from llama_index.llms.huggingface import TextGenerationInference
-from llama_index.llms.openai import OpenAI
+from app.config import workmait_config
+from app.clients.redis import RedisClient
+from app.common.embedding_cache import EmbeddingCache, MemoryTier, RedisTier
+from app.clients.local_embedding import LocalEmbedding
+from app.clients.cached_embedding import CachedEmbedding
+from app.clients.rate_limiter import RateLimitController
 
-# Embeddings
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.embeddings.openai import OpenAIEmbedding
+# LLM and embedding integrations are imported by the clients that use them, they are slow to import
 
 # Import Base LLM and Embedding
 from llama_index.core.llms import LLM
@@ -29,10 +31,20 @@ class SingletonMeta(type):
 
 
 class BaseAIClient(metaclass=SingletonMeta):
+    # Cache tiers are shared by every client, keys already include the embedding model
+    _embedding_memory_tier: MemoryTier = None
+    _embedding_persistent_tier: RedisTier = None
+
     def __init__(self, model_name=None, **kwargs):
         self.model_name = model_name
         self.llm: LLM = None
         self.embedding: BaseEmbedding = None
+        # The model behind the cache, for callers that look the cache up themselves
+        self.uncached_embedding: BaseEmbedding = None
+        self.embedding_cache: EmbeddingCache = None
+        # Admission control of remote models, shared by every client using the same model
+        self.llm_rate_limiter: Optional[RateLimitController] = None
+        self.embedding_rate_limiter: Optional[RateLimitController] = None
         self.llm_kwargs = kwargs.get('llm_kwargs', {})
         self.embedding_kwargs = kwargs.get('embedding_kwargs', {})
 
@@ -42,6 +54,27 @@ class BaseAIClient(metaclass=SingletonMeta):
     def initialize_embedding(self):
         raise NotImplementedError("Subclasses should implement this method to initialize embedding.")
 
+    def initialize_embedding_cache(self):
+        """
+        Create the content-addressed embedding cache of the embedding model and wrap `self.embedding` in it.
+
+        Text embeddings of `self.embedding` read from and write to the cache, query embeddings bypass it, as query and
+        text embeddings differ for models with instructions. `EmbeddingBatcher` looks the cache up itself and is given
+        `self.uncached_embedding`, so texts are not looked up twice.
+        """
+        cls = BaseAIClient
+        if cls._embedding_memory_tier is None:
+            cls._embedding_memory_tier = MemoryTier(max_bytes=workmait_config.EMBEDDING_CACHE_MAX_BYTES)
+        if cls._embedding_persistent_tier is None and workmait_config.EMBEDDING_CACHE_PERSISTENT:
+            cls._embedding_persistent_tier = RedisTier(redis_client=RedisClient().redis, ttl_s=workmait_config.EMBEDDING_CACHE_TTL_S)
+
+        self.embedding_cache = EmbeddingCache(model_name=self.embedding.model_name,
+                                              dimensions=getattr(self.embedding, 'dimensions', None),
+                                              memory_tier=cls._embedding_memory_tier,
+                                              persistent_tier=cls._embedding_persistent_tier)
+        self.uncached_embedding = self.embedding
+        self.embedding = CachedEmbedding(self.uncached_embedding, self.embedding_cache)
+
 
 class OpenAIClient(BaseAIClient):
     def __init__(self, model_name=None, **kwargs):
@@ -50,12 +83,45 @@ class OpenAIClient(BaseAIClient):
             self.model_name = workmait_config.OPENAI_DEFAULT_MODEL
         self.initialize_llm()
         self.initialize_embedding()
+        self.initialize_embedding_cache()
 
     def initialize_llm(self):
-        self.llm = OpenAI(model=self.model_name, api_key=workmait_config.OPENAI_API_KEY, **self.llm_kwargs)
+        from llama_index.llms.openai import OpenAI
+
+        self.llm_rate_limiter = RateLimitController.for_model(self.model_name)
+        self.llm = OpenAI(model=self.model_name, **self._client_kwargs(OpenAI, lambda: self.llm_rate_limiter), **self.llm_kwargs)
 
     def initialize_embedding(self):
-        self.embedding = OpenAIEmbedding(api_key=workmait_config.OPENAI_API_KEY, **self.embedding_kwargs)
+        from llama_index.embeddings.openai import OpenAIEmbedding
+
+        # The embedding model is only known once the embedding is built, the response hooks look its controller up
+        self.embedding = OpenAIEmbedding(**self._client_kwargs(OpenAIEmbedding, lambda: self.embedding_rate_limiter), **self.embedding_kwargs)
+        self.embedding_rate_limiter = RateLimitController.for_model(self.embedding.model_name)
+
+    @staticmethod
+    def _client_kwargs(client_cls, rate_limiter: Callable[[], Optional[RateLimitController]]) -> Dict[str, Any]:
+        """
+        Credentials, retries and HTTP clients whose response hooks report rate limit headers to the controller.
+        Integration versions that cannot take an async HTTP client keep their own, 429s are still handled.
+        """
+        kwargs = {'api_key': workmait_config.OPENAI_API_KEY, 'max_retries': workmait_config.OPENAI_CLIENT_RETRIES}
+        if workmait_config.OPENAI_API_BASE:
+            kwargs['api_base'] = workmait_config.OPENAI_API_BASE
+
+        if 'async_http_client' in inspect.signature(client_cls.__init__).parameters:
+            import httpx
+
+            def on_response(response):
+                controller = rate_limiter()
+                if controller is not None:
+                    controller.on_response(response)
+
+            async def aon_response(response):
+                on_response(response)
+
+            kwargs['http_client'] = httpx.Client(event_hooks={'response': [on_response]})
+            kwargs['async_http_client'] = httpx.AsyncClient(event_hooks={'response': [aon_response]})
+        return kwargs
 
 
 class HFClient(BaseAIClient):
@@ -65,9 +131,24 @@ class HFClient(BaseAIClient):
             self.model_name = workmait_config.HF_EMBEDDING
         self.initialize_llm()
         self.initialize_embedding()
+        self.initialize_embedding_cache()
 
     def initialize_llm(self):
+        from llama_index.llms.huggingface import TextGenerationInference
+
         self.llm = TextGenerationInference(model_url=workmait_config.HF_TEXT_GEN_INF_URL, token=workmait_config.HF_TOKEN, **self.llm_kwargs)
 
     def initialize_embedding(self):
+        if workmait_config.HF_EMBEDDING_WORKERS > 0:
+            self.embedding = LocalEmbedding(model_name=self.model_name,
+                                            num_workers=workmait_config.HF_EMBEDDING_WORKERS,
+                                            max_length=workmait_config.HF_EMBEDDING_MAX_LENGTH,
+                                            max_batch_size=workmait_config.HF_EMBEDDING_MAX_BATCH_SIZE,
+                                            max_batch_tokens=workmait_config.HF_EMBEDDING_MAX_BATCH_TOKENS,
+                                            max_delay_s=workmait_config.HF_EMBEDDING_MAX_DELAY_MS / 1000,
+                                            **self.embedding_kwargs)
+            return
+
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
         self.embedding = HuggingFaceEmbedding(model_name=self.model_name, **self.embedding_kwargs)
@@ -0,0 +1,90 @@
+# app/clients/cached_embedding.py
+
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+
+from app.common import exceptions
+from app.common.llama import BaseEmbedding
+from app.common.embedding_cache import EmbeddingCache
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Embedding model that reads text embeddings from an `EmbeddingCache` and writes the ones it computes back, so
+    direct calls on an AI client's embedding share the cache with node ingestion. Only texts that miss the cache are
+    sent to the wrapped model, once per distinct text. Query embeddings are not cached, as query and text embeddings
+    differ for models with instructions.
+    """
+    dimensions: Optional[int] = Field(default=None, description="Dimensions of the wrapped model's vectors.")
+
+    _model: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, model: BaseEmbedding, cache: EmbeddingCache, **kwargs: Any):
+        super().__init__(model_name=model.model_name,
+                         embed_batch_size=model.embed_batch_size,
+                         callback_manager=model.callback_manager,
+                         dimensions=cache.dimensions,
+                         **kwargs)
+        self._model = model
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def model(self) -> BaseEmbedding:
+        """The wrapped model, for callers that look the cache up themselves."""
+        return self._model
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        return self._cache
+
+    # ---------------------------------------------------------------------------------------------------------- #
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        cached = self._cache.get_many(texts)
+        missing = self._missing(texts, cached)
+        computed = {}
+        if missing:
+            vectors = self._model.get_text_embedding_batch(missing)
+            computed = self._computed(missing, vectors)
+            self._cache.set_many(missing, vectors)
+        return [cached[i] if i in cached else computed[text] for i, text in enumerate(texts)]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        cached = await asyncio.to_thread(self._cache.get_many, texts)
+        missing = self._missing(texts, cached)
+        computed = {}
+        if missing:
+            vectors = await self._model.aget_text_embedding_batch(missing)
+            computed = self._computed(missing, vectors)
+            await asyncio.to_thread(self._cache.set_many, missing, vectors)
+        return [cached[i] if i in cached else computed[text] for i, text in enumerate(texts)]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._model.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._model.aget_query_embedding(query)
+
+    @staticmethod
+    def _missing(texts: List[str], cached: Dict[int, List[float]]) -> List[str]:
+        return list(dict.fromkeys(text for i, text in enumerate(texts) if i not in cached))
+
+    @staticmethod
+    def _computed(texts: List[str], vectors: List[List[float]]) -> Dict[str, List[float]]:
+        # Vectors are matched to texts by position, a short response must not cache shifted vectors
+        if len(vectors) != len(texts):
+            raise exceptions.EmbeddingException(f"EmbeddingException: Expected {len(texts)} vectors, got {len(vectors)}")
+        return dict(zip(texts, vectors))
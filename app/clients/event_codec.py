@@ -0,0 +1,84 @@
+import logging
+import threading
+from typing import Any, Dict
+
+import orjson
+from pydantic import BaseModel
+
+from app.config import workmait_config
+
+logger = logging.getLogger(__name__)
+
+
+class EventCodec:
+    """
+    Versioned binary envelope of the events written to Redis streams.
+
+    The whole payload is serialized with orjson into a single stream field, so nested models and dicts round-trip
+    and an entry costs one field instead of one per attribute. The field value starts with a version byte and a
+    flags byte, followed by the body, compressed with zstd when it is large enough and zstandard is installed.
+    Entries without the envelope field are decoded as flat UTF-8 fields, as events were written before.
+    """
+    FIELD: bytes = b'e'
+    VERSION: int = 1
+    FLAG_ZSTD: int = 0x01
+
+    _local = threading.local()
+    _zstd_missing_logged: bool = False
+
+    @classmethod
+    def encode(cls, payload: BaseModel) -> Dict[bytes, bytes]:
+        """Return the stream fields of an event payload."""
+        body = orjson.dumps(payload.model_dump())
+        flags = 0
+        if workmait_config.EVENT_COMPRESSION == 'zstd' and len(body) >= workmait_config.EVENT_COMPRESSION_MIN_BYTES:
+            compressor = cls._compressor()
+            if compressor is not None:
+                compressed = compressor.compress(body)
+                # Small or random bodies can grow, they are kept as they are
+                if len(compressed) < len(body):
+                    body, flags = compressed, flags | cls.FLAG_ZSTD
+        return {cls.FIELD: bytes((cls.VERSION, flags)) + body}
+
+    @classmethod
+    def decode(cls, event: Dict) -> Dict[str, Any]:
+        """Return the payload fields of a stream entry, whichever way it was written."""
+        envelope = event.get(cls.FIELD)
+        if envelope is None:
+            envelope = event.get(cls.FIELD.decode('utf-8'))
+        if envelope is None:
+            return {(k.decode('utf-8') if isinstance(k, bytes) else k): (v.decode('utf-8') if isinstance(v, bytes) else v)
+                    for k, v in event.items()}
+
+        version, flags = envelope[0], envelope[1]
+        if version != cls.VERSION:
+            raise ValueError(f"Unsupported event envelope version {version}")
+        body = memoryview(envelope)[2:]
+        if flags & cls.FLAG_ZSTD:
+            body = cls._decompressor().decompress(body)
+        return orjson.loads(body)
+
+    # ---------------------------------------------------------------------------------------------------------- #
+
+    @classmethod
+    def _compressor(cls):
+        # zstd contexts are not thread safe, every producing thread keeps its own
+        compressor = getattr(cls._local, 'compressor', None)
+        if compressor is None:
+            try:
+                import zstandard
+            except ImportError:
+                if not cls._zstd_missing_logged:
+                    logger.warning('zstandard is not installed, events are written uncompressed')
+                    cls._zstd_missing_logged = True
+                return None
+            compressor = cls._local.compressor = zstandard.ZstdCompressor(level=workmait_config.EVENT_ZSTD_LEVEL)
+        return compressor
+
+    @classmethod
+    def _decompressor(cls):
+        decompressor = getattr(cls._local, 'decompressor', None)
+        if decompressor is None:
+            import zstandard
+            decompressor = cls._local.decompressor = zstandard.ZstdDecompressor()
+        return decompressor
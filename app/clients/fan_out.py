@@ -0,0 +1,108 @@
+import json
+import logging
+from typing import Iterable, List, Optional
+
+from app.clients.redis import RedisClient
+from app.config import workmait_config
+
+logger = logging.getLogger(__name__)
+
+
+class FanOutTracker:
+    """
+    Redis-backed completion tracking of events split into sub-events.
+
+    A parent has a hash holding its number of children and a set of the children that completed. Completions are
+    set members rather than a plain counter, so a child that is redelivered and runs again is only counted once.
+    Children that completed without adding all their files, or that were given up on, record the failed files in a
+    hash keyed by child, which the latest run of a child overwrites. The parent ID is a hash tag in every key, which
+    keeps the keys of a parent on one cluster slot.
+
+    The child that completes the parent takes a lease on reporting it, held until the parent is forgotten. The lease
+    expires before the entries of a dead holder are claimed, which the configuration checks, so if its holder dies
+    before reporting, the retry of a child reports the completion instead. A holder
+    that dies after reporting but before forgetting the parent gets the completion reported twice.
+    """
+    KEY_PREFIX: str = 'fanout'
+
+    @staticmethod
+    def _redis():
+        return RedisClient().redis
+
+    @classmethod
+    def meta_key(cls, parent_id: str) -> str:
+        """Return the key of the hash holding the number of children of the parent."""
+        return f"{cls.KEY_PREFIX}:{{{parent_id}}}:meta"
+
+    @classmethod
+    def done_key(cls, parent_id: str) -> str:
+        """Return the key of the set of completed children of the parent."""
+        return f"{cls.KEY_PREFIX}:{{{parent_id}}}:done"
+
+    @classmethod
+    def failed_key(cls, parent_id: str) -> str:
+        """Return the key of the hash of the files each failed child did not add."""
+        return f"{cls.KEY_PREFIX}:{{{parent_id}}}:failed"
+
+    @classmethod
+    def claim_key(cls, parent_id: str) -> str:
+        """Return the key of the lease on reporting the completion of the parent."""
+        return f"{cls.KEY_PREFIX}:{{{parent_id}}}:claim"
+
+    @classmethod
+    def start(cls, parent_id: str, children: int, ttl_s: Optional[int] = None) -> None:
+        """Record the number of children of a parent, before any of them is published."""
+        ttl_s = ttl_s or workmait_config.FAN_OUT_TTL_S
+        pipe = cls._redis().pipeline(transaction=True)
+        pipe.hset(cls.meta_key(parent_id), 'children', children)
+        pipe.expire(cls.meta_key(parent_id), ttl_s)
+        pipe.execute()
+
+    @classmethod
+    def complete(cls,
+                 parent_id: str,
+                 child_id: str,
+                 failed_file_ids: Iterable[str] = (),
+                 ttl_s: Optional[int] = None) -> Optional[int]:
+        """
+        Record a completed child, along with the files it did not add. Returns the number of children when this call
+        completed the parent and took the lease on reporting it, and None otherwise.
+        """
+        ttl_s = ttl_s or workmait_config.FAN_OUT_TTL_S
+        failed_file_ids = list(failed_file_ids)
+        pipe = cls._redis().pipeline(transaction=True)
+        pipe.sadd(cls.done_key(parent_id), child_id)
+        # A child that failed before and succeeded when retried no longer counts as failed
+        if failed_file_ids:
+            pipe.hset(cls.failed_key(parent_id), child_id, json.dumps(failed_file_ids))
+        else:
+            pipe.hdel(cls.failed_key(parent_id), child_id)
+        pipe.expire(cls.failed_key(parent_id), ttl_s)
+        pipe.expire(cls.done_key(parent_id), ttl_s)
+        pipe.expire(cls.meta_key(parent_id), ttl_s)
+        pipe.scard(cls.done_key(parent_id))
+        pipe.hget(cls.meta_key(parent_id), 'children')
+        *_, done, children = pipe.execute()
+
+        # Children of a parent that already completed and was forgotten have nothing to report
+        if children is None or done < int(children):
+            return None
+        if not cls._redis().set(cls.claim_key(parent_id), child_id, nx=True, ex=workmait_config.FAN_OUT_CLAIM_TTL_S):
+            return None
+        return int(children)
+
+    @classmethod
+    def failed_file_ids(cls, parent_id: str) -> List[str]:
+        """Return the files the children of a parent did not add, once each."""
+        failed = cls._redis().hvals(cls.failed_key(parent_id))
+        return sorted({file_id for file_ids in failed for file_id in json.loads(file_ids)})
+
+    @classmethod
+    def reopen(cls, parent_id: str) -> None:
+        """Drop the lease taken by `complete`, so the next completion of a child reports it again."""
+        cls._redis().delete(cls.claim_key(parent_id))
+
+    @classmethod
+    def forget(cls, parent_id: str) -> None:
+        """Drop the tracking state of a completed parent."""
+        cls._redis().delete(cls.meta_key(parent_id), cls.done_key(parent_id), cls.failed_key(parent_id), cls.claim_key(parent_id))
@@ -1,7 +1,3 @@
-# Boto3
-import boto3
-import s3fs
-
 # Import configuration
 from app.config import workmait_config
 
@@ -28,7 +24,10 @@ class S3Client(RemoteFileServiceClient):
 
     @classmethod
     def initialize(cls):
-        """Initialize the S3 client connections."""
+        """Initialize the S3 client connections. boto3 and s3fs are slow to import, so they load on first use."""
+        import boto3
+        import s3fs
+
         # Initialize boto3 resource
         if cls._resource_instance is None:
             cls._resource_instance = boto3.resource(
@@ -0,0 +1,248 @@
+import os
+import mmap
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from app.clients.file_clients import S3Client
+from app.common.metrics import MetricsRegistry
+from app.config import workmait_config
+
+logger = logging.getLogger(__name__)
+
+
+class FileSpool:
+    """
+    Stages remote files on local disk so each object is downloaded once and parsers read a local path.
+
+    Downloads stream into a spool file and are renamed into place when complete. Objects above the range threshold
+    are fetched as concurrent ranged GETs. The spool doubles as a size-bounded cache keyed by path and ETag: a file
+    whose ETag has not changed is served from disk, least recently used files are evicted first, and files pinned by
+    a running payload are never evicted. An object validated against S3 within FILE_SPOOL_VALIDATE_TTL_S is served
+    without a new HEAD.
+    """
+    _executor: ThreadPoolExecutor = None
+    _lock = threading.Lock()
+    _inflight: Dict[Path, Future] = {}
+    _pinned: Dict[Path, int] = {}
+    # Last validation of each remote path against S3, and the spool file it mapped to
+    _validated: Dict[str, Tuple[float, Path]] = {}
+
+    # Read size when streaming small objects
+    STREAM_CHUNK_BYTES: int = 1024 * 1024
+
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        """Return the shared download executor, creating it if needed."""
+        with cls._lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(max_workers=workmait_config.FILE_SPOOL_CONCURRENCY, thread_name_prefix='file-spool')
+            return cls._executor
+
+    @staticmethod
+    def remote_path(file_key: str, bucket_name: Optional[str] = None) -> str:
+        """Return the s3:// path of a file key."""
+        return f"s3://{bucket_name or workmait_config.FILE_SERVICE_BUCKET}/{file_key}"
+
+    @classmethod
+    def stage(cls, file_key: str, bucket_name: Optional[str] = None, pin: bool = False) -> Path:
+        """
+        Return a local path holding the current version of the object, downloading it if it is not cached. With
+        `pin`, the file is pinned before anything is evicted, and the caller unpins it once done.
+        """
+        remote_path = cls.remote_path(file_key, bucket_name)
+        local_path = cls._recently_validated(remote_path)
+        if local_path is not None and cls._hit(local_path, pin):
+            return local_path
+
+        info = S3Client.get_filesystem().info(remote_path)
+        local_path = cls._local_path(remote_path, etag=str(info.get('ETag', '')).strip('"'))
+        if local_path.exists() and local_path.stat().st_size == info['size'] and cls._hit(local_path, pin):
+            with cls._lock:
+                cls._validated[remote_path] = (time.monotonic(), local_path)
+            return local_path
+
+        with cls._lock:
+            future = cls._inflight.get(local_path)
+            owner = future is None
+            if owner:
+                future = Future()
+                cls._inflight[local_path] = future
+
+        if not owner:
+            # Another thread is already downloading this object
+            local_path = future.result()
+            if pin:
+                cls.pin([local_path])
+            return local_path
+
+        try:
+            MetricsRegistry.increment('file_spool.misses')
+            cls._download(remote_path, local_path, size=info['size'])
+            if pin:
+                cls.pin([local_path])
+            with cls._lock:
+                cls._validated[remote_path] = (time.monotonic(), local_path)
+            future.set_result(local_path)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with cls._lock:
+                cls._inflight.pop(local_path, None)
+
+        cls.evict()
+        return local_path
+
+    @classmethod
+    def prefetch(cls, file_keys: List[str], bucket_name: Optional[str] = None, pin: bool = False) -> Dict[str, Union[Path, Exception]]:
+        """
+        Stage several files concurrently. Returns the local path, or the error, of each file key. With `pin`, every
+        staged file is pinned as soon as it is available, so staging the rest of the batch never evicts it.
+        """
+        executor = cls.get_executor()
+        futures = {file_key: executor.submit(cls.stage, file_key, bucket_name, pin) for file_key in dict.fromkeys(file_keys)}
+        staged = {}
+        for file_key, future in futures.items():
+            try:
+                staged[file_key] = future.result()
+            except Exception as e:
+                logger.error(f"Failed to stage file '{file_key}': {e}")
+                staged[file_key] = e
+        return staged
+
+    @classmethod
+    @contextmanager
+    def staged(cls, file_keys: List[str], bucket_name: Optional[str] = None) -> Iterator[Dict[str, Union[Path, Exception]]]:
+        """
+        Prefetch the files and keep them pinned in the spool for the duration of the block.
+        """
+        staged = cls.prefetch(file_keys, bucket_name, pin=True)
+        paths = [path for path in staged.values() if isinstance(path, Path)]
+        try:
+            yield staged
+        finally:
+            cls.unpin(paths)
+
+    @classmethod
+    def pin(cls, paths: List[Path]) -> None:
+        """Protect staged files from eviction until they are unpinned."""
+        with cls._lock:
+            for path in paths:
+                cls._pinned[path] = cls._pinned.get(path, 0) + 1
+
+    @classmethod
+    def unpin(cls, paths: List[Path]) -> None:
+        """Allow pinned files to be evicted again."""
+        with cls._lock:
+            for path in paths:
+                cls._pinned[path] -= 1
+                if not cls._pinned[path]:
+                    del cls._pinned[path]
+
+    @staticmethod
+    def open_buffer(local_path: Path) -> mmap.mmap:
+        """Memory-map a staged file for parsers that read from a buffer."""
+        with open(local_path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def evict(cls) -> None:
+        """Delete least recently used files until the spool fits its size budget."""
+        spool_dir = Path(workmait_config.FILE_SPOOL_DIR)
+        files = [(path, path.stat()) for path in spool_dir.glob('*') if path.is_file() and not path.name.endswith('.part')]
+        total = sum(stat.st_size for _, stat in files)
+        if total <= workmait_config.FILE_SPOOL_MAX_BYTES:
+            return
+
+        with cls._lock:
+            pinned: Set[Path] = set(cls._pinned)
+        evicted: Set[Path] = set()
+        for path, stat in sorted(files, key=lambda item: item[1].st_atime):
+            if total <= workmait_config.FILE_SPOOL_MAX_BYTES:
+                break
+            if path in pinned:
+                continue
+            try:
+                path.unlink()
+                total -= stat.st_size
+                evicted.add(path)
+                MetricsRegistry.increment('file_spool.evictions')
+            except FileNotFoundError:
+                continue
+
+        with cls._lock:
+            cls._validated = {remote_path: validated for remote_path, validated in cls._validated.items() if validated[1] not in evicted}
+
+    @classmethod
+    def _recently_validated(cls, remote_path: str) -> Optional[Path]:
+        """Return the spool file of an object validated against S3 within the TTL."""
+        with cls._lock:
+            validated = cls._validated.get(remote_path)
+        if validated is None or time.monotonic() - validated[0] > workmait_config.FILE_SPOOL_VALIDATE_TTL_S:
+            return None
+        return validated[1]
+
+    @classmethod
+    def _hit(cls, local_path: Path, pin: bool) -> bool:
+        """Serve a cached spool file, pinning it first if asked. Returns False if it was evicted meanwhile."""
+        if pin:
+            cls.pin([local_path])
+        try:
+            # Refresh the access time used for LRU eviction
+            os.utime(local_path)
+        except FileNotFoundError:
+            if pin:
+                cls.unpin([local_path])
+            return False
+        MetricsRegistry.increment('file_spool.hits')
+        return True
+
+    @staticmethod
+    def _local_path(remote_path: str, etag: str) -> Path:
+        """Map a remote object version to its spool file, keeping the extension so readers detect the type."""
+        spool_dir = Path(workmait_config.FILE_SPOOL_DIR)
+        spool_dir.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256(f"{remote_path}\x00{etag}".encode('utf-8')).hexdigest()
+        return spool_dir / f"{digest}{Path(remote_path).suffix}"
+
+    @classmethod
+    def _download(cls, remote_path: str, local_path: Path, size: int) -> None:
+        """Download an object into a spool file and move it into place once complete."""
+        part_path = local_path.with_name(local_path.name + '.part')
+        fs = S3Client.get_filesystem()
+        try:
+            if size >= workmait_config.FILE_SPOOL_RANGE_THRESHOLD:
+                cls._download_ranges(fs, remote_path, part_path, size)
+            else:
+                with fs.open(remote_path, 'rb') as src, open(part_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, cls.STREAM_CHUNK_BYTES)
+            os.replace(part_path, local_path)
+            MetricsRegistry.increment('file_spool.bytes_downloaded', size)
+        finally:
+            part_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _download_ranges(fs, remote_path: str, part_path: Path, size: int) -> None:
+        """Fetch a large object as concurrent ranged GETs written at their offsets."""
+        part_size = workmait_config.FILE_SPOOL_RANGE_PART_BYTES
+        with open(part_path, 'wb') as f:
+            f.truncate(size)
+
+        fd = os.open(part_path, os.O_WRONLY)
+        try:
+            def fetch(start: int) -> None:
+                data = fs.cat_file(remote_path, start=start, end=min(start + part_size, size))
+                os.pwrite(fd, data, start)
+
+            # Ranged parts use their own pool so they never wait behind whole-file prefetches
+            with ThreadPoolExecutor(max_workers=workmait_config.FILE_SPOOL_CONCURRENCY, thread_name_prefix='file-spool-range') as executor:
+                list(executor.map(fetch, range(0, size, part_size)))
+        finally:
+            os.close(fd)
@@ -0,0 +1,155 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Sequence
+
+import neo4j
+
+from app.common.metrics import MetricsRegistry
+from app.config import workmait_config
+
+
+class NamespaceGraphStore:
+    """
+    Graph store of one namespace. Runs over the driver shared by every namespace, selecting the namespace's database
+    for each session, so a namespace costs no connections of its own.
+
+    Writes are batched `UNWIND ... MERGE` statements in one transaction per call. The store remembers the entities it
+    has merged along with a hash of their labels and properties, so entities mentioned again unchanged by later chunks
+    skip their MERGE. Mentions and relations MERGE their entities by ID rather than MATCH them, so an entity deleted
+    by another replica while it is remembered here is recreated instead of silently losing its edges.
+    """
+
+    # Graph layout shared with llama's property graph store. Chunk nodes have the node ID as their `id`, entities
+    # their name, chunks MENTION the entities extracted from them and relations carry the ID of their source chunk
+    CHUNK_LABEL: str = 'Chunk'
+    ENTITY_LABEL: str = '__Entity__'
+    MENTIONS: str = 'MENTIONS'
+    TRIPLET_SOURCE_KEY: str = 'triplet_source_id'
+
+    def __init__(self, driver: neo4j.Driver, database: str):
+        self.driver = driver
+        self.database = database
+        self._merged_entities: 'OrderedDict[str, str]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def session(self, **kwargs: Any) -> neo4j.Session:
+        """Open a session on the namespace's database."""
+        return self.driver.session(database=self.database, **kwargs)
+
+    def read(self, query: str, **params: Any) -> List[Dict[str, Any]]:
+        """Run a read query in a managed transaction and return its records."""
+        with self.session() as session:
+            return session.execute_read(self._run, query, params)
+
+    def write(self, query: str, **params: Any) -> List[Dict[str, Any]]:
+        """Run a write query in a managed transaction and return its records."""
+        with self.session() as session:
+            return session.execute_write(self._run, query, params)
+
+    def ensure_schema(self) -> None:
+        """Create the uniqueness constraints that back every MERGE on `id`, once per store."""
+        if self._schema_ready:
+            return
+        with self.session() as session:
+            for label in (self.CHUNK_LABEL, self.ENTITY_LABEL):
+                session.run(f"CREATE CONSTRAINT IF NOT EXISTS FOR (n:`{label}`) REQUIRE n.id IS UNIQUE").consume()
+        self._schema_ready = True
+
+    def upsert(self,
+               chunks: List[Dict[str, Any]],
+               entities: List[Dict[str, Any]],
+               mentions: List[Dict[str, Any]],
+               relations: List[Dict[str, Any]]) -> None:
+        """
+        Merge chunks, entities, the chunks' mentions of entities and the relations between entities.
+
+        Node rows have an `id`, `labels` and `properties`, mention rows a `chunk_id` and an `entity_id`, and relation
+        rows a `type`, `source_id`, `target_id` and `properties`.
+        """
+        self.ensure_schema()
+        unique_entities = {row['id']: row for row in entities}
+        signatures = {entity_id: self._signature(row) for entity_id, row in unique_entities.items()}
+        with self._lock:
+            new_entities = [row for entity_id, row in unique_entities.items()
+                            if self._merged_entities.get(entity_id) != signatures[entity_id]]
+        MetricsRegistry.increment('graph_store.entity_cache.hits', len(unique_entities) - len(new_entities))
+        MetricsRegistry.increment('graph_store.entity_cache.misses', len(new_entities))
+
+        started = time.perf_counter()
+        with self.session() as session:
+            session.execute_write(self._write, chunks, new_entities, mentions, relations)
+        MetricsRegistry.observe('graph_store.write_seconds', time.perf_counter() - started)
+
+        # Only remembered once the transaction has committed
+        self._remember({row['id']: signatures[row['id']] for row in new_entities})
+
+    def close(self) -> None:
+        """Release the store. The driver is shared and stays open."""
+        with self._lock:
+            self._merged_entities.clear()
+
+    # ---------------------------------------------------------------------------------------------------------- #
+
+    def _remember(self, signatures: Dict[str, str]) -> None:
+        max_size = workmait_config.GRAPH_ENTITY_CACHE_SIZE
+        with self._lock:
+            for entity_id, signature in signatures.items():
+                self._merged_entities[entity_id] = signature
+                self._merged_entities.move_to_end(entity_id)
+            while len(self._merged_entities) > max_size:
+                self._merged_entities.popitem(last=False)
+
+    @staticmethod
+    def _signature(row: Dict[str, Any]) -> str:
+        """Hash of what a MERGE of the entity row writes, so changed entities are written again."""
+        data = json.dumps([sorted(row.get('labels') or ()), row.get('properties') or {}], sort_keys=True, default=str)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _run(tx, query: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return tx.run(query, **params).data()
+
+    @staticmethod
+    def _labels(labels: Sequence[str]) -> str:
+        """Format labels for a Cypher pattern, escaping backticks."""
+        return ''.join(f":`{label.replace('`', '``')}`" for label in labels)
+
+    @staticmethod
+    def _batches(rows: List[Dict[str, Any]]) -> Iterable[List[Dict[str, Any]]]:
+        batch_size = workmait_config.GRAPH_WRITE_BATCH_SIZE
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+
+    @classmethod
+    def _write(cls, tx, chunks: List[Dict], entities: List[Dict], mentions: List[Dict], relations: List[Dict]) -> None:
+        chunk, entity = cls.CHUNK_LABEL, cls.ENTITY_LABEL
+
+        # Labels and relationship types cannot be parameters, so rows are written in groups sharing them
+        for key_label, rows in ((chunk, chunks), (entity, entities)):
+            groups: Dict[tuple, List[Dict]] = {}
+            for row in rows:
+                groups.setdefault(tuple(sorted(row.get('labels') or ())), []).append({'id': row['id'], 'properties': row['properties']})
+            for labels, group in groups.items():
+                query = (f"UNWIND $rows AS row MERGE (n:`{key_label}` {{id: row.id}}) "
+                         f"SET n += row.properties SET n{cls._labels(labels)}" if labels else
+                         f"UNWIND $rows AS row MERGE (n:`{key_label}` {{id: row.id}}) SET n += row.properties")
+                for batch in cls._batches(group):
+                    tx.run(query, rows=batch).consume()
+
+        query = (f"UNWIND $rows AS row MATCH (c:`{chunk}` {{id: row.chunk_id}}) MERGE (e:`{entity}` {{id: row.entity_id}}) "
+                 f"MERGE (c)-[:`{cls.MENTIONS}`]->(e)")
+        for batch in cls._batches(mentions):
+            tx.run(query, rows=batch).consume()
+
+        relation_groups: Dict[str, List[Dict]] = {}
+        for row in relations:
+            relation_groups.setdefault(row['type'], []).append(row)
+        for relation_type, group in relation_groups.items():
+            query = (f"UNWIND $rows AS row MERGE (a:`{entity}` {{id: row.source_id}}) MERGE (b:`{entity}` {{id: row.target_id}}) "
+                     f"MERGE (a)-[r{cls._labels([relation_type])}]->(b) SET r += row.properties")
+            for batch in cls._batches(group):
+                tx.run(query, rows=batch).consume()
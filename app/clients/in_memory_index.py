@@ -0,0 +1,85 @@
+import time
+import random
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+
+@dataclass
+class Vector:
+    id: str
+    values: List[float]
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class UpsertResponse:
+    upserted_count: int
+
+
+@dataclass
+class FetchResponse:
+    namespace: str
+    vectors: Dict[str, Vector]
+
+
+class InMemoryIndex:
+    """
+    In-memory stand-in for `Pinecone.Index`, used to benchmark the store code paths offline.
+
+    Implements the subset of the index API the clients use, with response objects shaped like Pinecone's. Every
+    request can be given a simulated latency and a failure rate to exercise concurrency and retries.
+    """
+
+    def __init__(self, latency_s: float = 0.0, failure_rate: float = 0.0, list_page_size: int = 100):
+        self.latency_s = latency_s
+        self.failure_rate = failure_rate
+        self.list_page_size = list_page_size
+        self.requests = 0
+        self._namespaces: Dict[str, Dict[str, Vector]] = {}
+        self._lock = threading.Lock()
+
+    def _request(self) -> None:
+        with self._lock:
+            self.requests += 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise ConnectionError("Simulated Pinecone request failure")
+
+    def upsert(self, vectors: List[Dict[str, Any]], namespace: str = '', **kwargs) -> UpsertResponse:
+        self._request()
+        with self._lock:
+            store = self._namespaces.setdefault(namespace, {})
+            for vector in vectors:
+                store[vector['id']] = Vector(id=vector['id'], values=list(vector['values']), metadata=dict(vector.get('metadata') or {}))
+        return UpsertResponse(upserted_count=len(vectors))
+
+    def fetch(self, ids: List[str], namespace: str = '', **kwargs) -> FetchResponse:
+        self._request()
+        with self._lock:
+            store = self._namespaces.get(namespace, {})
+            return FetchResponse(namespace=namespace, vectors={i: store[i] for i in ids if i in store})
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False, namespace: str = '', **kwargs) -> Dict:
+        self._request()
+        with self._lock:
+            if delete_all:
+                self._namespaces.pop(namespace, None)
+            else:
+                store = self._namespaces.get(namespace, {})
+                for i in ids or []:
+                    store.pop(i, None)
+        return {}
+
+    def list(self, prefix: str = '', namespace: str = '', **kwargs) -> Iterator[List[str]]:
+        with self._lock:
+            ids = sorted(i for i in self._namespaces.get(namespace, {}) if i.startswith(prefix))
+        for start in range(0, len(ids), self.list_page_size):
+            self._request()
+            yield ids[start:start + self.list_page_size]
+
+    def describe_index_stats(self, **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            namespaces = {name: {'vector_count': len(store)} for name, store in self._namespaces.items()}
+        return {'namespaces': namespaces, 'total_vector_count': sum(n['vector_count'] for n in namespaces.values())}
@@ -0,0 +1,392 @@
+# app/clients/local_embedding.py
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Deque, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+
+from app.common.llama import BaseEmbedding
+from app.common.metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+
+# --------------------------------------------------------------------------------------------------------------- #
+# Worker side. Everything below runs inside the engine's processes and must stay importable at module level.
+
+_worker_model = None
+
+
+def _load_worker_model(model_name: str, max_length: int, device: str, num_threads: int) -> None:
+    """Load the model once per worker. Threads are split between workers so they do not oversubscribe the CPU."""
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(num_threads)
+    _worker_model = SentenceTransformer(model_name, device=device)
+    _worker_model.max_seq_length = max_length
+
+
+def _embed_batch(texts: List[str], normalize: bool) -> np.ndarray:
+    """Embed one bucket of texts as a contiguous float32 array."""
+    vectors = _worker_model.encode(texts,
+                                   batch_size=len(texts),
+                                   normalize_embeddings=normalize,
+                                   convert_to_numpy=True,
+                                   show_progress_bar=False)
+    return np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+# --------------------------------------------------------------------------------------------------------------- #
+# Caller side.
+
+
+@dataclass
+class _Request:
+    """Texts submitted together, resolved once every one of them has been embedded."""
+    texts: List[str]
+    lengths: List[int]
+    future: Future
+    enqueued: float
+    remaining: int
+    vectors: Optional[np.ndarray] = None
+
+
+class LocalEmbeddingEngine:
+    """
+    Runs a local sentence embedding model in a pool of worker processes.
+
+    Submitted texts are queued and dispatched together once there are enough to fill every free worker, or when the
+    oldest one has waited `max_delay_s`. Queued texts are sorted by token length and cut into buckets bounded by
+    item count and by padded tokens, so texts of similar length are batched together and little compute is spent on
+    padding. At most one bucket per worker is in flight: while every worker is busy, texts keep accumulating and
+    are bucketed again with the ones that arrive meanwhile. Each request resolves to a contiguous float32 array.
+
+    A worker that dies breaks the whole pool. The pool is then replaced and each bucket it held runs once more.
+    """
+
+    def __init__(self,
+                 model_name: str,
+                 num_workers: int,
+                 max_length: int = 512,
+                 max_batch_size: int = 32,
+                 max_batch_tokens: int = 8192,
+                 max_delay_s: float = 0.005,
+                 normalize: bool = True,
+                 device: str = 'cpu'):
+        self.model_name = model_name
+        self.num_workers = num_workers
+        self.max_length = max_length
+        self.max_batch_size = max_batch_size
+        # A single input always fits, whatever its length
+        self.max_batch_tokens = max(max_batch_tokens, max_length)
+        self.max_delay_s = max_delay_s
+        self.normalize = normalize
+        self.device = device
+        self.dimensions: Optional[int] = None
+
+        # Queued texts, as their request and index, in arrival order
+        self._queue: Deque[Tuple[_Request, int]] = deque()
+        # Buckets submitted to the workers and not finished yet
+        self._outstanding = 0
+        self._condition = threading.Condition()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._dispatcher: Optional[threading.Thread] = None
+        self._tokenizer = None
+        # Fast tokenizers cannot be used by several threads at once
+        self._tokenizer_lock = threading.Lock()
+
+    def submit(self, texts: Sequence[str]) -> Future:
+        """Queue texts for embedding. The future resolves to an array with one row per text."""
+        future: Future = Future()
+        if not texts:
+            future.set_result(np.empty((0, self.dimensions or 0), dtype=np.float32))
+            return future
+
+        request = _Request(texts=list(texts),
+                           lengths=self.token_lengths(texts),
+                           future=future,
+                           enqueued=time.monotonic(),
+                           remaining=len(texts))
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Local embedding engine is closed")
+            self._start()
+            self._queue.extend((request, i) for i in range(len(texts)))
+            self._condition.notify()
+        return future
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Embed texts, blocking until every one is done."""
+        return self.submit(texts).result()
+
+    async def aembed(self, texts: Sequence[str]) -> np.ndarray:
+        """Embed texts without blocking the event loop, tokenization included."""
+        future = await asyncio.to_thread(self.submit, texts)
+        return await asyncio.wrap_future(future)
+
+    def token_lengths(self, texts: Sequence[str]) -> List[int]:
+        """Count the tokens of each text as the model sees them, truncated to `max_length`."""
+        with self._tokenizer_lock:
+            encoded = self._get_tokenizer()(list(texts), add_special_tokens=True, truncation=True, max_length=self.max_length)
+        return [len(ids) for ids in encoded['input_ids']]
+
+    def plan_buckets(self, lengths: Sequence[int]) -> List[List[int]]:
+        """
+        Group indices into buckets of similar length. A bucket costs its item count times its longest input, since
+        every input is padded to the longest one.
+        """
+        buckets: List[List[int]] = []
+        current: List[int] = []
+        for i in sorted(range(len(lengths)), key=lengths.__getitem__):
+            # Indices are sorted by length, so the new input is the longest of the bucket
+            if current and (len(current) >= self.max_batch_size or (len(current) + 1) * lengths[i] > self.max_batch_tokens):
+                buckets.append(current)
+                current = []
+            current.append(i)
+        if current:
+            buckets.append(current)
+        return buckets
+
+    def close(self) -> None:
+        """Embed what is already queued, then stop the dispatcher and the workers."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+        with self._condition:
+            # Buckets lost to a dead worker may still be running again on a new pool
+            while self._outstanding:
+                self._condition.wait()
+            executor = self._executor
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    # ---------------------------------------------------------------------------------------------------------- #
+
+    def _get_tokenizer(self):
+        # Called with the tokenizer lock held
+        if self._tokenizer is None:
+            from transformers import AutoTokenizer
+            self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        return self._tokenizer
+
+    def _start(self) -> None:
+        # Called with the condition held
+        if self._executor is None:
+            self._executor = self._create_executor()
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name='local-embedding-dispatcher', daemon=True)
+            self._dispatcher.start()
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # Spawned workers do not inherit the event loop, sockets or locks of this process
+        num_threads = max(1, (os.cpu_count() or 1) // self.num_workers)
+        return ProcessPoolExecutor(max_workers=self.num_workers,
+                                   mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_load_worker_model,
+                                   initargs=(self.model_name, self.max_length, self.device, num_threads))
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self._condition:
+                # While every worker is busy, texts keep accumulating in the queue
+                while (not self._queue and not self._closed) or (self._queue and self._outstanding >= self.num_workers):
+                    self._condition.wait()
+                if not self._queue:
+                    return
+
+                # Wait for enough texts to fill every free worker, at most until the oldest text's deadline
+                deadline = self._queue[0][0].enqueued + self.max_delay_s
+                while len(self._queue) < self.max_batch_size * (self.num_workers - self._outstanding) and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                buckets = self._take_buckets(self.num_workers - self._outstanding)
+                self._outstanding += len(buckets)
+                MetricsRegistry.set_gauge('local_embedding.outstanding_buckets', self._outstanding)
+
+            for targets in buckets:
+                self._submit(targets)
+
+    def _take_buckets(self, count: int) -> List[List[Tuple[_Request, int]]]:
+        """
+        Bucket every queued text and take the `count` buckets holding the oldest texts. The other texts stay queued.
+        Called with the condition held.
+        """
+        items = list(self._queue)
+        lengths = [request.lengths[i] for request, i in items]
+        # The queue is in arrival order, so the smallest position of a bucket is its oldest text
+        buckets = sorted(self.plan_buckets(lengths), key=min)[:count]
+        taken = {j for bucket in buckets for j in bucket}
+        self._queue = deque(item for j, item in enumerate(items) if j not in taken)
+
+        now = time.monotonic()
+        for bucket in buckets:
+            bucket_lengths = [lengths[j] for j in bucket]
+            MetricsRegistry.observe('local_embedding.queue_seconds', now - items[min(bucket)][0].enqueued)
+            MetricsRegistry.observe('local_embedding.batch_items', len(bucket))
+            MetricsRegistry.observe('local_embedding.batch_padding_ratio', 1 - sum(bucket_lengths) / (len(bucket) * max(bucket_lengths)))
+        return [[items[j] for j in bucket] for bucket in buckets]
+
+    def _submit(self, targets: List[Tuple[_Request, int]], attempt: int = 0) -> None:
+        with self._condition:
+            executor = self._executor
+        try:
+            future = executor.submit(_embed_batch, [request.texts[i] for request, i in targets], self.normalize)
+        except BrokenProcessPool as e:
+            self._restart(executor, targets, attempt, e)
+            return
+        except Exception as e:
+            logger.error(f"Error dispatching bucket of {len(targets)} texts: {e}")
+            self._release(targets, e)
+            return
+        future.add_done_callback(partial(self._scatter, executor, targets, attempt, time.perf_counter()))
+
+    def _scatter(self, executor: ProcessPoolExecutor, targets: List[Tuple[_Request, int]], attempt: int, started: float, future: Future) -> None:
+        """Copy the rows of a finished bucket into the arrays of their requests."""
+        try:
+            vectors = future.result()
+        except BrokenProcessPool as e:
+            self._restart(executor, targets, attempt, e)
+            return
+        except Exception as e:
+            logger.error(f"Error embedding bucket of {len(targets)} texts: {e}")
+            self._release(targets, e)
+            return
+        MetricsRegistry.observe('local_embedding.batch_seconds', time.perf_counter() - started)
+
+        with self._lock:
+            self.dimensions = vectors.shape[1]
+            for row, (request, i) in enumerate(targets):
+                if request.future.done():
+                    continue
+                if request.vectors is None:
+                    request.vectors = np.empty((len(request.texts), vectors.shape[1]), dtype=np.float32)
+                request.vectors[i] = vectors[row]
+                request.remaining -= 1
+                if request.remaining == 0:
+                    request.future.set_result(request.vectors)
+        self._release()
+
+    def _restart(self, executor: ProcessPoolExecutor, targets: List[Tuple[_Request, int]], attempt: int, error: Exception) -> None:
+        """Replace a pool broken by a dead worker, and run the bucket once more on the new pool."""
+        with self._condition:
+            # Every bucket of the broken pool ends up here, only the first one replaces it
+            if self._executor is executor:
+                logger.warning(f"Local embedding workers died, restarting them: {error}")
+                MetricsRegistry.increment('local_embedding.restarts')
+                executor.shutdown(wait=False)
+                self._executor = self._create_executor()
+        if attempt > 0:
+            logger.error(f"Error embedding bucket of {len(targets)} texts, the workers died running it twice: {error}")
+            self._release(targets, error)
+            return
+        self._submit(targets, attempt + 1)
+
+    def _release(self, targets: Optional[List[Tuple[_Request, int]]] = None, error: Optional[Exception] = None) -> None:
+        """Free the worker slot of a finished bucket, failing the requests of its texts if it failed."""
+        if error is not None:
+            with self._lock:
+                for request, _ in targets:
+                    if not request.future.done():
+                        request.future.set_exception(error)
+        with self._condition:
+            self._outstanding -= 1
+            MetricsRegistry.set_gauge('local_embedding.outstanding_buckets', self._outstanding)
+            self._condition.notify_all()
+
+
+class LocalEmbedding(BaseEmbedding):
+    """
+    Embedding model served by a `LocalEmbeddingEngine`, a drop-in replacement for `HuggingFaceEmbedding` that keeps
+    inference off the calling thread and spreads it over several processes.
+    """
+    max_length: int = Field(description="Maximum number of tokens per input, longer inputs are truncated.")
+    query_instruction: Optional[str] = Field(default=None, description="Instruction prepended to queries.")
+    text_instruction: Optional[str] = Field(default=None, description="Instruction prepended to texts.")
+
+    _engine: LocalEmbeddingEngine = PrivateAttr()
+
+    def __init__(self,
+                 model_name: str,
+                 num_workers: int,
+                 max_length: int = 512,
+                 max_batch_size: int = 32,
+                 max_batch_tokens: int = 8192,
+                 max_delay_s: float = 0.005,
+                 normalize: bool = True,
+                 device: str = 'cpu',
+                 **kwargs: Any):
+        # Requests are large enough to give every worker a full batch, the engine splits them
+        kwargs.setdefault('embed_batch_size', min(max_batch_size * num_workers, 2048))
+        super().__init__(model_name=model_name, max_length=max_length, **kwargs)
+        self._engine = LocalEmbeddingEngine(model_name=model_name,
+                                            num_workers=num_workers,
+                                            max_length=max_length,
+                                            max_batch_size=max_batch_size,
+                                            max_batch_tokens=max_batch_tokens,
+                                            max_delay_s=max_delay_s,
+                                            normalize=normalize,
+                                            device=device)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalEmbedding"
+
+    @property
+    def engine(self) -> LocalEmbeddingEngine:
+        return self._engine
+
+    def embed_array(self, texts: Sequence[str]) -> np.ndarray:
+        """Embed texts as a float32 array, one row per text."""
+        return self._engine.embed(self._format(texts, self.text_instruction))
+
+    async def aembed_array(self, texts: Sequence[str]) -> np.ndarray:
+        """Async variant of `embed_array`."""
+        return await self._engine.aembed(self._format(texts, self.text_instruction))
+
+    def close(self) -> None:
+        """Stop the engine's workers."""
+        self._engine.close()
+
+    # ---------------------------------------------------------------------------------------------------------- #
+
+    @staticmethod
+    def _format(texts: Sequence[str], instruction: Optional[str]) -> List[str]:
+        return [f"{instruction} {text}" for text in texts] if instruction else list(texts)
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._engine.embed(self._format([query], self.query_instruction))[0].tolist()
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return (await self._engine.aembed(self._format([query], self.query_instruction)))[0].tolist()
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self.aembed_array([text]))[0].tolist()
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return (await self.aembed_array(texts)).tolist()
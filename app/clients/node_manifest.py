@@ -0,0 +1,98 @@
+import logging
+from typing import Dict, Iterable, List, Set
+
+from app.clients.redis import RedisClient
+
+logger = logging.getLogger(__name__)
+
+
+class NodeManifest:
+    """
+    Redis-backed manifest of the node IDs each file has in each store namespace.
+
+    Every file has a set of node IDs and every store namespace a set of the file IDs it holds, so the nodes of a file,
+    or of a whole namespace, are found without listing the store. The namespace is a hash tag in every key, which keeps
+    the keys of a namespace on one cluster slot.
+    """
+    KEY_PREFIX: str = 'manifest'
+    # IDs sent per SADD / SREM command
+    WRITE_BATCH_SIZE: int = 1000
+
+    @staticmethod
+    def _redis():
+        return RedisClient().redis
+
+    @classmethod
+    def files_key(cls, store_namespace: str) -> str:
+        """Return the key of the set of file IDs in the namespace."""
+        return f"{cls.KEY_PREFIX}:{{{store_namespace}}}:files"
+
+    @classmethod
+    def file_key(cls, store_namespace: str, file_id: str) -> str:
+        """Return the key of the set of node IDs of a file in the namespace."""
+        return f"{cls.KEY_PREFIX}:{{{store_namespace}}}:file:{file_id}"
+
+    @classmethod
+    def add(cls, store_namespace: str, file_id: str, node_ids: Iterable[str]) -> None:
+        """Record node IDs of a file."""
+        node_ids = list(node_ids)
+        if not node_ids:
+            return
+        key = cls.file_key(store_namespace, file_id)
+        pipe = cls._redis().pipeline(transaction=False)
+        for start in range(0, len(node_ids), cls.WRITE_BATCH_SIZE):
+            pipe.sadd(key, *node_ids[start:start + cls.WRITE_BATCH_SIZE])
+        pipe.sadd(cls.files_key(store_namespace), file_id)
+        pipe.execute()
+
+    @classmethod
+    def remove(cls, store_namespace: str, file_id: str, node_ids: Iterable[str]) -> None:
+        """Forget node IDs of a file."""
+        node_ids = list(node_ids)
+        if not node_ids:
+            return
+        key = cls.file_key(store_namespace, file_id)
+        pipe = cls._redis().pipeline(transaction=False)
+        for start in range(0, len(node_ids), cls.WRITE_BATCH_SIZE):
+            pipe.srem(key, *node_ids[start:start + cls.WRITE_BATCH_SIZE])
+        pipe.execute()
+
+    @classmethod
+    def get(cls, store_namespace: str, file_id: str) -> Set[str]:
+        """Return the node IDs of a file."""
+        return {node_id.decode('utf-8') for node_id in cls._redis().smembers(cls.file_key(store_namespace, file_id))}
+
+    @classmethod
+    def get_many(cls, store_namespace: str, file_ids: List[str]) -> Dict[str, Set[str]]:
+        """Return the node IDs of several files."""
+        pipe = cls._redis().pipeline(transaction=False)
+        for file_id in file_ids:
+            pipe.smembers(cls.file_key(store_namespace, file_id))
+        return {file_id: {node_id.decode('utf-8') for node_id in members}
+                for file_id, members in zip(file_ids, pipe.execute())}
+
+    @classmethod
+    def has_file(cls, store_namespace: str, file_id: str) -> bool:
+        """Whether the manifest tracks the file, even with no nodes left."""
+        return bool(cls._redis().sismember(cls.files_key(store_namespace), file_id))
+
+    @classmethod
+    def drop(cls, store_namespace: str, file_ids: List[str]) -> None:
+        """Forget files and all their node IDs."""
+        if not file_ids:
+            return
+        pipe = cls._redis().pipeline(transaction=False)
+        pipe.delete(*(cls.file_key(store_namespace, file_id) for file_id in file_ids))
+        pipe.srem(cls.files_key(store_namespace), *file_ids)
+        pipe.execute()
+
+    @classmethod
+    def clear(cls, store_namespace: str) -> int:
+        """Forget every file of the namespace. Returns the number of files forgotten."""
+        redis_client = cls._redis()
+        files_key = cls.files_key(store_namespace)
+        file_ids = [file_id.decode('utf-8') for file_id in redis_client.sscan_iter(files_key, count=cls.WRITE_BATCH_SIZE)]
+        for start in range(0, len(file_ids), cls.WRITE_BATCH_SIZE):
+            redis_client.delete(*(cls.file_key(store_namespace, file_id) for file_id in file_ids[start:start + cls.WRITE_BATCH_SIZE]))
+        redis_client.delete(files_key)
+        return len(file_ids)
@@ -0,0 +1,293 @@
+# app/clients/rate_limiter.py
+
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Dict, Mapping, Optional, TypeVar
+
+from app.common.metrics import MetricsRegistry
+from app.config import workmait_config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+_DURATION = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse a rate limit reset duration such as `20ms`, `1.5s` or `6m0s`, in seconds."""
+    if not value:
+        return None
+    parts = _DURATION.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+class _TokenBucket:
+    """Budget refilled continuously up to its per-minute capacity."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` is available. Amounts above the capacity only wait for a full bucket."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+    def sync(self, limit: Optional[float], remaining: Optional[float], now: float) -> None:
+        """Align the bucket with the limit and remaining budget reported by the API."""
+        self._refill(now)
+        if limit:
+            self.capacity = limit
+        if remaining is not None:
+            self.level = min(self.level, remaining)
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+
+class RateLimitController:
+    """
+    Admission control for the calls to one model, shared by every client and pipeline using that model.
+
+    Calls are admitted when the request and token buckets hold their estimated cost and a concurrency slot is free.
+    The concurrency limit follows AIMD: it grows by one per window of successful calls and is cut when the API
+    answers 429 or when latency rises well above its baseline. Rate limited calls wait for `retry-after` and are
+    retried here, and the `x-ratelimit-*` headers of every response keep the buckets in line with the API's view.
+    Timeouts, connection errors, 408, 409 and 5xx answers are retried here as well, with jittered exponential
+    backoff, since the clients do not retry on their own.
+    """
+    _instances: Dict[str, 'RateLimitController'] = {}
+    _registry_lock = threading.Lock()
+
+    # Concurrency is halved on rate limits and cut gently on latency rises
+    RATE_LIMIT_DECREASE: float = 0.5
+    LATENCY_DECREASE: float = 0.9
+    # Smoothing of the recent and baseline latencies, and calls needed before latency is trusted
+    LATENCY_FAST_ALPHA: float = 0.3
+    LATENCY_SLOW_ALPHA: float = 0.02
+    LATENCY_MIN_SAMPLES: int = 20
+    # How often waiting calls check for a free concurrency slot
+    POLL_INTERVAL_S: float = 0.01
+    # Backoff of transient failures, doubled per attempt
+    BACKOFF_BASE_S: float = 0.5
+    BACKOFF_MAX_S: float = 30.0
+    TRANSIENT_STATUS_CODES = frozenset({408, 409})
+    # Timeouts and connection errors of the SDK and of httpx, matched by name as the SDK is imported lazily
+    TRANSIENT_ERRORS = frozenset({'APIConnectionError', 'TimeoutException', 'NetworkError', 'RemoteProtocolError'})
+
+    def __init__(self,
+                 name: str,
+                 requests_per_minute: float,
+                 tokens_per_minute: float,
+                 initial_concurrency: int,
+                 min_concurrency: int = 1,
+                 max_concurrency: int = 64,
+                 latency_tolerance: float = 2.0,
+                 max_retries: int = 5):
+        self.name = name
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_tolerance = latency_tolerance
+        self.max_retries = max_retries
+        self.limit = float(initial_concurrency)
+        self.in_flight = 0
+
+        self._requests = _TokenBucket(requests_per_minute)
+        self._tokens = _TokenBucket(tokens_per_minute)
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._latency_fast: Optional[float] = None
+        self._latency_slow: Optional[float] = None
+        self._latency_samples = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_model(cls, model_name: str) -> 'RateLimitController':
+        """Return the controller of a model, creating it from the configured limits."""
+        with cls._registry_lock:
+            if model_name not in cls._instances:
+                cls._instances[model_name] = cls(model_name,
+                                                 requests_per_minute=workmait_config.OPENAI_RATE_LIMIT_RPM,
+                                                 tokens_per_minute=workmait_config.OPENAI_RATE_LIMIT_TPM,
+                                                 initial_concurrency=workmait_config.OPENAI_INITIAL_CONCURRENCY,
+                                                 min_concurrency=workmait_config.OPENAI_MIN_CONCURRENCY,
+                                                 max_concurrency=workmait_config.OPENAI_MAX_CONCURRENCY,
+                                                 latency_tolerance=workmait_config.OPENAI_LATENCY_TOLERANCE,
+                                                 max_retries=workmait_config.OPENAI_RATE_LIMIT_RETRIES)
+            return cls._instances[model_name]
+
+    async def arun(self, call: Callable[[], Awaitable[T]], tokens: int) -> T:
+        """Run an async call once admitted, retrying it when it is rate limited."""
+        for attempt in range(self.max_retries + 1):
+            while (wait := self._try_acquire(tokens)) > 0:
+                await asyncio.sleep(wait)
+            started = time.monotonic()
+            try:
+                result = await call()
+            except Exception as e:
+                retry_after = self._on_error(e, attempt)
+                if retry_after is None or attempt == self.max_retries:
+                    raise
+            else:
+                self._on_success(started)
+                return result
+            finally:
+                # Cancelled calls give their slot back too
+                self._release()
+            await asyncio.sleep(retry_after)
+
+    def run(self, call: Callable[[], T], tokens: int) -> T:
+        """Blocking variant of `arun`."""
+        for attempt in range(self.max_retries + 1):
+            while (wait := self._try_acquire(tokens)) > 0:
+                time.sleep(wait)
+            started = time.monotonic()
+            try:
+                result = call()
+            except Exception as e:
+                retry_after = self._on_error(e, attempt)
+                if retry_after is None or attempt == self.max_retries:
+                    raise
+            else:
+                self._on_success(started)
+                return result
+            finally:
+                self._release()
+            time.sleep(retry_after)
+
+    def observe_headers(self, headers: Mapping[str, str]) -> None:
+        """Update the buckets from the `x-ratelimit-*` headers of a response."""
+        def number(name: str) -> Optional[float]:
+            try:
+                return float(headers[name])
+            except (KeyError, TypeError, ValueError):
+                return None
+
+        now = time.monotonic()
+        with self._lock:
+            for bucket, kind in ((self._requests, 'requests'), (self._tokens, 'tokens')):
+                remaining = number(f'x-ratelimit-remaining-{kind}')
+                bucket.sync(number(f'x-ratelimit-limit-{kind}'), remaining, now)
+                # An exhausted budget comes back at its reset time, not gradually
+                reset = parse_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+                if remaining == 0 and reset:
+                    self._blocked_until = max(self._blocked_until, now + reset)
+
+    def on_response(self, response) -> None:
+        """httpx response hook."""
+        self.observe_headers(response.headers)
+
+    def stats(self) -> Dict[str, float]:
+        """Return the concurrency limit, calls in flight and the available budgets."""
+        with self._lock:
+            return {'limit': self.limit,
+                    'in_flight': self.in_flight,
+                    'requests_available': self._requests.level,
+                    'tokens_available': self._tokens.level}
+
+    # ---------------------------------------------------------------------------------------------------------- #
+
+    def _try_acquire(self, tokens: int) -> float:
+        """Admit a call if a slot, a request and its tokens are available, otherwise return how long to wait."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            if self.in_flight >= int(self.limit):
+                return self.POLL_INTERVAL_S
+            wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(tokens, now))
+            if wait > 0:
+                return wait
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            self.in_flight += 1
+            MetricsRegistry.set_gauge(f'rate_limit.{self.name}.in_flight', self.in_flight)
+            return 0.0
+
+    def _on_success(self, started: float) -> None:
+        now = time.monotonic()
+        latency = now - started
+        MetricsRegistry.observe(f'rate_limit.{self.name}.latency_seconds', latency)
+        with self._lock:
+            if self._latency_fast is None:
+                self._latency_fast = self._latency_slow = latency
+            else:
+                self._latency_fast += self.LATENCY_FAST_ALPHA * (latency - self._latency_fast)
+                self._latency_slow += self.LATENCY_SLOW_ALPHA * (latency - self._latency_slow)
+            self._latency_samples += 1
+
+            if self._latency_samples >= self.LATENCY_MIN_SAMPLES and self._latency_fast > self.latency_tolerance * self._latency_slow:
+                self._decrease(self.LATENCY_DECREASE, now)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            MetricsRegistry.set_gauge(f'rate_limit.{self.name}.concurrency_limit', self.limit)
+
+    def _release(self) -> None:
+        """Give back the concurrency slot of a finished call, whatever its outcome."""
+        with self._lock:
+            self.in_flight -= 1
+            MetricsRegistry.set_gauge(f'rate_limit.{self.name}.in_flight', self.in_flight)
+
+    def _on_error(self, error: Exception, attempt: int) -> Optional[float]:
+        """Returns how long to wait before retrying a failed call, or None if it cannot be retried."""
+        status_code = getattr(error, 'status_code', None)
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+        if status_code != 429:
+            if not self._is_transient(error, status_code):
+                return None
+            retry_after = self._retry_after(headers) or min(self.BACKOFF_MAX_S, self.BACKOFF_BASE_S * 2 ** attempt) * random.uniform(0.5, 1)
+            MetricsRegistry.increment(f'rate_limit.{self.name}.transient_errors')
+            logger.warning(f"Transient error from '{self.name}', retrying in {retry_after:.2f}s: {error!r}")
+            return retry_after
+
+        self.observe_headers(headers)
+        retry_after = self._retry_after(headers) or min(60.0, 2 ** attempt)
+
+        now = time.monotonic()
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+            self._decrease(self.RATE_LIMIT_DECREASE, now)
+            MetricsRegistry.set_gauge(f'rate_limit.{self.name}.concurrency_limit', self.limit)
+        MetricsRegistry.increment(f'rate_limit.{self.name}.throttled')
+        logger.warning(f"Rate limited by '{self.name}', retrying in {retry_after:.2f}s with concurrency {int(self.limit)}")
+        return retry_after
+
+    @classmethod
+    def _is_transient(cls, error: Exception, status_code: Optional[int]) -> bool:
+        if status_code is not None:
+            return status_code in cls.TRANSIENT_STATUS_CODES or status_code >= 500
+        if isinstance(error, (TimeoutError, ConnectionError)):
+            return True
+        return any(klass.__name__ in cls.TRANSIENT_ERRORS for klass in type(error).__mro__)
+
+    @staticmethod
+    def _retry_after(headers: Mapping[str, str]) -> Optional[float]:
+        try:
+            return float(headers['retry-after-ms']) / 1000
+        except (KeyError, TypeError, ValueError):
+            return parse_duration(headers.get('retry-after'))
+
+    def _decrease(self, factor: float, now: float) -> None:
+        # Called with the lock held. Calls already in flight report the same congestion, so only one cut per
+        # round trip counts
+        if now - self._last_decrease < (self._latency_slow or 1.0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit * factor)
@@ -1,31 +1,61 @@
 # Typing imports
-from typing import Callable, Dict, Type
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Union
 
 # Redis imports
 import redis
+import redis.asyncio
 import redis.exceptions
 
+import os
+import socket
+import inspect
 import logging
 import asyncio
+import functools
 from pydantic import BaseModel
 
+from app.clients.admission import AdmissionController, AdmissionCost
+from app.clients.event_codec import EventCodec
+from app.common.metrics import MetricsRegistry
+from app.config import workmait_config
+
+
+# Callbacks may be plain functions or coroutine functions, and receive the entry ID if they take an `event_id`
+EventCallback = Callable[[Dict], Union[None, Awaitable[None]]]
+# Estimates the work of an event for admission control
+CostEstimator = Callable[[Dict], AdmissionCost]
+
+
+@functools.lru_cache(maxsize=None)
+def _takes_event_id(callback: EventCallback) -> bool:
+    return 'event_id' in inspect.signature(callback).parameters
+
 
 class RedisClient:
     _instance = None
 
+    # Seconds to wait before reading again after a failed XREADGROUP
+    READ_ERROR_BACKOFF: float = 1.0
+
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
-            cls._instance = super(RedisClient, cls).__new__(cls, *args, **kwargs)
+            cls._instance = super(RedisClient, cls).__new__(cls)
         return cls._instance
 
-    # TODO: Update the host and port to read from .env
-    def __init__(self, host: str = 'redis', port: int = 6379, db: int = 0):
+    def __init__(self,
+                 host: str = workmait_config.REDIS_HOST,
+                 port: int = workmait_config.REDIS_PORT,
+                 db: int = workmait_config.REDIS_DB):
         """
         Initialize the Redis client with connection parameters.
+
+        The synchronous client is used for producing events and for bookkeeping from pipeline code. The asyncio
+        client is used by the consumer engine so reads never block the event loop.
         """
         if not hasattr(self, 'initialized'):
             # Ensure initialization only happens once
             self.redis = redis.Redis(host=host, port=port, db=db)
+            self.async_redis = redis.asyncio.Redis(host=host, port=port, db=db)
             self.streams = {}
             # set the initialized flag to True
             self.initialized = True
@@ -52,44 +82,405 @@ class RedisClient:
         # Create the consumer group
         self.create_consumer_group(event_name=event_name, group_name=group_name)
 
-    def produce_event(self, event_name: str, event_payload: BaseModel) -> None:
+    def produce_event(self, event_name: str, event_payload: BaseModel) -> bool:
         """
         Produce an event to a specified Redis stream. This takes in an event payload which is a BaseModel via Pydantic.
+        The payload is written in the binary envelope of `EventCodec`, so nested models round-trip. Returns whether the
+        event was added.
         """
         try:
-            # Event Payload transformed into a dictionary
-            event_payload_dict = event_payload.model_dump()
-            # Encode it as UTF-8 if its a string. TODO: Add support for flattening nested base models.
-            encoded_event_payload = {k: v.encode('utf-8') if isinstance(v, str) else v for k, v in event_payload_dict.items()}
-            self.redis.xadd(name=event_name, fields=encoded_event_payload)
-            logging.info(f"Added the following event payload: {encoded_event_payload} to event '{event_name}'")
+            fields = EventCodec.encode(event_payload)
+            self.redis.xadd(name=event_name, fields=fields)
+            logging.info(f"Added a {type(event_payload).__name__} of {len(fields[EventCodec.FIELD])} bytes to event '{event_name}'")
+            return True
         except Exception as e:
             logging.error(f"Error producing message: {e}")
+            return False
+
+    @staticmethod
+    def build_consumer_name(prefix: str) -> str:
+        """
+        Build a consumer name that is unique per process and replica, so several workers can share a consumer group.
+        """
+        return f"{prefix}_{socket.gethostname()}_{os.getpid()}"
+
+    async def consume_events(self,
+                             event_name: str,
+                             group_name: str,
+                             consumer_name: str,
+                             callback: EventCallback,
+                             count: Optional[int] = None,
+                             block_ms: Optional[int] = None,
+                             max_in_flight: Optional[int] = None,
+                             claim_idle_ms: Optional[int] = None,
+                             admission: Optional[AdmissionController] = None,
+                             estimate_cost: Optional[CostEstimator] = None,
+                             on_dead_letter: Optional[EventCallback] = None) -> None:
+        """
+        Consume events from a specified Redis stream and process them with a callback.
+
+        Uses a blocking XREADGROUP on the asyncio client so the loop is free while the stream is idle. Events are
+        handed to a worker pool that keeps at most `max_in_flight` callbacks running; the read size is capped by the
+        free slots so this consumer never claims more entries than it can start on.
+
+        A background reclaimer runs next to the read loop and steals entries that have sat idle in any consumer's
+        pending list for longer than `claim_idle_ms`, so work left behind by a slow or crashed replica is picked up.
+        Entries still being processed are kept un-idle by a heartbeat, so long callbacks are never claimed twice.
+
+        With an admission controller, every event holds its estimated cost while it runs, and reads and claims pause
+        while the controller is closed. The group's lag and pending count are published as gauges. `on_dead_letter`
+        receives the payload fields of every event given up on, before it is moved to the dead-letter stream.
+        """
+        count = count or workmait_config.REDIS_STREAM_BATCH_SIZE
+        block_ms = workmait_config.REDIS_STREAM_BLOCK_MS if block_ms is None else block_ms
+        pool = StreamWorkerPool(client=self,
+                                event_name=event_name,
+                                group_name=group_name,
+                                callback=callback,
+                                max_in_flight=max_in_flight or workmait_config.REDIS_STREAM_MAX_IN_FLIGHT,
+                                admission=admission,
+                                estimate_cost=estimate_cost,
+                                on_dead_letter=on_dead_letter)
+        claim_idle_ms = claim_idle_ms or workmait_config.REDIS_STREAM_CLAIM_IDLE_MS
+        reclaim_task = asyncio.create_task(self.reclaim_events(pool=pool,
+                                                               consumer_name=consumer_name,
+                                                               min_idle_ms=claim_idle_ms))
+        heartbeat_task = asyncio.create_task(self.heartbeat_events(pool=pool,
+                                                                   consumer_name=consumer_name,
+                                                                   interval_s=claim_idle_ms / 3000))
+        lag_task = asyncio.create_task(self.monitor_lag(pool=pool))
+
+        try:
+            while True:
+                wanted = count
+                if admission is not None:
+                    await admission.wait_until_open()
+                    wanted = max(1, min(count, admission.events_available()))
+                slots = await pool.acquire_slots(wanted)
+                try:
+                    events = await self.async_redis.xreadgroup(groupname=group_name,
+                                                               consumername=consumer_name,
+                                                               streams={event_name: '>'},
+                                                               count=slots,
+                                                               block=block_ms)
+                except Exception as e:
+                    pool.release_slots(slots)
+                    logging.error(f"Error reading from event '{event_name}': {e}")
+                    await asyncio.sleep(self.READ_ERROR_BACKOFF)
+                    continue
+
+                for _, event_payload in events or []:
+                    for event_id, event in event_payload:
+                        pool.dispatch(event_id, event)
+                        slots -= 1
+
+                # Hand back the slots that were not filled by this read
+                pool.release_slots(slots)
+        finally:
+            reclaim_task.cancel()
+            heartbeat_task.cancel()
+            lag_task.cancel()
+            await asyncio.gather(reclaim_task, heartbeat_task, lag_task, return_exceptions=True)
+            await pool.shutdown()
+
+    async def reclaim_events(self,
+                             pool: 'StreamWorkerPool',
+                             consumer_name: str,
+                             min_idle_ms: int,
+                             interval_s: Optional[float] = None) -> None:
+        """
+        Periodically take over pending entries that have been idle for at least `min_idle_ms` using XAUTOCLAIM.
+
+        Only as many entries as the pool has free slots are claimed, so busy replicas leave stalled work to idle
+        ones and the pending lists rebalance across the group. Entries this pool is still processing are not started
+        again, and entries delivered more than REDIS_STREAM_MAX_DELIVERIES times are moved to the dead-letter stream.
+        """
+        interval_s = workmait_config.REDIS_STREAM_CLAIM_INTERVAL_S if interval_s is None else interval_s
+        start_id = '0-0'
 
-    async def consume_events(self, event_name: str, group_name: str, consumer_name: str, callback: Callable[[Dict], None]) -> None:
-        """Consume events from a specified Redis stream and process them with a callback."""
         while True:
+            await asyncio.sleep(interval_s)
+
             try:
-                # Process events
-                events = self.redis.xreadgroup(groupname=group_name, consumername=consumer_name, streams={event_name: '>'}, count=1)
-                if events:
-                    for _, event_payload in events:
-                        for event_id, event in event_payload:
+                summary = await self.async_redis.xpending(pool.event_name, pool.group_name)
+            except Exception as e:
+                logging.error(f"Error reading pending entries for event '{pool.event_name}': {e}")
+                continue
+            if not summary or not summary.get('pending'):
+                start_id = '0-0'
+                continue
+            if pool.admission is not None and not pool.admission.is_open():
+                continue
 
-                            # Log that consumption occured
-                            logging.info(f"Consumed event ID {event_id}: {event}")
+            slots = await pool.try_acquire_slots(workmait_config.REDIS_STREAM_BATCH_SIZE)
+            if not slots:
+                continue
+
+            try:
+                response = await self.async_redis.xautoclaim(name=pool.event_name,
+                                                             groupname=pool.group_name,
+                                                             consumername=consumer_name,
+                                                             min_idle_time=min_idle_ms,
+                                                             start_id=start_id,
+                                                             count=slots)
+            except Exception as e:
+                pool.release_slots(slots)
+                logging.error(f"Error claiming pending entries for event '{pool.event_name}': {e}")
+                continue
+
+            # Resume the scan where this call stopped; '0-0' means the whole pending list was covered
+            start_id, claimed = response[0], response[1]
+            deliveries = await self._delivery_counts(pool, [event_id for event_id, _ in claimed])
+            for event_id, event in claimed:
+                if event is None:
+                    # The entry was trimmed from the stream while pending, nothing left to process
+                    await self.async_redis.xack(pool.event_name, pool.group_name, event_id)
+                    continue
+                if pool.is_running(event_id):
+                    continue
+                if deliveries.get(event_id, 0) > workmait_config.REDIS_STREAM_MAX_DELIVERIES:
+                    await self.dead_letter(pool, event_id, event, deliveries[event_id])
+                    continue
+                logging.info(f"Claimed event ID {event_id} from '{pool.event_name}' after {min_idle_ms}ms idle")
+                pool.dispatch(event_id, event)
+                slots -= 1
+            pool.release_slots(slots)
+
+    async def heartbeat_events(self, pool: 'StreamWorkerPool', consumer_name: str, interval_s: float) -> None:
+        """
+        Periodically reset the idle time of the entries this pool is processing with XCLAIM JUSTID, which keeps them
+        out of every reclaimer's reach without counting as a delivery.
+        """
+        while True:
+            await asyncio.sleep(interval_s)
+            event_ids = pool.running_ids()
+            if not event_ids:
+                continue
+            try:
+                await self.async_redis.xclaim(name=pool.event_name,
+                                              groupname=pool.group_name,
+                                              consumername=consumer_name,
+                                              min_idle_time=0,
+                                              message_ids=event_ids,
+                                              justid=True)
+            except Exception as e:
+                logging.error(f"Error refreshing in-flight entries of event '{pool.event_name}': {e}")
 
-                            # handle the event
-                            callback(event)
+    async def dead_letter(self, pool: 'StreamWorkerPool', event_id: Any, event: Dict, deliveries: int) -> None:
+        """
+        Move an entry that keeps failing to the `<event>:dead` stream and acknowledge it, so it is not retried again.
 
-                            # Acknowledge event processing
-                            self.redis.xack(event_name, group_name, event_id)
+        The pool's dead-letter callback runs first. When it fails the entry stays pending, and is dead-lettered again
+        by the next claim.
+        """
+        if pool.on_dead_letter is not None:
+            try:
+                decoded = EventCodec.decode(event)
             except Exception as e:
-                logging.error(e)
-            await asyncio.sleep(1)  # Sleep for a short period to avoid tight loop
+                logging.error(f"Error decoding dead-lettered event ID {event_id} from '{pool.event_name}': {e}")
+            else:
+                try:
+                    result = pool.on_dead_letter(decoded)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    logging.error(f"Error handling dead-lettered event ID {event_id} from '{pool.event_name}': {e}")
+                    return
+
+        fields = dict(event)
+        fields[b'_source_id'] = event_id
+        fields[b'_deliveries'] = deliveries
+        try:
+            await self.async_redis.xadd(f"{pool.event_name}:dead", fields)
+            await self.async_redis.xack(pool.event_name, pool.group_name, event_id)
+        except Exception as e:
+            logging.error(f"Error dead-lettering event ID {event_id} from '{pool.event_name}': {e}")
+            return
+        MetricsRegistry.increment(f"stream.{pool.event_name}.dead_lettered")
+        logging.warning(f"Moved event ID {event_id} from '{pool.event_name}' to the dead-letter stream after {deliveries} deliveries")
+
+    async def _delivery_counts(self, pool: 'StreamWorkerPool', event_ids: List[Any]) -> Dict[Any, int]:
+        """Return how many times each of the entries was delivered, from XPENDING."""
+        if not event_ids:
+            return {}
+        pipe = self.async_redis.pipeline(transaction=False)
+        for event_id in event_ids:
+            pipe.xpending_range(pool.event_name, pool.group_name, min=event_id, max=event_id, count=1)
+        try:
+            responses = await pipe.execute()
+        except Exception as e:
+            logging.error(f"Error reading delivery counts of event '{pool.event_name}': {e}")
+            return {}
+        return {entry['message_id']: entry['times_delivered'] for pending in responses for entry in pending}
 
-    def start_consumer(self, event_name: str, group_name: str, consumer_name: str, callback: Callable[[Dict], None]) -> None:
+    async def monitor_lag(self, pool: 'StreamWorkerPool', interval_s: Optional[float] = None) -> None:
+        """
+        Periodically publish the group's lag (entries not yet delivered), its pending entries and this consumer's
+        in-flight events as gauges.
+        """
+        interval_s = workmait_config.REDIS_STREAM_LAG_INTERVAL_S if interval_s is None else interval_s
+        prefix = f"stream.{pool.event_name}"
+
+        while True:
+            try:
+                groups = await self.async_redis.xinfo_groups(pool.event_name)
+            except Exception as e:
+                logging.error(f"Error reading consumer groups of event '{pool.event_name}': {e}")
+                groups = []
+
+            for group in groups:
+                if group.get('name') not in (pool.group_name, pool.group_name.encode('utf-8')):
+                    continue
+                # Lag is only reported by Redis 7 and may be unknown after deletions
+                if group.get('lag') is not None:
+                    MetricsRegistry.set_gauge(f"{prefix}.lag", group['lag'])
+                MetricsRegistry.set_gauge(f"{prefix}.pending", group.get('pending', 0))
+            MetricsRegistry.set_gauge(f"{prefix}.in_flight", pool.in_flight)
+            await asyncio.sleep(interval_s)
+
+    async def process_event(self, event_name: str, group_name: str, event_id: Any, event: Dict, callback: EventCallback) -> bool:
+        """
+        Run the callback for a single event and acknowledge it once the callback has completed.
+
+        Events whose callback fails are left pending so they can be retried. Callbacks that take an `event_id`
+        argument receive the entry ID, which stays the same when the entry is retried.
+        """
+        # Log that consumption occured
+        logging.info(f"Consumed event ID {event_id}: {event}")
+
+        try:
+            # handle the event
+            result = callback(event, event_id=event_id) if _takes_event_id(callback) else callback(event)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logging.error(f"Error handling event ID {event_id} from '{event_name}': {e}")
+            return False
+
+        # Acknowledge event processing
+        try:
+            await self.async_redis.xack(event_name, group_name, event_id)
+        except Exception as e:
+            logging.error(f"Error acknowledging event ID {event_id} from '{event_name}': {e}")
+            return False
+        return True
+
+    def start_consumer(self, event_name: str, group_name: str, consumer_name: str, callback: EventCallback) -> None:
         """Start the consumer to process events using an asynchronous event loop."""
         loop = asyncio.get_event_loop()
         task = loop.create_task(self.consume_events(event_name, group_name, consumer_name, callback))
         loop.run_until_complete(task)
+
+    async def aclose(self) -> None:
+        """Close both the asyncio and synchronous connection pools."""
+        await self.async_redis.aclose()
+        self.redis.close()
+
+
+class StreamWorkerPool:
+    """
+    Bounded pool of in-flight event handlers for one consumer of a Redis stream.
+
+    Every dispatched event holds one semaphore slot, and its estimated cost in the admission controller, until its
+    callback has finished and the event is acknowledged.
+    """
+
+    def __init__(self,
+                 client: RedisClient,
+                 event_name: str,
+                 group_name: str,
+                 callback: EventCallback,
+                 max_in_flight: int,
+                 admission: Optional[AdmissionController] = None,
+                 estimate_cost: Optional[CostEstimator] = None,
+                 on_dead_letter: Optional[EventCallback] = None):
+        self.client = client
+        self.event_name = event_name
+        self.group_name = group_name
+        self.callback = callback
+        self.max_in_flight = max_in_flight
+        self.admission = admission
+        self.estimate_cost = estimate_cost
+        self.on_dead_letter = on_dead_letter
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._tasks: Set[asyncio.Task] = set()
+        self._running_ids: Set[Any] = set()
+
+    @property
+    def in_flight(self) -> int:
+        """Number of events currently being processed."""
+        return len(self._tasks)
+
+    def is_running(self, event_id: Any) -> bool:
+        """Whether this pool is processing the entry."""
+        return event_id in self._running_ids
+
+    def running_ids(self) -> List[Any]:
+        """IDs of the entries this pool is processing."""
+        return list(self._running_ids)
+
+    async def acquire_slots(self, wanted: int) -> int:
+        """
+        Wait for at least one free slot, then take up to `wanted` slots without waiting further.
+        """
+        await self._semaphore.acquire()
+        return 1 + await self.try_acquire_slots(wanted - 1)
+
+    async def try_acquire_slots(self, wanted: int) -> int:
+        """Take up to `wanted` slots that are free right now, returning 0 when the pool is full."""
+        slots = 0
+        while slots < wanted and not self._semaphore.locked():
+            # Returns immediately, the semaphore has a free slot
+            await self._semaphore.acquire()
+            slots += 1
+        return slots
+
+    def release_slots(self, slots: int) -> None:
+        """Return unused slots to the pool."""
+        for _ in range(slots):
+            self._semaphore.release()
+
+    def dispatch(self, event_id: Any, event: Dict) -> asyncio.Task:
+        """
+        Start processing an event on a slot that the caller has already acquired. The entry is decoded once here, and
+        the cost estimator and the callback both receive the decoded payload fields.
+        """
+        try:
+            event = EventCodec.decode(event)
+        except Exception as e:
+            # The callback fails on the raw entry, which stays pending like any failed event
+            logging.error(f"Error decoding event ID {event_id} from '{self.event_name}': {e}")
+        cost = None
+        if self.admission is not None:
+            cost = self.admission.reserve(self._estimate(event))
+        self._running_ids.add(event_id)
+        task = asyncio.create_task(self._run(event_id, event, cost))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _estimate(self, event: Dict) -> AdmissionCost:
+        if self.estimate_cost is None:
+            return AdmissionCost(files=1)
+        try:
+            return self.estimate_cost(event)
+        except Exception as e:
+            logging.warning(f"Error estimating the cost of an event from '{self.event_name}': {e}")
+            return AdmissionCost(files=1)
+
+    async def _run(self, event_id: Any, event: Dict, cost: Optional[AdmissionCost]) -> None:
+        try:
+            await self.client.process_event(self.event_name, self.group_name, event_id, event, self.callback)
+        finally:
+            self._running_ids.discard(event_id)
+            self._semaphore.release()
+            if cost is not None:
+                self.admission.release(cost)
+
+    async def shutdown(self) -> None:
+        """
+        Cancel the in-flight handlers. Their events stay unacknowledged in the pending list and are retried later.
+        """
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -1,16 +1,28 @@
+import json
+import time
+import logging
+import threading
 from abc import ABC, abstractmethod
-from typing import Any, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Sequence
 
 # Clients
 import neo4j
-from pinecone import Pinecone
+import neo4j.exceptions
 
 # Llama
-from app.common.llama import PineconeVectorStore, Neo4jPropertyGraphStore
+from app.common import llama
+from app.common.llama import BaseNode, node_to_metadata_dict
+from app.clients.graph_store import NamespaceGraphStore
+from app.clients.store_registry import StoreRegistry
 
 
+from app.common import exceptions
+from app.common.metrics import MetricsRegistry
 from app.config import workmait_config
 
+logger = logging.getLogger(__name__)
+
 
 # ------------------------------------------------------------------------------------------------------------------------- #
 # ------------------------------------------------------------------------------------------------------------------------- #
@@ -30,6 +42,21 @@ class BaseStoreClient(ABC):
         """Return the existing store for the namespace or create a new one."""
         pass
 
+    @abstractmethod
+    def delete_ids(self, namespace: str, ids: Sequence[str]) -> None:
+        """Delete nodes by ID from the namespace."""
+        pass
+
+    @abstractmethod
+    def copy_ids(self, source_namespace: str, target_namespace: str, ids: Sequence[str]) -> int:
+        """Copy nodes by ID from one namespace to another. Returns the number of nodes copied."""
+        pass
+
+    @abstractmethod
+    def delete_namespace(self, namespace: str) -> None:
+        """Delete every node of the namespace and evict its cached store."""
+        pass
+
     @abstractmethod
     def close(self):
         """Close the store client connection."""
@@ -42,7 +69,19 @@ class BaseStoreClient(ABC):
 
 class Neo4jClient(BaseStoreClient):
     _driver = None
-    _stores: Dict[str, Neo4jPropertyGraphStore] = {}
+    _stores: StoreRegistry[NamespaceGraphStore] = None
+    _lock = threading.Lock()
+
+    CHUNK_LABEL: str = NamespaceGraphStore.CHUNK_LABEL
+    ENTITY_LABEL: str = NamespaceGraphStore.ENTITY_LABEL
+    MENTIONS: str = NamespaceGraphStore.MENTIONS
+    TRIPLET_SOURCE_KEY: str = NamespaceGraphStore.TRIPLET_SOURCE_KEY
+
+    # IDs deleted or copied per transaction
+    DELETE_BATCH_SIZE: int = 1000
+    COPY_BATCH_SIZE: int = 1000
+    # Nodes deleted per transaction when dropping a namespace
+    DROP_BATCH_SIZE: int = 10000
 
     @classmethod
     def initialize(cls, **neo4j_kwargs: Any):
@@ -54,19 +93,26 @@ class Neo4jClient(BaseStoreClient):
             cls._driver = neo4j.GraphDatabase.driver(url, auth=(username, password), **neo4j_kwargs)
 
     @classmethod
-    def get_or_create_store(cls, namespace: str):
+    def get_or_create_store(cls, namespace: str) -> NamespaceGraphStore:
         """Return the existing graph store for the namespace or create a new one."""
-        if namespace not in cls._stores:
-            username = workmait_config.NEO4J_USERNAME
-            password = workmait_config.NEO4J_PASSWORD
-            url = workmait_config.NEO4J_URL
-            cls._stores[namespace] = Neo4jPropertyGraphStore(
-                username=username,
-                password=password,
-                url=url,
-                database=namespace
-            )
-        return cls._stores[namespace]
+        return cls.get_registry().get(namespace)
+
+    @classmethod
+    def get_registry(cls) -> StoreRegistry[NamespaceGraphStore]:
+        """Return the registry of graph stores, creating it if needed."""
+        with cls._lock:
+            if cls._stores is None:
+                cls._stores = StoreRegistry('graph',
+                                            factory=lambda namespace: NamespaceGraphStore(cls.get_driver(), database=namespace),
+                                            max_size=workmait_config.STORE_REGISTRY_MAX_SIZE,
+                                            ttl_s=workmait_config.STORE_REGISTRY_TTL_S,
+                                            on_evict=lambda store: store.close())
+            return cls._stores
+
+    @classmethod
+    def store_stats(cls) -> Dict[str, Any]:
+        """Return the hit, miss and eviction counts of the graph store registry."""
+        return cls.get_registry().stats()
 
     @classmethod
     def get_driver(cls):
@@ -75,13 +121,99 @@ class Neo4jClient(BaseStoreClient):
             cls.initialize()
         return cls._driver
 
+    @classmethod
+    def delete_ids(cls, namespace: str, ids: Sequence[str]) -> None:
+        """
+        Delete chunk nodes by ID from the namespace's database in batches, along with their relationships.
+        Entities are shared between files and are left in place.
+        """
+        ids = list(ids)
+        query = f"MATCH (n:`{cls.CHUNK_LABEL}`) WHERE n.id IN $ids DETACH DELETE n"
+        with cls.get_or_create_store(namespace).session() as session:
+            for start in range(0, len(ids), cls.DELETE_BATCH_SIZE):
+                session.run(query, ids=ids[start:start + cls.DELETE_BATCH_SIZE]).consume()
+
+    @classmethod
+    def list_ids(cls, namespace: str, prefix: str) -> List[str]:
+        """Return the IDs of every chunk node in the namespace whose ID starts with the prefix."""
+        query = f"MATCH (c:`{cls.CHUNK_LABEL}`) WHERE c.id STARTS WITH $prefix RETURN c.id AS id"
+        return [row['id'] for row in cls.get_or_create_store(namespace).read(query, prefix=prefix)]
+
+    @classmethod
+    def upsert_graph(cls,
+                     namespace: str,
+                     chunks: List[Dict[str, Any]],
+                     entities: List[Dict[str, Any]],
+                     mentions: List[Dict[str, Any]],
+                     relations: List[Dict[str, Any]]) -> List[str]:
+        """Merge chunks and the graph extracted from them into the namespace. Returns the chunk IDs."""
+        cls.get_or_create_store(namespace).upsert(chunks, entities, mentions, relations)
+        return [row['id'] for row in chunks]
+
+    @classmethod
+    def copy_ids(cls, source_namespace: str, target_namespace: str, ids: Sequence[str]) -> int:
+        """
+        Copy chunk nodes by ID between namespaces, along with the entities they mention and the relations extracted
+        from them. Entities are merged by ID, so the ones already in the target are shared. Raises if the target does
+        not hold every copied chunk afterwards.
+        """
+        chunk, entity, source_key = cls.CHUNK_LABEL, cls.ENTITY_LABEL, cls.TRIPLET_SOURCE_KEY
+        read_chunks = f"MATCH (c:`{chunk}`) WHERE c.id IN $ids RETURN c.id AS id, labels(c) AS labels, properties(c) AS properties"
+        read_entities = (f"MATCH (c:`{chunk}`)-[:`{cls.MENTIONS}`]->(e:`{entity}`) WHERE c.id IN $ids "
+                         f"RETURN c.id AS chunk_id, e.id AS id, labels(e) AS labels, properties(e) AS properties")
+        read_relations = (f"MATCH (c:`{chunk}`)-[:`{cls.MENTIONS}`]->(a:`{entity}`)-[r]->(b:`{entity}`) "
+                          f"WHERE c.id IN $ids AND r.{source_key} IN $ids "
+                          f"RETURN DISTINCT a.id AS source_id, type(r) AS type, properties(r) AS properties, b.id AS target_id")
+        count_chunks = f"MATCH (c:`{chunk}`) WHERE c.id IN $ids RETURN count(c) AS count"
+
+        ids = list(ids)
+        source, target = cls.get_or_create_store(source_namespace), cls.get_or_create_store(target_namespace)
+        copied = 0
+        for start in range(0, len(ids), cls.COPY_BATCH_SIZE):
+            batch = ids[start:start + cls.COPY_BATCH_SIZE]
+            chunks = source.read(read_chunks, ids=batch)
+            if not chunks:
+                continue
+            entities = source.read(read_entities, ids=batch)
+            relations = source.read(read_relations, ids=batch)
+
+            mentions = [{'chunk_id': row['chunk_id'], 'entity_id': row['id']} for row in entities]
+            target.upsert(chunks, entities, mentions, relations)
+            count = target.read(count_chunks, ids=[row['id'] for row in chunks])[0]['count']
+            if count != len(chunks):
+                raise exceptions.StoreException(f"StoreException: Namespace '{target_namespace}' holds {count} of {len(chunks)} copied chunks")
+            copied += count
+        return copied
+
+    @classmethod
+    def delete_namespace(cls, namespace: str) -> None:
+        """
+        Delete every node of the namespace's database in batched transactions, then evict and close its cached store.
+        """
+        query = f"MATCH (n) CALL {{ WITH n DETACH DELETE n }} IN TRANSACTIONS OF {cls.DROP_BATCH_SIZE} ROWS"
+        try:
+            # CALL ... IN TRANSACTIONS only runs in an auto-commit transaction
+            with cls.get_driver().session(database=namespace) as session:
+                session.run(query).consume()
+        except neo4j.exceptions.ClientError as e:
+            if e.code != 'Neo.ClientError.Database.DatabaseNotFound':
+                raise
+        finally:
+            cls.evict_store(namespace)
+
+    @classmethod
+    def evict_store(cls, namespace: str) -> None:
+        """Close and forget the cached graph store of a namespace."""
+        cls.get_registry().evict(namespace)
+
     @classmethod
     def close(cls):
-        """Close the Neo4j driver."""
+        """Close the graph stores and the Neo4j driver."""
+        if cls._stores is not None:
+            cls._stores.clear()
         if cls._driver is not None:
             cls._driver.close()
-        for store in cls._stores.values():
-            store.client.close()
+            cls._driver = None
 
 # ------------------------------------------------------------------------------------------------------------------------- #
 # ------------------------------------------------------------------------------------------------------------------------- #
@@ -89,34 +221,219 @@ class Neo4jClient(BaseStoreClient):
 
 
 class PineconeClient(BaseStoreClient):
-    _index_instance: Pinecone.Index = None
-    _vector_stores: Dict[str, PineconeVectorStore] = {}
+    _index_instance: 'pinecone.Index' = None
+    _vector_stores: StoreRegistry['llama.PineconeVectorStore'] = None
+    _executor: ThreadPoolExecutor = None
+    _lock = threading.Lock()
+
+    # Maximum number of IDs Pinecone accepts in a single delete request
+    DELETE_BATCH_SIZE: int = 1000
+    # Approximate size of a float in a JSON request body
+    FLOAT_BYTES: int = 20
+    # IDs per fetch request, they are sent in the URL
+    FETCH_BATCH_SIZE: int = 200
+    # IDs fetched before they are upserted when copying between namespaces
+    COPY_WINDOW: int = 2000
 
     @classmethod
     def initialize(cls) -> None:
         """Initialize the Pinecone client connection."""
         if cls._index_instance is None:
+            from pinecone import Pinecone
+
             api_key = workmait_config.PC_API_KEY
             host = workmait_config.PC_HOST
             pc = Pinecone(api_key=api_key)
             cls._index_instance = pc.Index(name='workmait-aws', host=host)
 
     @classmethod
-    def get_or_create_store(cls, namespace: str) -> PineconeVectorStore:
+    def get_or_create_store(cls, namespace: str) -> 'llama.PineconeVectorStore':
         """Return the existing vector store for the namespace or create a new one."""
-        if namespace not in cls._vector_stores:
-            index = cls.get_index()
-            cls._vector_stores[namespace] = PineconeVectorStore(pinecone_index=index, namespace=namespace)
-        return cls._vector_stores[namespace]
+        return cls.get_registry().get(namespace)
+
+    @classmethod
+    def get_registry(cls) -> StoreRegistry['llama.PineconeVectorStore']:
+        """Return the registry of vector stores, creating it if needed. Every store shares the index connection."""
+        with cls._lock:
+            if cls._vector_stores is None:
+                cls._vector_stores = StoreRegistry('vector',
+                                                   factory=lambda namespace: llama.PineconeVectorStore(pinecone_index=cls.get_index(), namespace=namespace),
+                                                   max_size=workmait_config.STORE_REGISTRY_MAX_SIZE,
+                                                   ttl_s=workmait_config.STORE_REGISTRY_TTL_S)
+            return cls._vector_stores
+
+    @classmethod
+    def store_stats(cls) -> Dict[str, Any]:
+        """Return the hit, miss and eviction counts of the vector store registry."""
+        return cls.get_registry().stats()
 
     @classmethod
-    def get_index(cls) -> Pinecone.Index:
+    def get_index(cls) -> 'pinecone.Index':
         """Return the Pinecone index instance, initializing if not already done."""
         if cls._index_instance is None:
             cls.initialize()
         return cls._index_instance
 
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        """Return the shared executor bounding the number of upsert and fetch requests in flight."""
+        with cls._lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(max_workers=workmait_config.PC_UPSERT_CONCURRENCY, thread_name_prefix='pinecone')
+            return cls._executor
+
+    @staticmethod
+    def build_vectors(nodes: Sequence[BaseNode]) -> List[Dict[str, Any]]:
+        """Convert embedded nodes to Pinecone vectors, with the same metadata layout as PineconeVectorStore."""
+        return [
+            {
+                'id': node.node_id,
+                'values': node.get_embedding(),
+                'metadata': node_to_metadata_dict(node, remove_text=False, flat_metadata=True),
+            }
+            for node in nodes
+        ]
+
+    @classmethod
+    def plan_upsert_batches(cls, vectors: Sequence[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Split vectors into batches bounded by vector count and by approximate request size."""
+        max_vectors = workmait_config.PC_UPSERT_BATCH_SIZE
+        max_bytes = workmait_config.PC_UPSERT_MAX_BYTES
+        batches, batch, batch_bytes = [], [], 0
+        for vector in vectors:
+            vector_bytes = cls._vector_bytes(vector)
+            if batch and (len(batch) >= max_vectors or batch_bytes + vector_bytes > max_bytes):
+                batches.append(batch)
+                batch, batch_bytes = [], 0
+            batch.append(vector)
+            batch_bytes += vector_bytes
+        if batch:
+            batches.append(batch)
+        return batches
+
+    @classmethod
+    def upsert_vectors(cls, namespace: str, vectors: Sequence[Dict[str, Any]]) -> int:
+        """
+        Upsert vectors into the namespace as concurrent batches, retrying each failed batch on its own.
+        Returns the number of vectors upserted, raises once every batch has finished if any of them failed.
+        """
+        index = cls.get_index()
+        batches = cls.plan_upsert_batches(vectors)
+        if len(batches) <= 1:
+            return sum(cls._upsert_batch(index, namespace, batch) for batch in batches)
+
+        executor = cls.get_executor()
+        futures = [executor.submit(cls._upsert_batch, index, namespace, batch) for batch in batches]
+        upserted, errors = 0, []
+        for future in futures:
+            try:
+                upserted += future.result()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise exceptions.StoreException(f"StoreException: {len(errors)} of {len(batches)} upsert batches failed for namespace '{namespace}': {errors[0]}")
+        return upserted
+
+    @classmethod
+    def upsert_nodes(cls, namespace: str, nodes: Sequence[BaseNode]) -> List[str]:
+        """Upsert embedded nodes into the namespace and return their IDs."""
+        cls.upsert_vectors(namespace, cls.build_vectors(nodes))
+        return [node.node_id for node in nodes]
+
+    @classmethod
+    def fetch_vectors(cls, namespace: str, ids: Sequence[str]) -> List[Dict[str, Any]]:
+        """Fetch vectors and their metadata by ID, as concurrent pages. IDs that do not exist are skipped."""
+        index = cls.get_index()
+        ids = list(ids)
+        pages = [ids[start:start + cls.FETCH_BATCH_SIZE] for start in range(0, len(ids), cls.FETCH_BATCH_SIZE)]
+        responses = cls.get_executor().map(lambda page: index.fetch(ids=page, namespace=namespace), pages)
+        return [
+            {'id': vector.id, 'values': list(vector.values), 'metadata': dict(vector.metadata or {})}
+            for response in responses
+            for vector in response.vectors.values()
+        ]
+
+    @classmethod
+    def copy_ids(cls, source_namespace: str, target_namespace: str, ids: Sequence[str]) -> int:
+        """
+        Copy vectors by ID between namespaces without re-embedding, one window of fetched pages at a time.
+        Raises if the target did not acknowledge every vector of a window.
+        """
+        ids = list(ids)
+        copied = 0
+        for start in range(0, len(ids), cls.COPY_WINDOW):
+            vectors = cls.fetch_vectors(source_namespace, ids[start:start + cls.COPY_WINDOW])
+            upserted = cls.upsert_vectors(target_namespace, vectors)
+            if upserted != len(vectors):
+                raise exceptions.StoreException(f"StoreException: Upserted {upserted} of {len(vectors)} vectors copied to namespace '{target_namespace}'")
+            copied += upserted
+        return copied
+
+    @classmethod
+    def _upsert_batch(cls, index, namespace: str, batch: List[Dict[str, Any]]) -> int:
+        """Upsert one batch, retrying with exponential backoff."""
+        retries = workmait_config.PC_UPSERT_RETRIES
+        for attempt in range(retries + 1):
+            started = time.perf_counter()
+            try:
+                response = index.upsert(vectors=batch, namespace=namespace)
+            except Exception as e:
+                if attempt == retries:
+                    MetricsRegistry.increment('pinecone.upsert.failed_batches')
+                    raise
+                MetricsRegistry.increment('pinecone.upsert.retries')
+                logger.warning(f"Upsert of {len(batch)} vectors to namespace '{namespace}' failed, retrying: {e}")
+                time.sleep(workmait_config.PC_UPSERT_BACKOFF_S * 2 ** attempt)
+                continue
+            MetricsRegistry.observe('pinecone.upsert.batch_seconds', time.perf_counter() - started)
+            MetricsRegistry.observe('pinecone.upsert.batch_vectors', len(batch))
+            MetricsRegistry.increment('pinecone.upsert.vectors', len(batch))
+            return response.upserted_count
+
+    @classmethod
+    def _vector_bytes(cls, vector: Dict[str, Any]) -> int:
+        """Approximate the serialized size of a vector."""
+        metadata = json.dumps(vector.get('metadata') or {}, default=str)
+        return len(vector['id']) + cls.FLOAT_BYTES * len(vector['values']) + len(metadata)
+
+    @classmethod
+    def list_ids(cls, namespace: str, prefix: str) -> List[str]:
+        """Return the IDs of every vector in the namespace whose ID starts with the prefix."""
+        index = cls.get_index()
+        return [vector_id for page in index.list(prefix=prefix, namespace=namespace) for vector_id in page]
+
+    @classmethod
+    def delete_ids(cls, namespace: str, ids: Sequence[str]) -> None:
+        """Delete vectors by ID from the namespace in batches."""
+        index = cls.get_index()
+        ids = list(ids)
+        for start in range(0, len(ids), cls.DELETE_BATCH_SIZE):
+            index.delete(ids=ids[start:start + cls.DELETE_BATCH_SIZE], namespace=namespace)
+
+    @classmethod
+    def delete_namespace(cls, namespace: str) -> None:
+        """Delete every vector of the namespace in one request and evict its cached store."""
+        from pinecone.exceptions import NotFoundException
+
+        try:
+            cls.get_index().delete(delete_all=True, namespace=namespace)
+        except NotFoundException:
+            # The namespace is already gone
+            pass
+        finally:
+            cls.evict_store(namespace)
+
+    @classmethod
+    def evict_store(cls, namespace: str) -> None:
+        """Forget the cached vector store of a namespace."""
+        cls.get_registry().evict(namespace)
+
     @classmethod
     def close(cls):
         """Close the Pinecone client connection."""
-        pass
+        if cls._vector_stores is not None:
+            cls._vector_stores.clear()
+        with cls._lock:
+            if cls._executor is not None:
+                cls._executor.shutdown(wait=True)
+                cls._executor = None
@@ -0,0 +1,102 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Optional, Tuple, TypeVar
+
+from app.common.metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+StoreT = TypeVar('StoreT')
+
+
+class StoreRegistry(Generic[StoreT]):
+    """
+    Bounded cache of per-namespace store objects.
+
+    Stores are created on first use and evicted when the registry is full, least recently used first, or when they
+    have not been used for `ttl_s` seconds. Evicted stores are passed to `on_evict` so their resources are released.
+    """
+
+    def __init__(self,
+                 name: str,
+                 factory: Callable[[str], StoreT],
+                 max_size: int,
+                 ttl_s: float,
+                 on_evict: Optional[Callable[[StoreT], None]] = None):
+        self.name = name
+        self.factory = factory
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.on_evict = on_evict
+        self._stores: 'OrderedDict[str, Tuple[StoreT, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, namespace: str) -> StoreT:
+        """Return the store of the namespace, creating it if it is not cached."""
+        now = time.monotonic()
+        with self._lock:
+            evicted = self._expire(now)
+            entry = self._stores.get(namespace)
+            if entry is not None:
+                self._stores[namespace] = (entry[0], now)
+                self._stores.move_to_end(namespace)
+                self._record('hits')
+                store = entry[0]
+            else:
+                self._record('misses')
+                store = self.factory(namespace)
+                self._stores[namespace] = (store, now)
+                while len(self._stores) > self.max_size:
+                    evicted.append(self._stores.popitem(last=False)[1][0])
+                    self._record('evictions')
+            MetricsRegistry.set_gauge(f'store_registry.{self.name}.size', len(self._stores))
+        self._close(evicted)
+        return store
+
+    def evict(self, namespace: str) -> None:
+        """Drop and close the store of a namespace, if it is cached."""
+        with self._lock:
+            entry = self._stores.pop(namespace, None)
+            if entry is not None:
+                self._record('evictions')
+        self._close([entry[0]] if entry is not None else [])
+
+    def clear(self) -> None:
+        """Drop and close every store."""
+        with self._lock:
+            stores = [store for store, _ in self._stores.values()]
+            self._stores.clear()
+        self._close(stores)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit, miss and eviction counts and the number of cached stores."""
+        with self._lock:
+            return {**self._stats, 'size': len(self._stores), 'max_size': self.max_size}
+
+    def _expire(self, now: float) -> list:
+        # Entries are ordered by last use, so expired ones are at the front
+        expired = []
+        while self._stores:
+            namespace, (store, last_used) = next(iter(self._stores.items()))
+            if now - last_used < self.ttl_s:
+                break
+            del self._stores[namespace]
+            self._record('evictions')
+            expired.append(store)
+        return expired
+
+    def _record(self, stat: str) -> None:
+        self._stats[stat] += 1
+        MetricsRegistry.increment(f'store_registry.{self.name}.{stat}')
+
+    def _close(self, stores: list) -> None:
+        if self.on_evict is None:
+            return
+        for store in stores:
+            try:
+                self.on_evict(store)
+            except Exception as e:
+                logger.warning(f"Error closing evicted {self.name} store: {e}")
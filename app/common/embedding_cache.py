@@ -0,0 +1,159 @@
+# app/common/embedding_cache.py
+
+import hashlib
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+from app.common.metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+
+def encode_vector(vector: Sequence[float]) -> bytes:
+    """Pack a vector as float32 bytes."""
+    return array('f', vector).tobytes()
+
+
+def decode_vector(data: bytes) -> List[float]:
+    """Unpack float32 bytes into a vector."""
+    vector = array('f')
+    vector.frombytes(data)
+    return vector.tolist()
+
+
+class MemoryTier:
+    """
+    In-process LRU tier bounded by the total size of the stored values.
+    """
+
+    def __init__(self, max_bytes: int, name: str = 'embedding_cache'):
+        self.max_bytes = max_bytes
+        self.name = name
+        self.size_bytes = 0
+        self._entries: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                data = self._entries.get(key)
+                if data is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = data
+        return found
+
+    def set_many(self, entries: Dict[str, bytes]) -> None:
+        with self._lock:
+            for key, data in entries.items():
+                previous = self._entries.pop(key, None)
+                if previous is not None:
+                    self.size_bytes -= len(previous)
+                self._entries[key] = data
+                self.size_bytes += len(data)
+
+            # Evict least recently used values until the tier fits its budget again
+            while self.size_bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= len(evicted)
+                MetricsRegistry.increment(f'{self.name}.evictions')
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+
+class RedisTier:
+    """
+    Persistent tier stored in Redis, shared by every replica.
+    """
+    KEY_PREFIX = 'embedding'
+
+    def __init__(self, redis_client, ttl_s: int, key_prefix: Optional[str] = None):
+        self.redis = redis_client
+        self.ttl_s = ttl_s
+        self.key_prefix = key_prefix or self.KEY_PREFIX
+
+    def _redis_key(self, key: str) -> str:
+        return f"{self.key_prefix}:{key}"
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        if not keys:
+            return {}
+        values = self.redis.mget([self._redis_key(key) for key in keys])
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, entries: Dict[str, bytes]) -> None:
+        if not entries:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for key, data in entries.items():
+            pipe.set(self._redis_key(key), data, ex=self.ttl_s)
+        pipe.execute()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache with an in-process LRU tier in front of an optional persistent tier.
+
+    Keys hash the text together with the embedding model name and dimensions, so switching models never returns
+    stale vectors. Persistent tier failures are logged and treated as misses. `EmbeddingBatcher` looks texts up
+    itself, AI clients wrap their embedding model in `CachedEmbedding` for every other caller.
+    """
+
+    def __init__(self, model_name: str, dimensions: Optional[int], memory_tier: MemoryTier, persistent_tier: Optional[RedisTier] = None):
+        self.model_name = model_name
+        self.dimensions = dimensions
+        self.memory_tier = memory_tier
+        self.persistent_tier = persistent_tier
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        """Build the cache key of a text for this model."""
+        digest = hashlib.sha256(f"{self.model_name}\x00{self.dimensions}\x00{text}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def get_many(self, texts: Sequence[str]) -> Dict[int, List[float]]:
+        """
+        Look up the texts, returning the cached vectors by position. Persistent hits are promoted to memory.
+        """
+        keys = [self.key(text) for text in texts]
+        found = self.memory_tier.get_many(keys)
+        memory_hits = len(found)
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing and self.persistent_tier is not None:
+            try:
+                persistent = self.persistent_tier.get_many(missing)
+            except Exception as e:
+                logger.error(f"Error reading from persistent embedding cache: {e}")
+                persistent = {}
+            self.memory_tier.set_many(persistent)
+            found.update(persistent)
+            MetricsRegistry.increment('embedding_cache.hits.persistent', len(persistent))
+
+        vectors = {i: decode_vector(found[key]) for i, key in enumerate(keys) if key in found}
+        self.hits += len(vectors)
+        self.misses += len(keys) - len(vectors)
+        MetricsRegistry.increment('embedding_cache.hits.memory', memory_hits)
+        MetricsRegistry.increment('embedding_cache.misses', len(keys) - len(vectors))
+        return vectors
+
+    def set_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        """Store freshly computed vectors in both tiers."""
+        entries = {self.key(text): encode_vector(vector) for text, vector in zip(texts, vectors)}
+        self.memory_tier.set_many(entries)
+        if self.persistent_tier is not None:
+            try:
+                self.persistent_tier.set_many(entries)
+            except Exception as e:
+                logger.error(f"Error writing to persistent embedding cache: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hit/miss counters of this cache."""
+        return {'hits': self.hits, 'misses': self.misses, 'memory_bytes': self.memory_tier.size_bytes}
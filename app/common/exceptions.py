@@ -30,6 +30,14 @@ class StoreAdditionException(PipelineException):
     """Exception raised for errors in the store addition step."""
     pass
 
+class EmbeddingException(PipelineException):
+    """Exception raised when the embedding model does not return one vector per text."""
+    pass
+
+class ProcessPoolException(PipelineException):
+    """Exception raised when a worker process of the parse pool dies."""
+    pass
+
 class PipelineStepException(PipelineException):
     """Exception raised for errors in the store addition step."""
     pass
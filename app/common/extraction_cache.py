@@ -0,0 +1,64 @@
+# app/common/extraction_cache.py
+
+import json
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.common.embedding_cache import MemoryTier, RedisTier
+from app.common.metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionCache:
+    """
+    Content-addressed cache of LLM graph extractions, using the same tiers as the embedding cache.
+
+    Keys hash the chunk text together with the model and the extraction schema, so changing either never returns
+    stale triplets. Only names, labels and endpoints are cached: properties come from the chunk being indexed.
+    """
+
+    def __init__(self, model_name: str, schema_key: str, memory_tier: MemoryTier, persistent_tier: Optional[RedisTier] = None):
+        self.model_name = model_name
+        self.schema_key = schema_key
+        self.memory_tier = memory_tier
+        self.persistent_tier = persistent_tier
+
+    def key(self, text: str) -> str:
+        """Build the cache key of a chunk text for this model and schema."""
+        digest = hashlib.sha256(f"{self.model_name}\x00{self.schema_key}\x00{text}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def get_many(self, texts: Sequence[str]) -> Dict[int, Dict[str, List[Dict[str, Any]]]]:
+        """
+        Look up the texts, returning the cached extractions by position. Persistent hits are promoted to memory.
+        """
+        keys = [self.key(text) for text in texts]
+        found = self.memory_tier.get_many(keys)
+        MetricsRegistry.increment('extraction_cache.hits.memory', sum(1 for key in keys if key in found))
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing and self.persistent_tier is not None:
+            try:
+                persistent = self.persistent_tier.get_many(missing)
+            except Exception as e:
+                logger.error(f"Error reading from persistent extraction cache: {e}")
+                persistent = {}
+            self.memory_tier.set_many(persistent)
+            found.update(persistent)
+            MetricsRegistry.increment('extraction_cache.hits.persistent', sum(1 for key in keys if key in persistent))
+
+        extractions = {i: json.loads(found[key]) for i, key in enumerate(keys) if key in found}
+        MetricsRegistry.increment('extraction_cache.misses', len(keys) - len(extractions))
+        return extractions
+
+    def set_many(self, texts: Sequence[str], extractions: Sequence[Dict[str, List[Dict[str, Any]]]]) -> None:
+        """Store fresh extractions in both tiers."""
+        entries = {self.key(text): json.dumps(extraction).encode('utf-8') for text, extraction in zip(texts, extractions)}
+        self.memory_tier.set_many(entries)
+        if self.persistent_tier is not None:
+            try:
+                self.persistent_tier.set_many(entries)
+            except Exception as e:
+                logger.error(f"Error writing to persistent extraction cache: {e}")
@@ -1,12 +1,19 @@
-from app.pipelines import VectorPipeline, GraphPipeline
+from app.pipelines import BasePipeline, VectorPipeline, GraphPipeline
 
 
-def initialize_strategies(vector_strategies, graph_strategies):
+def initialize_strategies(vector_strategies, graph_strategies, materialize: bool = False):
     """
-    Initialize all the pipeline strategies defined throughout the application.
+    Register all the pipeline strategies defined throughout the application.
+
+    Strategies are built on first use, so startup does not wait for clients and parsers. With `materialize`, every
+    strategy is built now instead.
     """
     for strategy in vector_strategies.values():
-        VectorPipeline.create_pipeline(**strategy)
+        VectorPipeline.register_spec(strategy['strategy_name'], strategy)
 
     for strategy in graph_strategies.values():
-        VectorPipeline.create_pipeline(**strategy)
+        GraphPipeline.register_spec(strategy['strategy_name'], strategy)
+
+    if materialize:
+        for strategy_name in [*vector_strategies, *graph_strategies]:
+            BasePipeline.get_pipeline(strategy_name=strategy_name)
@@ -1,25 +1,80 @@
-# Reading
-from llama_parse import LlamaParse
-from llama_index.core.readers.base import BaseReader
-
-# Parsing
-from llama_index.core.node_parser import NodeParser
-from llama_index.core.node_parser.relational.base_element import BaseElementNodeParser
-from llama_index.core.node_parser import MarkdownElementNodeParser
-
-# Ingestion
-from llama_index.core.ingestion import IngestionPipeline
-from llama_index.core.base.embeddings.base import BaseEmbedding
-from llama_index.core.schema import TransformComponent
-
-# Memory Storage
-from llama_index.core.vector_stores.types import VectorStore, BasePydanticVectorStore
-from llama_index.core.graph_stores.types import PropertyGraphStore
-from llama_index.core.indices.property_graph import SchemaLLMPathExtractor, PropertyGraphIndex
-
-# Managed Storage
-from llama_index.graph_stores.neo4j import Neo4jPropertyGraphStore
-from llama_index.vector_stores.pinecone import PineconeVectorStore
-
-# Other
-from beanie.odm.fields import PydanticObjectId
\ No newline at end of file
+"""
+Llama classes used across the application, imported on first access.
+
+Integration packages are slow to import, so each name is resolved from its module the first time it is used and
+cached in this module afterwards. `from app.common.llama import X` only imports the module that defines X.
+"""
+
+import importlib
+from typing import TYPE_CHECKING
+
+_EXPORTS = {
+    # Reading
+    'LlamaParse': 'llama_parse',
+    'BaseReader': 'llama_index.core.readers.base',
+
+    # Parsing
+    'NodeParser': 'llama_index.core.node_parser',
+    'BaseElementNodeParser': 'llama_index.core.node_parser.relational.base_element',
+    'MarkdownElementNodeParser': 'llama_index.core.node_parser',
+
+    # Ingestion
+    'IngestionPipeline': 'llama_index.core.ingestion',
+    'BaseEmbedding': 'llama_index.core.base.embeddings.base',
+    'get_tokenizer': 'llama_index.core.utils',
+    'TransformComponent': 'llama_index.core.schema',
+    'BaseNode': 'llama_index.core.schema',
+    'MetadataMode': 'llama_index.core.schema',
+
+    # Memory Storage
+    'VectorStore': 'llama_index.core.vector_stores.types',
+    'BasePydanticVectorStore': 'llama_index.core.vector_stores.types',
+    'node_to_metadata_dict': 'llama_index.core.vector_stores.utils',
+    'PropertyGraphStore': 'llama_index.core.graph_stores.types',
+    'EntityNode': 'llama_index.core.graph_stores.types',
+    'Relation': 'llama_index.core.graph_stores.types',
+    'KG_NODES_KEY': 'llama_index.core.graph_stores.types',
+    'KG_RELATIONS_KEY': 'llama_index.core.graph_stores.types',
+    'SchemaLLMPathExtractor': 'llama_index.core.indices.property_graph',
+    'PropertyGraphIndex': 'llama_index.core.indices.property_graph',
+
+    # Managed Storage
+    'Neo4jPropertyGraphStore': 'llama_index.graph_stores.neo4j',
+    'PineconeVectorStore': 'llama_index.vector_stores.pinecone',
+
+    # Other
+    'PydanticObjectId': 'beanie.odm.fields',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
+
+if TYPE_CHECKING:
+    from llama_parse import LlamaParse
+    from llama_index.core.readers.base import BaseReader
+    from llama_index.core.node_parser import NodeParser, MarkdownElementNodeParser
+    from llama_index.core.node_parser.relational.base_element import BaseElementNodeParser
+    from llama_index.core.ingestion import IngestionPipeline
+    from llama_index.core.base.embeddings.base import BaseEmbedding
+    from llama_index.core.utils import get_tokenizer
+    from llama_index.core.schema import TransformComponent, BaseNode, MetadataMode
+    from llama_index.core.vector_stores.types import VectorStore, BasePydanticVectorStore
+    from llama_index.core.vector_stores.utils import node_to_metadata_dict
+    from llama_index.core.graph_stores.types import PropertyGraphStore, EntityNode, Relation, KG_NODES_KEY, KG_RELATIONS_KEY
+    from llama_index.core.indices.property_graph import SchemaLLMPathExtractor, PropertyGraphIndex
+    from llama_index.graph_stores.neo4j import Neo4jPropertyGraphStore
+    from llama_index.vector_stores.pinecone import PineconeVectorStore
+    from beanie.odm.fields import PydanticObjectId
@@ -0,0 +1,71 @@
+# app/common/metrics.py
+
+import threading
+from collections import defaultdict, deque
+from typing import Deque, Dict
+
+
+class MetricsRegistry:
+    """
+    Process-wide registry of counters, gauges and histograms.
+
+    Histograms keep a bounded window of recent observations so their summaries reflect current behaviour.
+    """
+    _lock = threading.Lock()
+    _counters: Dict[str, float] = defaultdict(float)
+    _gauges: Dict[str, float] = {}
+    _histograms: Dict[str, Deque[float]] = {}
+
+    HISTOGRAM_WINDOW: int = 1024
+
+    @classmethod
+    def increment(cls, name: str, value: float = 1) -> None:
+        """Increase a counter."""
+        with cls._lock:
+            cls._counters[name] += value
+
+    @classmethod
+    def set_gauge(cls, name: str, value: float) -> None:
+        """Set a gauge to its current value."""
+        with cls._lock:
+            cls._gauges[name] = value
+
+    @classmethod
+    def observe(cls, name: str, value: float) -> None:
+        """Record an observation in a histogram."""
+        with cls._lock:
+            if name not in cls._histograms:
+                cls._histograms[name] = deque(maxlen=cls.HISTOGRAM_WINDOW)
+            cls._histograms[name].append(value)
+
+    @classmethod
+    def summarize(cls, name: str) -> Dict[str, float]:
+        """Return count, mean and percentiles for a histogram."""
+        with cls._lock:
+            values = sorted(cls._histograms.get(name, ()))
+        if not values:
+            return {'count': 0}
+
+        def percentile(q: float) -> float:
+            return values[min(len(values) - 1, int(q * len(values)))]
+
+        return {
+            'count': len(values),
+            'mean': sum(values) / len(values),
+            'p50': percentile(0.50),
+            'p95': percentile(0.95),
+            'max': values[-1],
+        }
+
+    @classmethod
+    def snapshot(cls) -> Dict[str, Dict]:
+        """Return every metric in the registry."""
+        with cls._lock:
+            counters = dict(cls._counters)
+            gauges = dict(cls._gauges)
+            histogram_names = list(cls._histograms)
+        return {
+            'counters': counters,
+            'gauges': gauges,
+            'histograms': {name: cls.summarize(name) for name in histogram_names},
+        }
@@ -1,12 +1,13 @@
 import re
-import uuid
-import uuid
-from typing import List, Literal
+import json
+import hashlib
+import logging
+from typing import Any, Dict, List, Literal, Optional
 from pathlib import Path
 
-from app.common.llama import BaseEmbedding, TransformComponent
+from app.common.llama import BaseNode, MetadataMode
 
-from app.clients import S3Client
+from app.clients import FileSpool
 
 
 
@@ -16,20 +17,51 @@ def create_store_namespace(namespace: str, pipeline_type: Literal['vector', 'gra
     return f"{namespace}:{pipeline_type}"
 
 
-def id_func(file_id: str) -> str:
+def content_hash(text: str, metadata: Optional[Dict[str, Any]] = None) -> str:
     """
-    Takes in a file_id and returns it concatenated with a unique UUID4.
+    Return a short, stable hash of a chunk's text and of the metadata stored with it.
     """
-    return f"{file_id}#{str(uuid.uuid4())}"
+    digest = hashlib.sha256(text.encode('utf-8'))
+    if metadata:
+        digest.update(b'\x00')
+        digest.update(json.dumps(metadata, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()[:16]
 
 
-def add_embedding_model(transformations: List[TransformComponent], embed_model: TransformComponent):
+def id_func(file_id: str, position: int, text: str, metadata: Optional[Dict[str, Any]] = None) -> str:
     """
-    Check if an instance of BaseEmbedding is already in the transformations list.
+    Build a deterministic node ID from the file_id, the chunk position and a hash of the chunk content and metadata.
+    Re-ingesting an unchanged file produces the same IDs, so vectors are upserted in place, while a change to the
+    text or to the metadata only produces new IDs for the chunks it touches.
     """
-    if any(isinstance(t, BaseEmbedding) for t in transformations):
-        raise ValueError("An instance of BaseEmbedding is already present in the transformations.")
-    transformations.append(embed_model)
+    return f"{file_id}#{position}#{content_hash(text, metadata)}"
+
+
+def file_id_prefix(file_id: str) -> str:
+    """
+    Return the prefix shared by the IDs of every node of a file.
+    """
+    return f"{file_id}#"
+
+
+def assign_node_ids(nodes: List[BaseNode], file_id: str) -> List[BaseNode]:
+    """
+    Replace the IDs of a file's nodes with deterministic IDs, updating the references between them.
+    """
+    id_map: Dict[str, str] = {}
+    for position, node in enumerate(nodes):
+        new_id = id_func(file_id, position, node.get_content(metadata_mode=MetadataMode.NONE), node.metadata)
+        id_map[node.node_id] = new_id
+        node.id_ = new_id
+
+    for node in nodes:
+        for related in node.relationships.values():
+            for info in related if isinstance(related, list) else [related]:
+                info.node_id = id_map.get(info.node_id, info.node_id)
+        # Index nodes produced by element parsers point at the node holding their object
+        if getattr(node, 'index_id', None) in id_map:
+            node.index_id = id_map[node.index_id]
+    return nodes
 
 
 def clean_filename(filename: str) -> str:
@@ -41,20 +73,12 @@ def clean_filename(filename: str) -> str:
     return cleaned_name
 
 
-def read_from_file_service(file_key: str, bucket_name: str = 'workmaitblogimages') -> Path:
+def read_from_file_service(file_key: str, bucket_name: Optional[str] = None, pin: bool = False) -> Path:
     """
-    Read a file from S3 and return a Path-like object to access it.
-
+    Stage a file from S3 on local disk and return the local path to read it from, pinned in the spool if asked.
     """
-    s3_fs = S3Client.get_filesystem()
-    s3_path = f's3://{bucket_name}/{file_key}'
-
     try:
-        # Ensure the file exists by attempting to open it
-        with s3_fs.open(s3_path, 'rb') as f:
-            pass
+        return FileSpool.stage(file_key, bucket_name, pin=pin)
     except Exception as e:
-        print(f"Failed to access file from S3: {e}")
+        logging.error(f"Failed to access file from S3: {e}")
         raise
-
-    return Path(s3_path)
@@ -3,7 +3,7 @@ import os
 from dotenv import load_dotenv
 
 # Pydantic
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 
 # Load the environment variables
 load_dotenv()
@@ -21,23 +21,151 @@ class WorkmaitConfig(BaseModel):
     GOOGLE_CLIENT_ID: str = os.getenv('GOOGLE_CLIENT_ID')
     GOOGLE_CLIENT_SECRET: str = os.getenv('GOOGLE_CLIENT_SECRET')
 
+    # Store objects cached per namespace
+    STORE_REGISTRY_MAX_SIZE: int = int(os.getenv('STORE_REGISTRY_MAX_SIZE', 256))
+    STORE_REGISTRY_TTL_S: float = float(os.getenv('STORE_REGISTRY_TTL_S', 3600))
+
+    # Neo4j
+    NEO4J_URL: str = os.getenv('NEO4J_URL')
+    NEO4J_USERNAME: str = os.getenv('NEO4J_USERNAME')
+    NEO4J_PASSWORD: str = os.getenv('NEO4J_PASSWORD')
+    # Rows per UNWIND statement, and entity IDs remembered per namespace as already merged
+    GRAPH_WRITE_BATCH_SIZE: int = int(os.getenv('GRAPH_WRITE_BATCH_SIZE', 1000))
+    GRAPH_ENTITY_CACHE_SIZE: int = int(os.getenv('GRAPH_ENTITY_CACHE_SIZE', 100000))
+
+    # Graph extraction, concurrent LLM calls are per strategy
+    GRAPH_EXTRACTION_CONCURRENCY: int = int(os.getenv('GRAPH_EXTRACTION_CONCURRENCY', 8))
+    GRAPH_EXTRACTION_MAX_TRIPLETS: int = int(os.getenv('GRAPH_EXTRACTION_MAX_TRIPLETS', 10))
+    GRAPH_EXTRACTION_CACHE_MAX_BYTES: int = int(os.getenv('GRAPH_EXTRACTION_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    GRAPH_EXTRACTION_CACHE_PERSISTENT: bool = os.getenv('GRAPH_EXTRACTION_CACHE_PERSISTENT', 'true').lower() == 'true'
+    GRAPH_EXTRACTION_CACHE_TTL_S: int = int(os.getenv('GRAPH_EXTRACTION_CACHE_TTL_S', 30 * 24 * 3600))
+
     # Pinecone
     PC_API_KEY: str = os.getenv('PC_API_KEY')
     PC_HOST: str = os.getenv('PC_HOST')
+    # Upserts are split by vector count and by request size, Pinecone rejects requests above 2MB
+    PC_UPSERT_BATCH_SIZE: int = int(os.getenv('PC_UPSERT_BATCH_SIZE', 200))
+    PC_UPSERT_MAX_BYTES: int = int(os.getenv('PC_UPSERT_MAX_BYTES', 1536 * 1024))
+    PC_UPSERT_CONCURRENCY: int = int(os.getenv('PC_UPSERT_CONCURRENCY', 4))
+    PC_UPSERT_RETRIES: int = int(os.getenv('PC_UPSERT_RETRIES', 3))
+    PC_UPSERT_BACKOFF_S: float = float(os.getenv('PC_UPSERT_BACKOFF_S', 0.5))
 
     # HF
     HF_TEXT_GEN_INF_URL: str = os.getenv('HF_TEXT_GEN_INF_URL')
     HF_TOKEN: str = os.getenv('HF_TOKEN')
     HF_EMBEDDING: str = "BAAI/bge-small-en-v1.5"
+    # Worker processes of the local embedding engine, 0 runs the embedding model in-process
+    HF_EMBEDDING_WORKERS: int = int(os.getenv('HF_EMBEDDING_WORKERS', 0))
+    HF_EMBEDDING_MAX_LENGTH: int = int(os.getenv('HF_EMBEDDING_MAX_LENGTH', 512))
+    # Batches are bounded by item count and by padded tokens, and wait at most the delay for more inputs
+    HF_EMBEDDING_MAX_BATCH_SIZE: int = int(os.getenv('HF_EMBEDDING_MAX_BATCH_SIZE', 32))
+    HF_EMBEDDING_MAX_BATCH_TOKENS: int = int(os.getenv('HF_EMBEDDING_MAX_BATCH_TOKENS', 8192))
+    HF_EMBEDDING_MAX_DELAY_MS: float = float(os.getenv('HF_EMBEDDING_MAX_DELAY_MS', 5))
 
     # OpenAI API KEY
     OPENAI_API_KEY: str = os.getenv('OPENAI_API_KEY')
     OPENAI_DEFAULT_MODEL: str = 'gpt-4o'
+    OPENAI_API_BASE: str = os.getenv('OPENAI_API_BASE')
+    # Retries of rate limits and transient errors are left to the rate limit controller, the clients would retry
+    # without backing off the other calls
+    OPENAI_CLIENT_RETRIES: int = int(os.getenv('OPENAI_CLIENT_RETRIES', 0))
+    OPENAI_RATE_LIMIT_RETRIES: int = int(os.getenv('OPENAI_RATE_LIMIT_RETRIES', 6))
+    # Starting budgets per model, corrected by the rate limit headers of every response
+    OPENAI_RATE_LIMIT_RPM: float = float(os.getenv('OPENAI_RATE_LIMIT_RPM', 3500))
+    OPENAI_RATE_LIMIT_TPM: float = float(os.getenv('OPENAI_RATE_LIMIT_TPM', 1000000))
+    OPENAI_INITIAL_CONCURRENCY: int = int(os.getenv('OPENAI_INITIAL_CONCURRENCY', 4))
+    OPENAI_MIN_CONCURRENCY: int = int(os.getenv('OPENAI_MIN_CONCURRENCY', 1))
+    OPENAI_MAX_CONCURRENCY: int = int(os.getenv('OPENAI_MAX_CONCURRENCY', 64))
+    # Concurrency is cut when recent latency exceeds this multiple of the baseline
+    OPENAI_LATENCY_TOLERANCE: float = float(os.getenv('OPENAI_LATENCY_TOLERANCE', 2.0))
+
+    # Pipelines
+    PIPELINE_STAGE_QUEUE_SIZE: int = int(os.getenv('PIPELINE_STAGE_QUEUE_SIZE', 2))
+    PIPELINE_LOAD_WORKERS: int = int(os.getenv('PIPELINE_LOAD_WORKERS', 2))
+    # Worker processes for CPU-bound reading and chunking, 0 runs those stages in threads
+    PARSE_PROCESS_POOL_SIZE: int = int(os.getenv('PARSE_PROCESS_POOL_SIZE', 0))
+
+    # Embeddings
+    EMBEDDING_MAX_REQUEST_TOKENS: int = int(os.getenv('EMBEDDING_MAX_REQUEST_TOKENS', 250000))
+    EMBEDDING_CACHE_MAX_BYTES: int = int(os.getenv('EMBEDDING_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    EMBEDDING_CACHE_PERSISTENT: bool = os.getenv('EMBEDDING_CACHE_PERSISTENT', 'true').lower() == 'true'
+    EMBEDDING_CACHE_TTL_S: int = int(os.getenv('EMBEDDING_CACHE_TTL_S', 30 * 24 * 3600))
+    # Embedding requests of concurrent events are coalesced for up to the window, 0 sends them directly
+    EMBEDDING_MICRO_BATCH_WINDOW_MS: float = float(os.getenv('EMBEDDING_MICRO_BATCH_WINDOW_MS', 10))
+    EMBEDDING_MICRO_BATCH_CONCURRENCY: int = int(os.getenv('EMBEDDING_MICRO_BATCH_CONCURRENCY', 4))
 
     # Boto3
     AWS_ACCESS_KEY_ID: str = os.getenv('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY: str = os.getenv('AWS_SECRET_ACCESS_KEY')
 
+    # File service and local spool
+    FILE_SERVICE_BUCKET: str = os.getenv('FILE_SERVICE_BUCKET', 'workmaitblogimages')
+    FILE_SPOOL_DIR: str = os.getenv('FILE_SPOOL_DIR', '/tmp/workmait-spool')
+    FILE_SPOOL_MAX_BYTES: int = int(os.getenv('FILE_SPOOL_MAX_BYTES', 2 * 1024 ** 3))
+    FILE_SPOOL_CONCURRENCY: int = int(os.getenv('FILE_SPOOL_CONCURRENCY', 8))
+    FILE_SPOOL_RANGE_THRESHOLD: int = int(os.getenv('FILE_SPOOL_RANGE_THRESHOLD', 32 * 1024 ** 2))
+    FILE_SPOOL_RANGE_PART_BYTES: int = int(os.getenv('FILE_SPOOL_RANGE_PART_BYTES', 8 * 1024 ** 2))
+    # Seconds a cached file is served without checking its ETag again
+    FILE_SPOOL_VALIDATE_TTL_S: float = float(os.getenv('FILE_SPOOL_VALIDATE_TTL_S', 30))
+
+    # Redis
+    REDIS_HOST: str = os.getenv('REDIS_HOST', 'redis')
+    REDIS_PORT: int = int(os.getenv('REDIS_PORT', 6379))
+    REDIS_DB: int = int(os.getenv('REDIS_DB', 0))
+
+    # Redis Streams consumers
+    REDIS_STREAM_BATCH_SIZE: int = int(os.getenv('REDIS_STREAM_BATCH_SIZE', 10))
+    REDIS_STREAM_BLOCK_MS: int = int(os.getenv('REDIS_STREAM_BLOCK_MS', 5000))
+    REDIS_STREAM_MAX_IN_FLIGHT: int = int(os.getenv('REDIS_STREAM_MAX_IN_FLIGHT', 4))
+    REDIS_STREAM_CLAIM_IDLE_MS: int = int(os.getenv('REDIS_STREAM_CLAIM_IDLE_MS', 60000))
+    REDIS_STREAM_CLAIM_INTERVAL_S: float = float(os.getenv('REDIS_STREAM_CLAIM_INTERVAL_S', 15))
+    # Entries delivered more often than this are moved to the event's dead-letter stream
+    REDIS_STREAM_MAX_DELIVERIES: int = int(os.getenv('REDIS_STREAM_MAX_DELIVERIES', 5))
+    REDIS_STREAM_LAG_INTERVAL_S: float = float(os.getenv('REDIS_STREAM_LAG_INTERVAL_S', 10))
+
+    # Admission control, reads pause while in-flight work exceeds any of these budgets
+    ADMISSION_MAX_FILES: int = int(os.getenv('ADMISSION_MAX_FILES', 64))
+    ADMISSION_MAX_BYTES: int = int(os.getenv('ADMISSION_MAX_BYTES', 1024 ** 3))
+    ADMISSION_MAX_TOKENS: int = int(os.getenv('ADMISSION_MAX_TOKENS', 5000000))
+    # Share of each budget a single event holds at most, whatever its size
+    ADMISSION_MAX_EVENT_SHARE: float = float(os.getenv('ADMISSION_MAX_EVENT_SHARE', 0.5))
+    # Size assumed for files whose metadata has none, and bytes per token of extracted text
+    ADMISSION_DEFAULT_FILE_BYTES: int = int(os.getenv('ADMISSION_DEFAULT_FILE_BYTES', 4 * 1024 ** 2))
+    ADMISSION_BYTES_PER_TOKEN: int = int(os.getenv('ADMISSION_BYTES_PER_TOKEN', 4))
+
+    # Fair scheduling of add nodes events, run slots of the small and large lanes, cost from which a payload is
+    # large, and namespace weights written as `namespace:weight,namespace:weight`
+    SCHEDULER_SMALL_SLOTS: int = int(os.getenv('SCHEDULER_SMALL_SLOTS', 4))
+    SCHEDULER_LARGE_SLOTS: int = int(os.getenv('SCHEDULER_LARGE_SLOTS', 2))
+    SCHEDULER_LARGE_COST_BYTES: int = int(os.getenv('SCHEDULER_LARGE_COST_BYTES', 16 * 1024 ** 2))
+    SCHEDULER_NAMESPACE_WEIGHTS: str = os.getenv('SCHEDULER_NAMESPACE_WEIGHTS', '')
+
+    # Add nodes events with at least this many files are split into per-file sub-events on the work stream, 0 never
+    # splits. Splitting by strategy as well spreads further but parses a file once per strategy
+    ADD_NODES_SPLIT_MIN_FILES: int = int(os.getenv('ADD_NODES_SPLIT_MIN_FILES', 0))
+    ADD_NODES_SPLIT_BY_STRATEGY: bool = os.getenv('ADD_NODES_SPLIT_BY_STRATEGY', 'false').lower() == 'true'
+    # Seconds the completion state of a split event is kept without progress
+    FAN_OUT_TTL_S: int = int(os.getenv('FAN_OUT_TTL_S', 7 * 24 * 3600))
+    # Seconds the child completing a split event has to report it before a retried child may report it instead,
+    # below the idle time after which a dead worker's entries are claimed
+    FAN_OUT_CLAIM_TTL_S: int = int(os.getenv('FAN_OUT_CLAIM_TTL_S', 30))
+
+    # Compression of produced events, 'zstd' or 'none', for bodies of at least the given size
+    EVENT_COMPRESSION: str = os.getenv('EVENT_COMPRESSION', 'zstd').lower()
+    EVENT_COMPRESSION_MIN_BYTES: int = int(os.getenv('EVENT_COMPRESSION_MIN_BYTES', 1024))
+    EVENT_ZSTD_LEVEL: int = int(os.getenv('EVENT_ZSTD_LEVEL', 3))
+
+    # Strategies are built on first use unless preloaded at startup
+    STRATEGIES_PRELOAD: bool = os.getenv('STRATEGIES_PRELOAD', 'false').lower() == 'true'
+
+    @model_validator(mode='after')
+    def check_fan_out_claim_ttl(self) -> 'WorkmaitConfig':
+        # A lease outliving the claim idle time would keep the retry of a dead child from reporting its parent
+        if self.FAN_OUT_CLAIM_TTL_S * 1000 >= self.REDIS_STREAM_CLAIM_IDLE_MS:
+            raise ValueError(f"FAN_OUT_CLAIM_TTL_S ({self.FAN_OUT_CLAIM_TTL_S}s) must be below "
+                             f"REDIS_STREAM_CLAIM_IDLE_MS ({self.REDIS_STREAM_CLAIM_IDLE_MS}ms)")
+        return self
+
 
 # Instance of config
 workmait_config = WorkmaitConfig()
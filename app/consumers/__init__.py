@@ -1,10 +1,12 @@
 from app.consumers.add_nodes import consume_add_nodes
+from app.consumers.add_nodes_work import consume_add_nodes_work
 from app.consumers.delete_nodes import consume_delete_nodes
 from app.consumers.move_nodes import consume_move_nodes
 from app.consumers.delete_store import consume_delete_store
 
 __all__ = [
     'consume_add_nodes',
+    'consume_add_nodes_work',
     'consume_delete_nodes',
     'consume_move_nodes',
     'consume_delete_store'
@@ -1,29 +1,117 @@
+import uuid
+import asyncio
 import logging
 import redis.exceptions
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
 from app.consumers.callback_wrapper import callback_wrapper
-from app.clients import RedisClient
-from app.payloads import AddNodesPayload
+from app.consumers.scheduler import FairScheduler
+from app.clients import RedisClient, AdmissionController, AdmissionCost, FanOutTracker
+from app.config import workmait_config
+from app.payloads import AddNodesPayload, AddNodesWorkPayload
 from app.interface import add_nodes
 
 # Event and consumer details
 EVENT_NAME = 'ADD_NODES_EVENT'
 CONSUMER_GROUP = 'add_nodes_group'
-CONSUMER_NAME = 'add_nodes_consumer_1'
+CONSUMER_NAME = RedisClient.build_consumer_name('add_nodes_consumer')
+
+# Sub-events of split add nodes events, and the event emitted once all sub-events of one completed
+WORK_EVENT_NAME = 'ADD_NODES_WORK_EVENT'
+COMPLETED_EVENT_NAME = 'ADD_NODES_COMPLETED_EVENT'
 
 @callback_wrapper
-async def add_nodes_callback(event: Dict[str, Any]):
+async def add_nodes_callback(event: Dict[str, Any], event_id: Optional[Any] = None):
     """
-    Handling of the add nodes process.
+    Handling of the add nodes process. Large payloads are split into sub-events for the work stream, the others
+    wait for their namespace's turn in the fair scheduler.
     """
     try:
         payload = AddNodesPayload(**event)
-        await add_nodes(payload)
+        if should_split(payload):
+            await asyncio.to_thread(split_add_nodes, payload, RedisClient(), parent_id_of(event_id))
+            return
+        await schedule_add_nodes(payload)
     except Exception as e:
         logging.error(f"Error in add_nodes_callback: {e}")
         raise
 
+async def schedule_add_nodes(payload: AddNodesPayload) -> List[str]:
+    """
+    Run the add nodes process of a payload once the fair scheduler gives it a slot. The payload holds its admission
+    cost from then on. Returns the IDs of the files that were not added to every store.
+    """
+    scheduler = FairScheduler.get_instance()
+    cost = await scheduler.estimate_cost(payload)
+    return await scheduler.run(payload.namespace, cost, lambda: add_nodes(payload), admission_cost=add_nodes_cost(payload))
+
+def should_split(payload: AddNodesPayload) -> bool:
+    """
+    Whether the payload is large enough to be split into sub-events.
+    """
+    min_files = workmait_config.ADD_NODES_SPLIT_MIN_FILES
+    return 0 < min_files <= len(payload.files)
+
+def parent_id_of(event_id: Optional[Any]) -> str:
+    """
+    Return the parent ID of a split event from its stream entry ID. A redelivered entry keeps its ID, and two
+    events with identical payloads still get their own parent. Events without an entry ID get a random one.
+    """
+    if event_id is None:
+        return uuid.uuid4().hex
+    event_id = event_id.decode('utf-8') if isinstance(event_id, bytes) else str(event_id)
+    return f"{EVENT_NAME}:{event_id}"
+
+def split_add_nodes(payload: AddNodesPayload, redis_client: RedisClient, parent_id: str) -> str:
+    """
+    Publish one sub-event per file, and per strategy if configured, on the work stream so every replica can take
+    a share of the payload. Returns the parent ID tracking their completion.
+
+    The parent ID comes from the parent's stream entry, so a parent event that is redelivered after a partial
+    publish tracks the same children again, and children published twice are counted once.
+    """
+    if workmait_config.ADD_NODES_SPLIT_BY_STRATEGY:
+        strategy_groups: List[List[str]] = [[strategy] for strategy in payload.strategies]
+    else:
+        strategy_groups = [payload.strategies]
+
+    children = [AddNodesPayload(namespace=payload.namespace,
+                                strategies=strategies,
+                                files=[file],
+                                payload_metadata=payload.payload_metadata,
+                                incremental=payload.incremental)
+                for file in payload.files for strategies in strategy_groups]
+
+    FanOutTracker.start(parent_id, len(children))
+    for child_id, child in enumerate(children):
+        work = AddNodesWorkPayload(parent_id=parent_id, child_id=str(child_id), payload=child)
+        if not redis_client.produce_event(WORK_EVENT_NAME, work):
+            # The parent stays pending and is published again when it is retried
+            raise RuntimeError(f"Error publishing sub-event {child_id} of '{parent_id}'")
+
+    logging.info(f"Split add nodes event of {len(payload.files)} files into {len(children)} sub-events of '{parent_id}'")
+    return parent_id
+
+def add_nodes_cost(payload: AddNodesPayload) -> AdmissionCost:
+    """
+    Estimate the work of an add nodes payload from its files. Sizes come from the file metadata when present, and
+    every strategy embeds the extracted text again.
+    """
+    file_bytes = sum(int(file.file_metadata.get('size') or workmait_config.ADMISSION_DEFAULT_FILE_BYTES) for file in payload.files)
+    return AdmissionCost(files=len(payload.files),
+                         bytes=file_bytes,
+                         tokens=file_bytes // workmait_config.ADMISSION_BYTES_PER_TOKEN * max(1, len(payload.strategies)))
+
+def estimate_add_nodes_cost(event: Dict[str, Any]) -> AdmissionCost:
+    """
+    Estimate the work of an add nodes event while it is dispatched. Events that are split only publish their
+    sub-events, the others hold their cost once the fair scheduler runs them, not while they wait for it.
+    """
+    payload = AddNodesPayload(**event)
+    if should_split(payload):
+        return AdmissionCost(files=1)
+    return AdmissionCost()
+
 async def consume_add_nodes(redis_client: RedisClient):
     """
     Consumer functionality for AddNodes. Uses the redis client for implementation.
@@ -37,6 +125,12 @@ async def consume_add_nodes(redis_client: RedisClient):
         return
 
     try:
-        await redis_client.consume_events(event_name=EVENT_NAME, group_name=CONSUMER_GROUP, consumer_name=CONSUMER_NAME, callback=add_nodes_callback)
+        # Events hold their admission cost once the fair scheduler runs them, the pool bounds how many wait for it
+        await redis_client.consume_events(event_name=EVENT_NAME,
+                                          group_name=CONSUMER_GROUP,
+                                          consumer_name=CONSUMER_NAME,
+                                          callback=add_nodes_callback,
+                                          admission=AdmissionController.get_instance(),
+                                          estimate_cost=estimate_add_nodes_cost)
     except Exception as e:
         logging.error(f"Error consuming events: {e}")
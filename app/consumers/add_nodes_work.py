@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import redis.exceptions
+from typing import Dict, Any, List
+
+from app.consumers.callback_wrapper import callback_wrapper
+from app.consumers.add_nodes import WORK_EVENT_NAME, COMPLETED_EVENT_NAME, schedule_add_nodes
+from app.clients import RedisClient, AdmissionController, AdmissionCost, FanOutTracker
+from app.payloads import AddNodesWorkPayload, AddNodesCompletedPayload
+
+# Event and consumer details
+EVENT_NAME = WORK_EVENT_NAME
+CONSUMER_GROUP = 'add_nodes_work_group'
+CONSUMER_NAME = RedisClient.build_consumer_name('add_nodes_work_consumer')
+
+@callback_wrapper
+async def add_nodes_work_callback(event: Dict[str, Any]):
+    """
+    Handling of a sub-event of a split add nodes event. The sub-event that completes its parent emits the parent's
+    completed event, listing the files any sub-event failed to add.
+    """
+    try:
+        work = AddNodesWorkPayload(**event)
+        failed_file_ids = await schedule_add_nodes(work.payload)
+        await complete_child(work, failed_file_ids)
+    except Exception as e:
+        logging.error(f"Error in add_nodes_work_callback: {e}")
+        raise
+
+async def add_nodes_work_dead_letter(event: Dict[str, Any]):
+    """
+    Handling of a sub-event that is given up on. It completes its parent with all its files failed, so the parent is
+    still reported.
+    """
+    work = AddNodesWorkPayload(**event)
+    logging.warning(f"Sub-event {work.child_id} of '{work.parent_id}' was dead-lettered, completing it as failed")
+    await complete_child(work, [file.file_id for file in work.payload.files])
+
+async def complete_child(work: AddNodesWorkPayload, failed_file_ids: List[str]):
+    """
+    Record the completion of a sub-event, and emit its parent's completed event if it was the last one.
+    """
+    children = await asyncio.to_thread(FanOutTracker.complete, work.parent_id, work.child_id, failed_file_ids)
+    if children is None:
+        return
+    completed = AddNodesCompletedPayload(parent_id=work.parent_id,
+                                         namespace=work.payload.namespace,
+                                         children=children,
+                                         failed_file_ids=await asyncio.to_thread(FanOutTracker.failed_file_ids, work.parent_id))
+    if not await asyncio.to_thread(RedisClient().produce_event, COMPLETED_EVENT_NAME, completed):
+        # Leave the completion to the retry of this sub-event
+        await asyncio.to_thread(FanOutTracker.reopen, work.parent_id)
+        raise RuntimeError(f"Error publishing the completion of '{work.parent_id}'")
+    await asyncio.to_thread(FanOutTracker.forget, work.parent_id)
+
+def estimate_add_nodes_work_cost(event: Dict[str, Any]) -> AdmissionCost:
+    """
+    Estimate the work of a sub-event while it is dispatched. Its file holds its cost once the fair scheduler runs it,
+    not while it waits for it.
+    """
+    return AdmissionCost()
+
+async def consume_add_nodes_work(redis_client: RedisClient):
+    """
+    Consumer functionality for the sub-events of split AddNodes events. Uses the redis client for implementation.
+    """
+    try:
+        redis_client.register_event(event_name=EVENT_NAME, group_name=CONSUMER_GROUP)
+    except redis.exceptions.ResponseError:
+        logging.warning('Consumer group already exists, continuing with existing group.')
+    except Exception as e:
+        logging.error(f"Error registering event: {e}")
+        return
+
+    try:
+        # Shares the admission budgets with the add nodes consumer
+        await redis_client.consume_events(event_name=EVENT_NAME,
+                                          group_name=CONSUMER_GROUP,
+                                          consumer_name=CONSUMER_NAME,
+                                          callback=add_nodes_work_callback,
+                                          admission=AdmissionController.get_instance(),
+                                          estimate_cost=estimate_add_nodes_work_cost,
+                                          on_dead_letter=add_nodes_work_dead_letter)
+    except Exception as e:
+        logging.error(f"Error consuming events: {e}")
@@ -11,7 +11,7 @@ from app.interface import delete_nodes
 # Event and consumer details
 EVENT_NAME = 'DELETE_NODES_EVENT'
 CONSUMER_GROUP = 'delete_nodes_group'
-CONSUMER_NAME = 'delete_nodes_consumer_1'
+CONSUMER_NAME = RedisClient.build_consumer_name('delete_nodes_consumer')
 
 @callback_wrapper
 async def delete_nodes_callback(event: Dict[str, Any]):
@@ -11,7 +11,7 @@ from app.interface import delete_store
 # Event and consumer details
 EVENT_NAME = 'DELETE_STORE_EVENT'
 CONSUMER_GROUP = 'delete_store_group'
-CONSUMER_NAME = 'delete_store_consumer_1'
+CONSUMER_NAME = RedisClient.build_consumer_name('delete_store_consumer')
 
 @callback_wrapper
 async def delete_store_callback(event: Dict[str, Any]):
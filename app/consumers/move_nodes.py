@@ -11,7 +11,7 @@ from app.interface import move_nodes
 # Event and consumer details
 EVENT_NAME = 'MOVE_NODES_EVENT'
 CONSUMER_GROUP = 'move_nodes_group'
-CONSUMER_NAME = 'move_nodes_consumer_1'
+CONSUMER_NAME = RedisClient.build_consumer_name('move_nodes_consumer')
 
 @callback_wrapper
 async def move_nodes_callback(event: Dict[str, Any]):
@@ -0,0 +1,182 @@
+# app/consumers/scheduler.py
+
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from app.clients import S3Client, FileSpool, AdmissionController, AdmissionCost
+from app.common.metrics import MetricsRegistry
+from app.config import workmait_config
+from app.payloads import AddNodesPayload, FilePayload, FileType
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+@dataclass
+class _Ticket:
+    """A payload waiting for a slot in its lane."""
+    namespace: str
+    start: float
+    finish: float
+    future: asyncio.Future
+    enqueued: float
+
+
+class _Lane:
+    """
+    Start-time fair queue with a fixed number of run slots.
+
+    Every namespace is a flow. A ticket starts at the later of the lane's virtual time and the finish of the
+    namespace's previous ticket, and finishes its weighted cost later. Free slots go to the smallest finish, so a
+    namespace with a long backlog only gets its weighted share while others are waiting.
+    """
+
+    def __init__(self, name: str, slots: int):
+        self.name = name
+        self.slots = slots
+        self.running = 0
+        self.virtual_time = 0.0
+        self._finish_tags: Dict[str, float] = {}
+        self._heap: List[Tuple[float, int, _Ticket]] = []
+        self._sequence = itertools.count()
+
+    def enqueue(self, namespace: str, weighted_cost: float) -> _Ticket:
+        start = max(self.virtual_time, self._finish_tags.get(namespace, 0.0))
+        ticket = _Ticket(namespace=namespace,
+                         start=start,
+                         finish=start + weighted_cost,
+                         future=asyncio.get_running_loop().create_future(),
+                         enqueued=time.monotonic())
+        self._finish_tags[namespace] = ticket.finish
+        heapq.heappush(self._heap, (ticket.finish, next(self._sequence), ticket))
+        self._grant()
+        return ticket
+
+    def release(self) -> None:
+        self.running -= 1
+        self._grant()
+
+    def _grant(self) -> None:
+        while self.running < self.slots and self._heap:
+            _, _, ticket = heapq.heappop(self._heap)
+            # Waiters that were cancelled leave their ticket behind
+            if ticket.future.done():
+                continue
+            self.virtual_time = max(self.virtual_time, ticket.start)
+            self.running += 1
+            ticket.future.set_result(None)
+            MetricsRegistry.observe(f'scheduler.{self.name}.wait_seconds', time.monotonic() - ticket.enqueued)
+
+        # Namespaces whose last ticket is behind the virtual time start afresh, their tags can go
+        if len(self._finish_tags) > 2 * len(self._heap) + 1024:
+            self._finish_tags = {namespace: finish for namespace, finish in self._finish_tags.items() if finish > self.virtual_time}
+        MetricsRegistry.set_gauge(f'scheduler.{self.name}.queued', len(self._heap))
+        MetricsRegistry.set_gauge(f'scheduler.{self.name}.running', self.running)
+
+
+class FairScheduler:
+    """
+    Orders add nodes payloads between the stream consumer and the pipelines.
+
+    Payloads are queued by namespace with weighted fair queuing, so a namespace backfilling thousands of files gets
+    its share of the workers without stalling the others. Small and large payloads run in separate lanes with
+    their own slots, so a large document never holds up small interactive uploads. Cost is the size of the files,
+    from their metadata or from S3, scaled by how expensive their type is to parse, for every strategy.
+
+    A payload given a slot then waits for admission room for its cost and holds it while it runs, never while it is
+    queued. Queued payloads therefore never keep the consumers from reading, and small uploads read behind a large
+    backlog are not starved, while the admission budgets still bound the work actually running.
+    """
+    _instance: 'FairScheduler' = None
+
+    # Relative parsing cost per byte of each file type
+    FILE_TYPE_COST: Dict[FileType, float] = {
+        FileType.PDF: 1.0,
+        FileType.PPT: 0.5,
+        FileType.DOC: 0.3,
+        FileType.EXCEL: 0.2,
+    }
+
+    def __init__(self,
+                 small_slots: int,
+                 large_slots: int,
+                 large_cost: float,
+                 weights: Optional[Dict[str, float]] = None,
+                 admission: Optional[AdmissionController] = None):
+        self.large_cost = large_cost
+        self.weights = weights or {}
+        self.admission = admission
+        self._lanes = {'small': _Lane('small', small_slots), 'large': _Lane('large', large_slots)}
+
+    @classmethod
+    def get_instance(cls) -> 'FairScheduler':
+        """Return the scheduler shared by the add nodes consumers, created from the configured lanes and weights."""
+        if cls._instance is None:
+            cls._instance = cls(small_slots=workmait_config.SCHEDULER_SMALL_SLOTS,
+                                large_slots=workmait_config.SCHEDULER_LARGE_SLOTS,
+                                large_cost=workmait_config.SCHEDULER_LARGE_COST_BYTES,
+                                weights=parse_weights(workmait_config.SCHEDULER_NAMESPACE_WEIGHTS),
+                                admission=AdmissionController.get_instance())
+        return cls._instance
+
+    async def run(self,
+                  namespace: str,
+                  cost: float,
+                  call: Callable[[], Awaitable[T]],
+                  admission_cost: Optional[AdmissionCost] = None) -> T:
+        """
+        Wait for the payload's turn in its lane and for admission room for its cost, then run it while holding both.
+        """
+        lane = self._lanes['large' if cost >= self.large_cost else 'small']
+        ticket = lane.enqueue(namespace, cost / self.weights.get(namespace, 1.0))
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            # A slot granted just before the cancellation goes back to the lane
+            if ticket.future.done() and not ticket.future.cancelled():
+                lane.release()
+            raise
+
+        held = None
+        try:
+            if self.admission is not None and admission_cost is not None:
+                held = await self.admission.acquire(admission_cost)
+            return await call()
+        finally:
+            lane.release()
+            if held is not None:
+                self.admission.release(held)
+
+    async def estimate_cost(self, payload: AddNodesPayload) -> float:
+        """Estimate the work of a payload, looking up in S3 the size of files whose metadata has none."""
+        sizes = await asyncio.gather(*(asyncio.to_thread(self.file_size, file) for file in payload.files))
+        cost = sum(size * self.FILE_TYPE_COST.get(file.file_type, 1.0) for file, size in zip(payload.files, sizes))
+        return cost * max(1, len(payload.strategies))
+
+    @staticmethod
+    def file_size(file: FilePayload) -> int:
+        """Size of a file from its metadata or its S3 object, or the configured default when neither is known."""
+        size = file.file_metadata.get('size')
+        if size is not None:
+            return int(size)
+        try:
+            return int(S3Client.get_filesystem().info(FileSpool.remote_path(file.file_path))['size'])
+        except Exception as e:
+            logger.warning(f"Error reading the size of '{file.file_path}', using the default: {e}")
+            return workmait_config.ADMISSION_DEFAULT_FILE_BYTES
+
+
+def parse_weights(value: Optional[str]) -> Dict[str, float]:
+    """Parse namespace weights written as `namespace:weight,namespace:weight`."""
+    weights = {}
+    for entry in (value or '').split(','):
+        if ':' in entry:
+            namespace, weight = entry.rsplit(':', 1)
+            weights[namespace.strip()] = float(weight)
+    return weights
@@ -1,41 +1,53 @@
 # app/interface.py
 
+import asyncio
 from typing import List, Dict, Literal
 
 # Payloads
 from app.payloads import AddNodesPayload, DeleteNodesPayload, DeleteStorePayload, MoveNodesPayload
-from app.pipelines import BasePipeline
+from app.pipelines import BasePipeline, ExecutionPlan
+from app.pipelines.store_operations import delete_file_nodes, delete_namespace, move_file_nodes
 
 # Utils
 from app.common.utils import create_store_namespace
 
 
-async def add_nodes(payload: AddNodesPayload):
-    """Add nodes to the specified pipeline and store namespace."""
-    for strategy_name in payload.strategies:
+async def add_nodes(payload: AddNodesPayload) -> List[str]:
+    """
+    Add nodes to the specified pipeline and store namespace. Returns the IDs of the files that were not added to
+    every store.
 
-        pipeline = BasePipeline.get_pipeline(strategy_name=strategy_name)
-        store_namespace = create_store_namespace(payload.namespace, pipeline_type=pipeline.pipeline_type)
-
-        await pipeline.execute(store_namespace=store_namespace,
-                               file_payloads=payload.files,
-                               payload_metadata=payload.payload_metadata,
-                               )
+    The requested strategies are planned together so stages they share run once, and the plan runs with its
+    stages overlapped on the event loop. Strategies used for the first time are built off the event loop.
+    """
+    plan = await ExecutionPlan.acreate(payload)
+    await plan.aexecute()
+    return plan.failed_file_ids()
 
 
 async def delete_nodes(payload: DeleteNodesPayload):
-    """Delete nodes from the specified namespace."""
-    # Implement the logic to delete nodes
-    pass
+    """
+    Delete the nodes of the given files from the specified namespace.
+
+    The node IDs come from the manifest written when the files were stored, so the cost follows the number of
+    chunks of the files rather than the size of the namespace.
+    """
+    await asyncio.to_thread(delete_file_nodes, payload.namespace, payload.file_ids)
 
 
 async def delete_store(payload: DeleteStorePayload):
-    """Delete the specified store."""
-    # Implement the logic to delete store
-    pass
+    """
+    Delete the vector and graph stores of the specified namespace, along with their manifest and cached store
+    objects.
+    """
+    await asyncio.to_thread(delete_namespace, payload.namespace)
 
 
 async def move_nodes(payload: MoveNodesPayload):
-    """Move nodes from the source namespace to the target namespace."""
-    # Implement the logic to move nodes
-    pass
+    """
+    Move the nodes of the given files from the source namespace to the target namespace.
+
+    Stored vectors and graph nodes are copied as they are, so a move costs store I/O only and never re-parses or
+    re-embeds the files.
+    """
+    await asyncio.to_thread(move_file_nodes, payload.source_namespace, payload.target_namespace, payload.file_ids)
@@ -24,6 +24,22 @@ class AddNodesPayload(BaseModel):
     strategies: List[str]
     files: List[FilePayload]
     payload_metadata: Dict[str, Any]
+    # Only embed and upsert chunks that changed since the file was last indexed
+    incremental: bool = False
+
+
+class AddNodesWorkPayload(BaseModel):
+    parent_id: str
+    child_id: str
+    payload: AddNodesPayload
+
+
+class AddNodesCompletedPayload(BaseModel):
+    parent_id: str
+    namespace: str
+    children: int
+    # Files that a sub-event did not add to every store, including the files of dead-lettered sub-events
+    failed_file_ids: List[str] = []
 
 
 class DeleteNodesPayload(BaseModel):
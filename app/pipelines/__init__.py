@@ -1,10 +1,12 @@
 from app.pipelines.pipeline import BasePipeline
 from app.pipelines.graph_pipelines import GraphPipeline
 from app.pipelines.vector_pipelines import VectorPipeline
+from app.pipelines.planner import ExecutionPlan
 
 __all__ = [
     'BasePipeline',
     'GraphPipeline',
-    'VectorPipeline'
+    'VectorPipeline',
+    'ExecutionPlan'
 
 ]
@@ -0,0 +1,347 @@
+# app/pipelines/embedding.py
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+import logging
+import sys
+import threading
+import time
+import weakref
+
+from app.common.llama import BaseEmbedding, BaseNode, MetadataMode, get_tokenizer
+from app.clients.local_embedding import LocalEmbedding
+from app.clients.rate_limiter import RateLimitController
+from app.common.embedding_cache import EmbeddingCache
+from app.common.metrics import MetricsRegistry
+from app.common import exceptions
+from app.config import workmait_config
+
+logger = logging.getLogger(__name__)
+
+
+# --------------------------------------------------------------------------------------------------------------- #
+# --------------------------------------------------------------------------------------------------------------- #
+# --------------------------------------------------------------------------------------------------------------- #
+
+
+@dataclass
+class EmbeddingLimits:
+    """Per-request limits of an embedding model."""
+    max_items: int
+    max_tokens: int
+
+
+def embedding_limits(embed_model: BaseEmbedding) -> EmbeddingLimits:
+    """
+    Derive the request limits of an embedding model.
+
+    The item limit is the model's `embed_batch_size`. Local models truncate every input to `max_length`,
+    so their token budget is what a full batch can hold; remote models use the configured per-request budget.
+    """
+    max_items = embed_model.embed_batch_size
+    # The HuggingFace integration is only loaded by clients that use it
+    huggingface = sys.modules.get('llama_index.embeddings.huggingface')
+    if isinstance(embed_model, LocalEmbedding) or (huggingface is not None and isinstance(embed_model, huggingface.HuggingFaceEmbedding)):
+        return EmbeddingLimits(max_items=max_items, max_tokens=max_items * embed_model.max_length)
+    return EmbeddingLimits(max_items=max_items, max_tokens=workmait_config.EMBEDDING_MAX_REQUEST_TOKENS)
+
+
+def embedding_key(embed_model: BaseEmbedding) -> str:
+    """
+    Identify an embedding model by class, model name and dimensions. Models with equal keys produce equal vectors.
+    """
+    return f"{type(embed_model).__qualname__}:{embed_model.model_name}:{getattr(embed_model, 'dimensions', None)}"
+
+
+def check_embeddings(texts: Sequence[str], embeddings: Sequence[List[float]]) -> None:
+    """
+    Raise when a model response does not hold exactly one vector per text. Vectors are matched to texts by position,
+    so a short response would shift every vector after the missing one.
+    """
+    if len(embeddings) != len(texts):
+        raise exceptions.EmbeddingException(f"EmbeddingException: Expected {len(texts)} vectors, got {len(embeddings)}")
+
+
+class EmbeddingBatcher:
+    """
+    Packs nodes from any number of files into as few embedding requests as the model limits allow, then scatters
+    the returned vectors back onto their nodes.
+
+    Texts found in the embedding cache, and duplicates of texts already in the request, are never sent to the model.
+    """
+
+    def __init__(self,
+                 embed_model: BaseEmbedding,
+                 limits: EmbeddingLimits = None,
+                 cache: Optional[EmbeddingCache] = None,
+                 micro_batcher: Optional['EmbeddingMicroBatcher'] = None,
+                 rate_limiter: Optional[RateLimitController] = None):
+        self.embed_model = embed_model
+        self.limits = limits or embedding_limits(embed_model)
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        # Async requests go through the micro-batcher when given, to share them with concurrent events
+        self.micro_batcher = micro_batcher
+        self._tokenizer = get_tokenizer()
+
+    def count_tokens(self, texts: Sequence[str]) -> List[int]:
+        """Count the tokens of each text."""
+        return [len(self._tokenizer(text)) for text in texts]
+
+    def plan_batches(self, token_counts: Sequence[int]) -> List[List[int]]:
+        """
+        Greedily group text indices into batches bounded by item count and token budget.
+        """
+        batches: List[List[int]] = []
+        current: List[int] = []
+        current_tokens = 0
+
+        for i, tokens in enumerate(token_counts):
+            if current and (len(current) >= self.limits.max_items or current_tokens + tokens > self.limits.max_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+
+        if current:
+            batches.append(current)
+        return batches
+
+    def embed_nodes(self, nodes: List[BaseNode]) -> List[BaseNode]:
+        """
+        Embed the nodes in place. Returns the nodes whose batch failed so the caller can drop their files.
+        """
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        cached = self.cache.get_many(texts) if self.cache is not None else {}
+        pending = self._apply_cached(nodes, texts, cached)
+        unique_texts = list(pending)
+        token_counts = self.count_tokens(unique_texts)
+        failed: List[BaseNode] = []
+
+        for batch in self.plan_batches(token_counts):
+            batch_texts = [unique_texts[i] for i in batch]
+            batch_tokens = sum(token_counts[i] for i in batch)
+            self._record_batch(len(batch), batch_tokens)
+            try:
+                if self.rate_limiter is not None:
+                    embeddings = self.rate_limiter.run(lambda: self.embed_model.get_text_embedding_batch(batch_texts), batch_tokens)
+                else:
+                    embeddings = self.embed_model.get_text_embedding_batch(batch_texts)
+                check_embeddings(batch_texts, embeddings)
+            except Exception as e:
+                logger.error(f"Error embedding batch of {len(batch)} texts: {e}")
+                failed.extend(nodes[i] for text in batch_texts for i in pending[text])
+                continue
+
+            self._apply_embeddings(nodes, pending, batch_texts, embeddings)
+            if self.cache is not None:
+                self.cache.set_many(batch_texts, embeddings)
+
+        return failed
+
+    async def aembed_nodes(self, nodes: List[BaseNode]) -> List[BaseNode]:
+        """
+        Async variant of `embed_nodes`. Requests use the model's async API and cache lookups run in a thread.
+
+        With a micro-batcher, every batch is submitted at once and may share a request with batches of other events.
+        """
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        cached = await asyncio.to_thread(self.cache.get_many, texts) if self.cache is not None else {}
+        pending = self._apply_cached(nodes, texts, cached)
+        unique_texts = list(pending)
+        token_counts = self.count_tokens(unique_texts)
+        failed: List[BaseNode] = []
+
+        batches = self.plan_batches(token_counts)
+        requests = []
+        for batch in batches:
+            batch_tokens = sum(token_counts[i] for i in batch)
+            self._record_batch(len(batch), batch_tokens)
+            requests.append(self._aembed_batch([unique_texts[i] for i in batch], batch_tokens))
+        if self.micro_batcher is not None:
+            results = await asyncio.gather(*requests)
+        else:
+            results = [await request for request in requests]
+
+        embedded_texts, embedded_vectors = [], []
+        for batch, embeddings in zip(batches, results):
+            batch_texts = [unique_texts[i] for i in batch]
+            if embeddings is None:
+                failed.extend(nodes[i] for text in batch_texts for i in pending[text])
+                continue
+            self._apply_embeddings(nodes, pending, batch_texts, embeddings)
+            embedded_texts.extend(batch_texts)
+            embedded_vectors.extend(embeddings)
+
+        if self.cache is not None and embedded_texts:
+            await asyncio.to_thread(self.cache.set_many, embedded_texts, embedded_vectors)
+        return failed
+
+    async def _aembed_batch(self, texts: List[str], tokens: int) -> Optional[List[List[float]]]:
+        """Embed one planned batch. Returns None when it fails or does not return one vector per text."""
+        try:
+            if self.micro_batcher is not None:
+                embeddings = await self.micro_batcher.aembed(texts, tokens)
+            elif self.rate_limiter is not None:
+                embeddings = await self.rate_limiter.arun(lambda: self.embed_model.aget_text_embedding_batch(texts), tokens)
+            else:
+                embeddings = await self.embed_model.aget_text_embedding_batch(texts)
+            check_embeddings(texts, embeddings)
+            return embeddings
+        except Exception as e:
+            logger.error(f"Error embedding batch of {len(texts)} texts: {e}")
+            return None
+
+    @staticmethod
+    def _apply_cached(nodes: List[BaseNode], texts: List[str], cached: Dict[int, List[float]]) -> Dict[str, List[int]]:
+        """
+        Set the cached embeddings and group the remaining nodes by text so each distinct text is embedded once.
+        """
+        pending: Dict[str, List[int]] = {}
+        for i, text in enumerate(texts):
+            if i in cached:
+                nodes[i].embedding = cached[i]
+            else:
+                pending.setdefault(text, []).append(i)
+        return pending
+
+    @staticmethod
+    def _apply_embeddings(nodes: List[BaseNode], pending: Dict[str, List[int]], texts: List[str], embeddings: List[List[float]]) -> None:
+        """Scatter the vectors of a batch back onto every node with the same text."""
+        for text, embedding in zip(texts, embeddings):
+            for i in pending[text]:
+                nodes[i].embedding = embedding
+
+    def _record_batch(self, items: int, tokens: int) -> None:
+        """Report how full a batch is relative to the tighter of the two limits."""
+        fill_ratio = max(items / self.limits.max_items, tokens / self.limits.max_tokens)
+        MetricsRegistry.increment('embedding.requests')
+        MetricsRegistry.observe('embedding.batch_items', items)
+        MetricsRegistry.observe('embedding.batch_fill_ratio', fill_ratio)
+        logger.debug(f"Embedding batch: {items} items, {tokens} tokens, fill ratio {fill_ratio:.2f}")
+
+
+# --------------------------------------------------------------------------------------------------------------- #
+# Micro-batching across events
+
+
+@dataclass
+class _QueuedEmbedding:
+    """Texts of one caller, waiting to be embedded with those of other callers."""
+    texts: List[str]
+    tokens: int
+    future: asyncio.Future
+    enqueued: float
+
+
+@dataclass
+class _EmbeddingWindow:
+    """Requests collected on one event loop since the last flush."""
+    requests: List[_QueuedEmbedding] = field(default_factory=list)
+    items: int = 0
+    tokens: int = 0
+    timer: Optional[asyncio.TimerHandle] = None
+    semaphore: Optional[asyncio.Semaphore] = None
+    tasks: set = field(default_factory=set)
+
+
+class EmbeddingMicroBatcher:
+    """
+    Process-wide coalescing of embedding requests, one batcher per AI client.
+
+    Concurrent pipelines each send their own embedding batches, which are often far from full when events are small.
+    Requests are collected for up to `window_s` after the first one, or until the next would overflow the model's
+    item or token limits, and then sent as one request. Each caller gets back the vectors of its own texts. The
+    time spent waiting and the size of every coalesced request are recorded.
+    """
+    _instances: Dict[Tuple[type, Optional[str]], 'EmbeddingMicroBatcher'] = {}
+    _lock = threading.Lock()
+
+    def __init__(self,
+                 embed_model: BaseEmbedding,
+                 limits: EmbeddingLimits = None,
+                 window_s: float = None,
+                 max_concurrency: int = None,
+                 rate_limiter: Optional[RateLimitController] = None):
+        self.embed_model = embed_model
+        self.rate_limiter = rate_limiter
+        self.limits = limits or embedding_limits(embed_model)
+        self.window_s = window_s if window_s is not None else workmait_config.EMBEDDING_MICRO_BATCH_WINDOW_MS / 1000
+        self.max_concurrency = max_concurrency or workmait_config.EMBEDDING_MICRO_BATCH_CONCURRENCY
+        self._windows: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _EmbeddingWindow]' = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def for_client(cls, ai_client) -> 'EmbeddingMicroBatcher':
+        """Return the batcher of an AI client, keyed as AI clients are, by class and model name."""
+        key = (type(ai_client), ai_client.model_name)
+        with cls._lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(ai_client.uncached_embedding, rate_limiter=ai_client.embedding_rate_limiter)
+            return cls._instances[key]
+
+    async def aembed(self, texts: List[str], tokens: int) -> List[List[float]]:
+        """Embed texts within the model limits, together with the texts of concurrent callers."""
+        loop = asyncio.get_running_loop()
+        window = self._windows.get(loop)
+        if window is None:
+            window = self._windows[loop] = _EmbeddingWindow(semaphore=asyncio.Semaphore(self.max_concurrency))
+
+        # A request that would overflow the open window flushes it first
+        if window.requests and (window.items + len(texts) > self.limits.max_items or window.tokens + tokens > self.limits.max_tokens):
+            self._flush(window)
+
+        request = _QueuedEmbedding(texts=texts, tokens=tokens, future=loop.create_future(), enqueued=time.monotonic())
+        window.requests.append(request)
+        window.items += len(texts)
+        window.tokens += tokens
+        if window.items >= self.limits.max_items or window.tokens >= self.limits.max_tokens:
+            self._flush(window)
+        elif window.timer is None:
+            window.timer = loop.call_later(self.window_s, self._flush, window)
+        return await request.future
+
+    # ---------------------------------------------------------------------------------------------------------- #
+
+    def _flush(self, window: _EmbeddingWindow) -> None:
+        if window.timer is not None:
+            window.timer.cancel()
+            window.timer = None
+        requests = window.requests
+        window.requests, window.items, window.tokens = [], 0, 0
+        if requests:
+            task = asyncio.get_running_loop().create_task(self._send(window, requests))
+            # The loop only keeps weak references to tasks
+            window.tasks.add(task)
+            task.add_done_callback(window.tasks.discard)
+
+    async def _send(self, window: _EmbeddingWindow, requests: List[_QueuedEmbedding]) -> None:
+        async with window.semaphore:
+            now = time.monotonic()
+            for request in requests:
+                MetricsRegistry.observe('embedding.micro_batch.queue_seconds', now - request.enqueued)
+            texts = [text for request in requests for text in request.texts]
+            MetricsRegistry.observe('embedding.micro_batch.items', len(texts))
+            tokens = sum(request.tokens for request in requests)
+            MetricsRegistry.observe('embedding.micro_batch.tokens', tokens)
+            MetricsRegistry.observe('embedding.micro_batch.callers', len(requests))
+
+            try:
+                if self.rate_limiter is not None:
+                    embeddings = await self.rate_limiter.arun(lambda: self.embed_model.aget_text_embedding_batch(texts), tokens)
+                else:
+                    embeddings = await self.embed_model.aget_text_embedding_batch(texts)
+                # Vectors are sliced back to the callers by position, a short response fails the whole window
+                check_embeddings(texts, embeddings)
+            except Exception as e:
+                for request in requests:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                return
+
+        offset = 0
+        for request in requests:
+            # Callers may have been cancelled while waiting
+            if not request.future.done():
+                request.future.set_result(embeddings[offset:offset + len(request.texts)])
+            offset += len(request.texts)
@@ -0,0 +1,161 @@
+# app/pipelines/graph_extraction.py
+
+import json
+import time
+import asyncio
+import logging
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.clients import RedisClient
+from app.clients.rate_limiter import RateLimitController
+from app.common.embedding_cache import MemoryTier, RedisTier
+from app.common.extraction_cache import ExtractionCache
+from app.common import llama
+from app.common.llama import (BaseNode,
+                              MetadataMode,
+                              EntityNode,
+                              Relation,
+                              KG_NODES_KEY,
+                              KG_RELATIONS_KEY,
+                              get_tokenizer)
+from app.common.metrics import MetricsRegistry
+from app.config import workmait_config
+
+logger = logging.getLogger(__name__)
+
+# Entities and relations extracted from one chunk
+Extraction = Tuple[List[EntityNode], List[Relation]]
+
+
+class GraphExtractor:
+    """
+    Extracts entities and relations from chunks with an LLM, many chunks at a time.
+
+    Chunks are extracted concurrently, up to `max_concurrency` LLM calls per event loop, and results are cached by
+    chunk text, model and schema so unchanged content is never sent to the LLM twice. Latency and token counts are
+    recorded per chunk. Token counts are estimated from the chunk text and the extracted triplets.
+    """
+    # Cache tiers are shared by every extractor, keys already include the model and schema
+    _memory_tier: MemoryTier = None
+    _persistent_tier: RedisTier = None
+
+    # Estimated prompt and output tokens of an extraction besides the chunk text, for rate limit admission
+    PROMPT_TOKENS: int = 500
+    TOKENS_PER_TRIPLET: int = 30
+
+    def __init__(self,
+                 llm,
+                 schema: Optional[Dict[str, Any]] = None,
+                 max_concurrency: Optional[int] = None,
+                 rate_limiter: Optional[RateLimitController] = None):
+        self.schema = dict(schema or {})
+        self.max_triplets = self.schema.pop('max_triplets_per_chunk', workmait_config.GRAPH_EXTRACTION_MAX_TRIPLETS)
+        # Concurrency is managed here across chunks and files, the extractor handles one chunk per call
+        self.extractor = llama.SchemaLLMPathExtractor(llm=llm, max_triplets_per_chunk=self.max_triplets, num_workers=1, **self.schema)
+        self.max_concurrency = max_concurrency or workmait_config.GRAPH_EXTRACTION_CONCURRENCY
+        self.rate_limiter = rate_limiter
+        self.model_name = getattr(llm, 'model', None) or getattr(llm, 'model_name', None) or type(llm).__name__
+        self.cache = self._create_cache()
+        self._semaphores: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]' = weakref.WeakKeyDictionary()
+        self._tokenizer = get_tokenizer()
+
+    @property
+    def schema_key(self) -> str:
+        """Key identifying the extraction schema, part of every cache key."""
+        return f"{sorted(self.schema.items())!r}|{self.max_triplets}"
+
+    async def aextract(self, nodes: List[BaseNode]) -> Dict[str, Extraction]:
+        """
+        Extract the graph of each node, from the cache when possible. Returns the extraction of every node whose
+        extraction succeeded, keyed by node ID.
+        """
+        texts = [node.get_content(metadata_mode=MetadataMode.LLM) for node in nodes]
+        cached = await asyncio.to_thread(self.cache.get_many, texts)
+
+        # Identical chunks are only sent once
+        missing: Dict[str, int] = {}
+        for i, text in enumerate(texts):
+            if i not in cached:
+                missing.setdefault(text, i)
+        extracted = await asyncio.gather(*(self._aextract_node(nodes[i], texts[i]) for i in missing.values()))
+        fresh = {text: extraction for text, extraction in zip(missing, extracted) if extraction is not None}
+        if fresh:
+            await asyncio.to_thread(self.cache.set_many, list(fresh), list(fresh.values()))
+
+        results = {}
+        for i, node in enumerate(nodes):
+            extraction = cached.get(i) or fresh.get(texts[i])
+            if extraction is not None:
+                results[node.node_id] = self._to_graph(node, extraction)
+        return results
+
+    # ---------------------------------------------------------------------------------------------------------- #
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def _aextract_node(self, node: BaseNode, text: str) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+        """Run the LLM extraction of one chunk. Returns None when it fails."""
+        input_tokens = len(self._tokenizer(text))
+        # The extractor reads and writes its output in the node metadata. Nodes are shared by the graph targets of
+        # a payload, each target extracts from a private copy so concurrent extractions never see each other's output
+        node = node.copy(update={'metadata': {key: value for key, value in node.metadata.items()
+                                              if key not in (KG_NODES_KEY, KG_RELATIONS_KEY)}})
+        async with self._semaphore():
+            started = time.perf_counter()
+            try:
+                if self.rate_limiter is not None:
+                    estimated_tokens = input_tokens + self.PROMPT_TOKENS + self.max_triplets * self.TOKENS_PER_TRIPLET
+                    await self.rate_limiter.arun(lambda: self.extractor.acall([node]), estimated_tokens)
+                else:
+                    await self.extractor.acall([node])
+            except Exception as e:
+                MetricsRegistry.increment('graph_extraction.failures')
+                logger.error(f"Error extracting graph from node '{node.node_id}': {e}")
+                return None
+            elapsed = time.perf_counter() - started
+
+        entities = node.metadata.pop(KG_NODES_KEY, None) or []
+        relations = node.metadata.pop(KG_RELATIONS_KEY, None) or []
+        extraction = {
+            'entities': [{'name': entity.name, 'label': entity.label} for entity in entities if isinstance(entity, EntityNode)],
+            'relations': [{'label': relation.label, 'source_id': relation.source_id, 'target_id': relation.target_id}
+                          for relation in relations],
+        }
+
+        output_tokens = len(self._tokenizer(json.dumps(extraction)))
+        MetricsRegistry.observe('graph_extraction.chunk_seconds', elapsed)
+        MetricsRegistry.observe('graph_extraction.chunk_input_tokens', input_tokens)
+        MetricsRegistry.observe('graph_extraction.chunk_output_tokens', output_tokens)
+        MetricsRegistry.increment('graph_extraction.input_tokens', input_tokens)
+        MetricsRegistry.increment('graph_extraction.output_tokens', output_tokens)
+        return extraction
+
+    @staticmethod
+    def _to_graph(node: BaseNode, extraction: Dict[str, List[Dict[str, Any]]]) -> Extraction:
+        """Rebuild entities and relations, with the chunk's metadata as properties as the extractor sets them."""
+        metadata = {key: value for key, value in node.metadata.items() if key not in (KG_NODES_KEY, KG_RELATIONS_KEY)}
+        entities = [EntityNode(name=entity['name'], label=entity['label'], properties=dict(metadata))
+                    for entity in extraction['entities']]
+        relations = [Relation(label=relation['label'], source_id=relation['source_id'], target_id=relation['target_id'],
+                              properties=dict(metadata))
+                     for relation in extraction['relations']]
+        return entities, relations
+
+    def _create_cache(self) -> ExtractionCache:
+        cls = GraphExtractor
+        if cls._memory_tier is None:
+            cls._memory_tier = MemoryTier(max_bytes=workmait_config.GRAPH_EXTRACTION_CACHE_MAX_BYTES, name='extraction_cache')
+        if cls._persistent_tier is None and workmait_config.GRAPH_EXTRACTION_CACHE_PERSISTENT:
+            cls._persistent_tier = RedisTier(redis_client=RedisClient().redis,
+                                             ttl_s=workmait_config.GRAPH_EXTRACTION_CACHE_TTL_S,
+                                             key_prefix='graph_extraction')
+        return ExtractionCache(model_name=self.model_name,
+                               schema_key=self.schema_key,
+                               memory_tier=cls._memory_tier,
+                               persistent_tier=cls._persistent_tier)
@@ -1,41 +1,129 @@
 # app/pipelines/graph_pipeline.py
 
-from app.pipelines.pipeline import BasePipeline, PipelineRegistry
-from app.clients import Neo4jClient
-from app.payloads import FilePayload
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
 import logging
 
+from app.pipelines.pipeline import ParsedFile
+from app.pipelines.vector_pipelines import VectorPipeline
+from app.pipelines.graph_extraction import GraphExtractor
+from app.clients import Neo4jClient, BaseAIClient
+from app.payloads import FilePayload
+
+from app.common.llama import (BaseReader,
+                              NodeParser,
+                              TransformComponent,
+                              BaseNode,
+                              MetadataMode,
+                              EntityNode,
+                              KG_NODES_KEY,
+                              KG_RELATIONS_KEY)
+
 logger = logging.getLogger(__name__)
 
-class GraphPipeline(BasePipeline):
-    file_parser: LlamaParse = None
-    node_parser: NodeParser = None
-    graph_client: Neo4jClient = None
+# Property values Neo4j can store
+_PRIMITIVES = (str, int, float, bool)
 
-    @classmethod
-    def initialize(cls):
-        cls.file_parser = LlamaParse()
-        cls.node_parser = NodeParser()
-        cls.graph_client = Neo4jClient.get_driver()  # Singleton instance
-        PipelineRegistry.register_pipeline(cls)  # Register the pipeline
 
-    @classmethod
-    def execute(cls, store_namespace: str, files: List[FilePayload], metadata: Dict[str, Any], **kwargs):
+def graph_properties(values: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep the values Neo4j can store as properties: primitives and lists of primitives."""
+    properties = {}
+    for key, value in (values or {}).items():
+        if isinstance(value, _PRIMITIVES) or (isinstance(value, list) and all(isinstance(v, _PRIMITIVES) for v in value)):
+            properties[key] = value
+    return properties
+
+
+class GraphPipeline(VectorPipeline):
+    """
+    Pipeline that indexes files as a property graph in Neo4j.
+
+    Files are read, chunked and embedded as in the vector pipeline, so the planner shares those stages between vector
+    and graph strategies. Entities and relations are then extracted from every chunk with the strategy's LLM, after
+    incremental diffing so unchanged chunks are skipped, and written with the chunks in batched transactions.
+    Extractors among the transformations may also leave a graph in each chunk's metadata. It is moved out of the
+    metadata before embedding, and those chunks are not extracted again.
+    """
+    PIPELINE_TYPE: str = 'graph'
+
+    def __init__(self,
+                 strategy_name: str,
+                 file_parser: BaseReader,
+                 node_parser: NodeParser,
+                 ai_client: BaseAIClient,
+                 transformations: List[TransformComponent],
+                 store_client: Optional[Neo4jClient] = None,
+                 graph_schema: Optional[Dict[str, Any]] = None,
+                 ):
         """
-        Execute the pipeline to process and index the file.
-        
-        Args:
-            store_namespace (str): The store namespace.
-            files (List[FilePayload]): The files to process.
-            metadata (Dict[str, Any]): Additional metadata.
-            **kwargs: Additional keyword arguments.
+        Initialize the Graph Pipeline. `graph_schema` holds the SchemaLLMPathExtractor arguments that define the
+        entities and relations to extract.
         """
-        try:
-            store = cls.graph_client.get_or_create_store(store_namespace)
-            for file in files:
-                documents = cls.file_parser.load_data(file_path=file.file_path, extra_info=metadata)
-                raw_nodes = cls.node_parser.get_nodes_from_documents(documents=documents)
-                nodes_to_index = cls._process_nodes(raw_nodes, file_id=file.file_id, **kwargs)
-                store.add(nodes=nodes_to_index)
-        except Exception as e:
-            logger.error(f"An error occurred during execution: {e}")
+        super().__init__(strategy_name, file_parser, node_parser, ai_client, transformations, store_client or Neo4jClient)
+        self.graph_extractor = (GraphExtractor(ai_client.llm, schema=graph_schema, rate_limiter=ai_client.llm_rate_limiter)
+                                if ai_client.llm is not None else None)
+
+    def parse_file(self, file_payload: FilePayload, documents: List, **kwargs) -> ParsedFile:
+        """Chunk and transform the documents, then move the extracted entities and relations out of the node metadata."""
+        parsed_file = super().parse_file(file_payload, documents, **kwargs)
+        for node in parsed_file.nodes:
+            entities = node.metadata.pop(KG_NODES_KEY, None) or []
+            relations = node.metadata.pop(KG_RELATIONS_KEY, None) or []
+            if entities or relations:
+                parsed_file.graph[node.node_id] = (entities, relations)
+        return parsed_file
+
+    def extract_files(self, parsed_files: List[ParsedFile]) -> List[ParsedFile]:
+        """Extract the graph of the files' chunks. Must not be called from a running event loop."""
+        return asyncio.run(self.aextract_files(parsed_files))
+
+    async def aextract_files(self, parsed_files: List[ParsedFile]) -> List[ParsedFile]:
+        """Extract the graph of every chunk of the files that has none yet, all files concurrently."""
+        if self.graph_extractor is None:
+            return parsed_files
+
+        async def extract(parsed_file: ParsedFile) -> None:
+            nodes = [node for node in parsed_file.nodes if node.node_id not in parsed_file.graph]
+            if nodes:
+                parsed_file.graph.update(await self.graph_extractor.aextract(nodes))
+
+        await asyncio.gather(*(extract(parsed_file) for parsed_file in parsed_files))
+        return parsed_files
+
+    def _upsert_nodes(self, store_namespace: str, parsed_file: ParsedFile) -> List[str]:
+        """Merge the chunks of a file and the graph extracted from them."""
+        chunks, entities, mentions, relations = self._graph_rows(parsed_file)
+        return self.store_client.upsert_graph(store_namespace, chunks, entities, mentions, relations)
+
+    @classmethod
+    def _graph_rows(cls, parsed_file: ParsedFile) -> Tuple[List[Dict], List[Dict], List[Dict], List[Dict]]:
+        """Convert the nodes of a file and their extracted graph to the rows written by the graph store."""
+        source_key = Neo4jClient.TRIPLET_SOURCE_KEY
+        chunks = [{'id': node.node_id, 'labels': [], 'properties': cls._chunk_properties(node)}
+                  for node in parsed_file.nodes]
+
+        chunk_ids = {row['id'] for row in chunks}
+        entities, mentions, relations = [], [], []
+        for node_id, (kg_nodes, kg_relations) in parsed_file.graph.items():
+            if node_id not in chunk_ids:
+                continue
+            for kg_node in kg_nodes:
+                if not isinstance(kg_node, EntityNode):
+                    continue
+                properties = {**graph_properties(kg_node.properties), 'name': kg_node.name, source_key: node_id}
+                entities.append({'id': kg_node.id, 'labels': [kg_node.label], 'properties': properties})
+                mentions.append({'chunk_id': node_id, 'entity_id': kg_node.id})
+            for relation in kg_relations:
+                relations.append({'type': relation.label,
+                                  'source_id': relation.source_id,
+                                  'target_id': relation.target_id,
+                                  'properties': {**graph_properties(relation.properties), source_key: node_id}})
+        return chunks, entities, mentions, relations
+
+    @staticmethod
+    def _chunk_properties(node: BaseNode) -> Dict[str, Any]:
+        properties = graph_properties(node.metadata)
+        properties['text'] = node.get_content(metadata_mode=MetadataMode.NONE)
+        if node.embedding is not None:
+            properties['embedding'] = node.embedding
+        return properties
@@ -1,14 +1,35 @@
 # ABC
-from abc import ABC, abstractmethod
-from typing import Dict, Any, List
+from abc import ABC, ABCMeta, abstractmethod
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Tuple
+import asyncio
+import logging
+import threading
+import time
 
 
 from app.payloads import AddNodesPayload, FilePayload
+from app.common.metrics import MetricsRegistry
 
+logger = logging.getLogger(__name__)
 
-class SingletonMeta(type):
+
+@dataclass
+class ParsedFile:
+    """
+    A file that has been parsed into nodes and is waiting to be embedded and stored.
+    """
+    file_payload: FilePayload
+    nodes: List[Any]
+    # IDs indexed for a previous version of the file that are no longer produced
+    stale_ids: List[str] = field(default_factory=list)
+    # Entities and relations extracted from each node by graph strategies, keyed by node ID
+    graph: Dict[str, Tuple[List[Any], List[Any]]] = field(default_factory=dict)
+
+
+class SingletonMeta(ABCMeta):
     """
-    A metaclass for creating Singleton classes.
+    A metaclass for creating Singleton classes, one instance per class and strategy.
     """
     _instances = {}
 
@@ -16,10 +37,11 @@ class SingletonMeta(type):
         """
         When called, creates instance if does not exist. Else, it returns instance.
         """
-        if cls not in cls._instances:
+        key = (cls, args[0] if args else kwargs.get('strategy_name'))
+        if key not in cls._instances:
             instance = super().__call__(*args, **kwargs)
-            cls._instances[cls] = instance
-        return cls._instances[cls]
+            cls._instances[key] = instance
+        return cls._instances[key]
 
 
 class BasePipeline(ABC, metaclass=SingletonMeta):
@@ -27,6 +49,9 @@ class BasePipeline(ABC, metaclass=SingletonMeta):
     Abstract base class for pipelines.
     """
     _pipeline_instances: Dict[str, 'BasePipeline'] = {}
+    # Strategies registered but not built yet, with the pipeline class that builds them
+    _pipeline_specs: Dict[str, Tuple[type, Dict[str, Any]]] = {}
+    _materialize_lock = threading.RLock()
 
     def __init__(self, strategy_name: str, pipeline_type: str):
         self._strategy_name = strategy_name
@@ -60,14 +85,51 @@ class BasePipeline(ABC, metaclass=SingletonMeta):
         """Register a pipeline instance."""
         cls._pipeline_instances[strategy_name] = pipeline_instance
 
+    @classmethod
+    def register_spec(cls, strategy_name: str, spec: Dict[str, Any]):
+        """
+        Register a strategy to be built by this pipeline class the first time it is used. Spec values are
+        `create_pipeline` arguments, callable values are factories called with no arguments when the strategy is built.
+        """
+        cls._pipeline_specs[strategy_name] = (cls, spec)
+
     @classmethod
     def get_pipeline(cls, strategy_name: str) -> 'BasePipeline':
-        """Retrieve a pipeline instance by strategy name."""
+        """Retrieve a pipeline instance by strategy name, building it from its spec on first use."""
+        pipeline_instance = cls._pipeline_instances.get(strategy_name)
+        if not pipeline_instance:
+            pipeline_instance = cls._materialize(strategy_name)
+        return pipeline_instance
+
+    @classmethod
+    async def aget_pipeline(cls, strategy_name: str) -> 'BasePipeline':
+        """Retrieve a pipeline instance by strategy name, building it in a worker thread so the event loop keeps running."""
         pipeline_instance = cls._pipeline_instances.get(strategy_name)
         if not pipeline_instance:
-            raise ValueError(f"No pipeline registered under strategy: {strategy_name}")
+            pipeline_instance = await asyncio.to_thread(cls._materialize, strategy_name)
         return pipeline_instance
 
+    @classmethod
+    def _materialize(cls, strategy_name: str) -> 'BasePipeline':
+        with BasePipeline._materialize_lock:
+            # Another caller may have built it while this one waited
+            pipeline_instance = cls._pipeline_instances.get(strategy_name)
+            if pipeline_instance:
+                return pipeline_instance
+
+            entry = cls._pipeline_specs.get(strategy_name)
+            if entry is None:
+                raise ValueError(f"No pipeline registered under strategy: {strategy_name}")
+            pipeline_cls, spec = entry
+
+            started = time.perf_counter()
+            kwargs = {key: value() if callable(value) else value for key, value in spec.items()}
+            pipeline_instance = pipeline_cls.create_pipeline(**kwargs)
+            elapsed = time.perf_counter() - started
+            MetricsRegistry.observe('pipeline.materialize_seconds', elapsed)
+            logger.info(f"Built strategy '{strategy_name}' in {elapsed:.2f}s")
+            return pipeline_instance
+
 
 # --------------------------------------------------------------------------------------------------------------- #
 # --------------------------------------------------------------------------------------------------------------- #
@@ -0,0 +1,335 @@
+# app/pipelines/planner.py
+
+import copy
+import asyncio
+import dataclasses
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.payloads import AddNodesPayload, FilePayload
+from app.clients import FileSpool
+from app.pipelines.pipeline import BasePipeline, ParsedFile
+from app.pipelines.vector_pipelines import VectorPipeline
+from app.pipelines.embedding import embedding_key
+from app.pipelines.stages import Stage, BatchStage, run_stages
+from app.common.utils import create_store_namespace
+from app.common import exceptions
+from app.config import workmait_config
+
+logger = logging.getLogger(__name__)
+
+
+def component_key(component: Any) -> str:
+    """
+    Build a key that is equal for two components configured the same way, even when they are distinct instances.
+    """
+    name = type(component).__qualname__
+    if component is None:
+        return name
+    try:
+        return f"{name}:{component.to_json()}"
+    except Exception:
+        pass
+    try:
+        return f"{name}:{sorted(vars(component).items())!r}"
+    except TypeError:
+        return f"{name}:{id(component)}"
+
+
+def target_key(store_namespace: str, pipeline: VectorPipeline) -> str:
+    """
+    Build the key of a store target. Graph strategies that write the same store namespace with different extraction
+    models or schemas are distinct targets, each extracting and storing its own graph.
+    """
+    extractor = getattr(pipeline, 'graph_extractor', None)
+    if extractor is None:
+        return store_namespace
+    return f"{store_namespace}|{extractor.model_name}|{extractor.schema_key}"
+
+
+# --------------------------------------------------------------------------------------------------------------- #
+# --------------------------------------------------------------------------------------------------------------- #
+# --------------------------------------------------------------------------------------------------------------- #
+
+
+@dataclass
+class EmbedStage:
+    """Embeds the nodes of a chunk stage once and fans them out to every target namespace."""
+    key: str
+    pipeline: VectorPipeline
+    # Target key -> store namespace and the pipeline that writes to it
+    targets: Dict[str, Tuple[str, VectorPipeline]] = field(default_factory=dict)
+
+
+@dataclass
+class ChunkStage:
+    """Chunks and transforms the documents of a load stage once."""
+    key: str
+    pipeline: VectorPipeline
+    embed_stages: Dict[str, EmbedStage] = field(default_factory=dict)
+
+
+@dataclass
+class LoadStage:
+    """Fetches and reads every file of the payload once."""
+    key: str
+    pipeline: VectorPipeline
+    chunk_stages: Dict[str, ChunkStage] = field(default_factory=dict)
+
+
+class ExecutionPlan:
+    """
+    DAG of the distinct stages needed by the strategies of a payload.
+
+    Strategies that share a reader share the load stage, strategies that also share a pipeline type, node parser and
+    transformations share the chunk stage, and strategies that also share an embedding model share the embed stage.
+    Each distinct stage runs once and its output fans out to the stages below it. Files dropped by any stage are
+    missing from the files stored by some target, and reported by `failed_file_ids` once the plan has run.
+    """
+
+    def __init__(self, payload: AddNodesPayload, pipelines: Optional[List[BasePipeline]] = None):
+        self.payload = payload
+        self.load_stages: Dict[str, LoadStage] = {}
+        # Pipelines that cannot be decomposed into shared stages run on their own
+        self.standalone: List[BasePipeline] = []
+        # Target key -> IDs of the files the target stored
+        self.stored_file_ids: Dict[str, Set[str]] = {}
+
+        if pipelines is None:
+            pipelines = [BasePipeline.get_pipeline(strategy_name=strategy_name) for strategy_name in payload.strategies]
+        for pipeline in pipelines:
+            self.add_pipeline(pipeline)
+
+    @classmethod
+    async def acreate(cls, payload: AddNodesPayload) -> 'ExecutionPlan':
+        """Plan a payload from the event loop, building strategies used for the first time in a worker thread."""
+        pipelines = [await BasePipeline.aget_pipeline(strategy_name=strategy_name) for strategy_name in payload.strategies]
+        return cls(payload, pipelines)
+
+    def add_pipeline(self, pipeline: BasePipeline) -> None:
+        """Place a pipeline's stages in the DAG, reusing identical stages that are already planned."""
+        if not isinstance(pipeline, VectorPipeline):
+            self.standalone.append(pipeline)
+            return
+
+        load_key = component_key(pipeline.file_parser)
+        load_stage = self.load_stages.setdefault(load_key, LoadStage(key=load_key, pipeline=pipeline))
+
+        # Graph pipelines also pull the extracted graph out of the nodes, so they never share a chunk stage with vector ones
+        chunk_key = '|'.join([pipeline.pipeline_type, component_key(pipeline.node_parser)] + [component_key(t) for t in pipeline.transformations])
+        chunk_stage = load_stage.chunk_stages.setdefault(chunk_key, ChunkStage(key=chunk_key, pipeline=pipeline))
+
+        embed_key = embedding_key(pipeline.embed_model)
+        embed_stage = chunk_stage.embed_stages.setdefault(embed_key, EmbedStage(key=embed_key, pipeline=pipeline))
+
+        store_namespace = create_store_namespace(self.payload.namespace, pipeline_type=pipeline.pipeline_type)
+        embed_stage.targets.setdefault(target_key(store_namespace, pipeline), (store_namespace, pipeline))
+
+    def describe(self) -> Dict[str, int]:
+        """Count the distinct stages of the plan."""
+        chunk_stages = [c for l in self.load_stages.values() for c in l.chunk_stages.values()]
+        embed_stages = [e for c in chunk_stages for e in c.embed_stages.values()]
+        return {
+            'strategies': len(self.payload.strategies),
+            'load_stages': len(self.load_stages),
+            'chunk_stages': len(chunk_stages),
+            'embed_stages': len(embed_stages),
+            'store_targets': sum(len(e.targets) for e in embed_stages),
+            'standalone': len(self.standalone),
+        }
+
+    def failed_file_ids(self) -> List[str]:
+        """IDs of the payload's files that some store target did not store. Standalone pipelines raise instead."""
+        targets = [key for load_stage in self.load_stages.values()
+                   for chunk_stage in load_stage.chunk_stages.values()
+                   for embed_stage in chunk_stage.embed_stages.values()
+                   for key in embed_stage.targets]
+        return [file_payload.file_id for file_payload in self.payload.files
+                if any(file_payload.file_id not in self.stored_file_ids.get(key, ()) for key in targets)]
+
+    def execute(self) -> List[str]:
+        """Run every distinct stage once and return the IDs added to the stores."""
+        logger.info(f"Executing plan for namespace '{self.payload.namespace}': {self.describe()}")
+        index_ids = []
+
+        # Every file is downloaded once, concurrently, and stays staged locally for all load stages
+        with FileSpool.staged([file_payload.file_path for file_payload in self.payload.files]):
+            for load_stage in self.load_stages.values():
+                documents = self._run_load_stage(load_stage)
+                for chunk_stage in load_stage.chunk_stages.values():
+                    parsed_files = self._run_chunk_stage(chunk_stage, documents)
+                    shared = len(chunk_stage.embed_stages) == 1
+                    for embed_stage in chunk_stage.embed_stages.values():
+                        # Different embedding models must not write into the same node objects
+                        stage_files = parsed_files if shared else copy.deepcopy(parsed_files)
+                        index_ids.extend(self._run_embed_stage(embed_stage, stage_files))
+
+        for pipeline in self.standalone:
+            store_namespace = create_store_namespace(self.payload.namespace, pipeline_type=pipeline.pipeline_type)
+            index_ids.extend(pipeline.execute(store_namespace=store_namespace,
+                                              file_payloads=self.payload.files,
+                                              payload_metadata=self.payload.payload_metadata,
+                                              incremental=self.payload.incremental) or [])
+        return index_ids
+
+    async def aexecute(self) -> List[str]:
+        """
+        Run the plan asynchronously with the stages overlapped.
+
+        The DAG becomes a tree of asynchronous stages joined by bounded queues: one fetch stage feeds every load
+        stage, and each stage's output fans out to the stages below it, ending in one store stage per target.
+        """
+        logger.info(f"Executing plan for namespace '{self.payload.namespace}': {self.describe()}")
+        index_ids = []
+
+        if self.load_stages:
+            root = self._build_async_stages()
+            results = await run_stages(root, self.payload.files)
+            index_ids.extend(index_id for ids in results for index_id in ids)
+
+        for pipeline in self.standalone:
+            store_namespace = create_store_namespace(self.payload.namespace, pipeline_type=pipeline.pipeline_type)
+            execute = getattr(pipeline, 'aexecute', None)
+            kwargs = dict(store_namespace=store_namespace,
+                          file_payloads=self.payload.files,
+                          payload_metadata=self.payload.payload_metadata,
+                          incremental=self.payload.incremental)
+            ids = await execute(**kwargs) if execute else await asyncio.to_thread(pipeline.execute, **kwargs)
+            index_ids.extend(ids or [])
+        return index_ids
+
+    def _build_async_stages(self) -> Stage:
+        payload_metadata = self.payload.payload_metadata
+        load_stages = list(self.load_stages.values())
+
+        async def fetch(file_payload: FilePayload):
+            file_payload, local_path = await load_stages[0].pipeline.afetch_file(file_payload)
+            # One pin per load stage, each releases its own once the file is loaded
+            FileSpool.pin([local_path] * (len(load_stages) - 1))
+            return file_payload, local_path
+
+        root = Stage('fetch', fetch, workers=workmait_config.FILE_SPOOL_CONCURRENCY)
+        for load_stage in load_stages:
+            load = root.then(Stage(f'load:{load_stage.key}', self._async_load(load_stage, payload_metadata),
+                                   workers=workmait_config.PIPELINE_LOAD_WORKERS))
+            for chunk_stage in load_stage.chunk_stages.values():
+                chunk = load.then(Stage(f'chunk:{chunk_stage.key}', self._async_chunk(chunk_stage)))
+                shared = len(chunk_stage.embed_stages) == 1
+                for embed_stage in chunk_stage.embed_stages.values():
+                    embed = chunk.then(BatchStage(f'embed:{embed_stage.key}', self._async_embed(embed_stage, shared),
+                                                  max_weight=embed_stage.pipeline.embedding_batcher.limits.max_items,
+                                                  weight=lambda parsed_file: len(parsed_file.nodes)))
+                    for key, (store_namespace, pipeline) in embed_stage.targets.items():
+                        embed.then(Stage(f'store:{key}', self._async_store(key, store_namespace, pipeline)))
+        return root
+
+    @staticmethod
+    def _async_load(load_stage: LoadStage, payload_metadata: Dict[str, Any]):
+        async def load(item):
+            file_payload, local_path = item
+            try:
+                return file_payload, await load_stage.pipeline.aload_documents(file_payload, local_path, payload_metadata)
+            finally:
+                FileSpool.unpin([local_path])
+        return load
+
+    @staticmethod
+    def _async_chunk(chunk_stage: ChunkStage):
+        async def chunk(item):
+            file_payload, documents = item
+            return await chunk_stage.pipeline.aparse_file(file_payload, documents)
+        return chunk
+
+    def _async_embed(self, embed_stage: EmbedStage, shared: bool):
+        async def embed(parsed_files: List[ParsedFile]):
+            if not shared:
+                # Different embedding models must not write into the same node objects
+                parsed_files = copy.deepcopy(parsed_files)
+            to_embed, target_files = await asyncio.to_thread(self._split_targets, embed_stage, parsed_files)
+            embedded_files = await embed_stage.pipeline.aembed_files(to_embed)
+            return self._embedded_targets(target_files, embedded_files)
+        return embed
+
+    def _async_store(self, key: str, store_namespace: str, pipeline: VectorPipeline):
+        async def store(target_files: Dict[str, List[ParsedFile]]):
+            files = await pipeline.aextract_files(target_files[key])
+            return await asyncio.to_thread(self._store_files, key, store_namespace, pipeline, files)
+        return store
+
+    def _run_load_stage(self, load_stage: LoadStage) -> Dict[str, List]:
+        documents = {}
+        for file_payload in self.payload.files:
+            try:
+                documents[file_payload.file_id] = load_stage.pipeline.load_documents(file_payload, self.payload.payload_metadata)
+            except exceptions.PipelineException as e:
+                logger.error(f"Execution error for file '{file_payload.file_path}': {e}")
+        return documents
+
+    def _run_chunk_stage(self, chunk_stage: ChunkStage, documents: Dict[str, List]) -> List[ParsedFile]:
+        parsed_files = []
+        for file_payload in self._files_with(documents):
+            try:
+                parsed_files.append(chunk_stage.pipeline.parse_file(file_payload, documents[file_payload.file_id]))
+            except exceptions.PipelineException as e:
+                logger.error(f"Execution error for file '{file_payload.file_path}': {e}")
+        return parsed_files
+
+    def _run_embed_stage(self, embed_stage: EmbedStage, parsed_files: List[ParsedFile]) -> List[str]:
+        to_embed, target_files = self._split_targets(embed_stage, parsed_files)
+        embedded_files = embed_stage.pipeline.embed_files(to_embed)
+        index_ids = []
+        for key, files in self._embedded_targets(target_files, embedded_files).items():
+            store_namespace, pipeline = embed_stage.targets[key]
+            index_ids.extend(self._store_files(key, store_namespace, pipeline, pipeline.extract_files(files)))
+        return index_ids
+
+    def _store_files(self, key: str, store_namespace: str, pipeline: VectorPipeline, parsed_files: List[ParsedFile]) -> List[str]:
+        """Store the files of a target one by one, recording the ones the target stored."""
+        index_ids = []
+        stored = self.stored_file_ids.setdefault(key, set())
+        for parsed_file in parsed_files:
+            try:
+                index_ids.extend(pipeline.store_file(store_namespace, parsed_file))
+            except exceptions.PipelineException as e:
+                logger.error(f"Execution error for file '{parsed_file.file_payload.file_path}': {e}")
+                continue
+            stored.add(parsed_file.file_payload.file_id)
+        return index_ids
+
+    def _split_targets(self, embed_stage: EmbedStage, parsed_files: List[ParsedFile]) -> Tuple[List[ParsedFile], Dict[str, List[ParsedFile]]]:
+        """
+        Work out what to embed once for the embed stage and what each target should store.
+
+        Without incremental mode every target stores every node. In incremental mode each target is diffed
+        against what it already indexes and the union of the nodes any target is missing is embedded.
+        """
+        if not self.payload.incremental:
+            return parsed_files, {key: parsed_files for key in embed_stage.targets}
+
+        target_files: Dict[str, List[ParsedFile]] = {}
+        for key, (store_namespace, pipeline) in embed_stage.targets.items():
+            target_files[key] = []
+            for parsed_file in parsed_files:
+                try:
+                    target_files[key].append(pipeline.diff_indexed_nodes(store_namespace, parsed_file))
+                except exceptions.PipelineException as e:
+                    logger.error(f"Execution error for file '{parsed_file.file_payload.file_path}': {e}")
+
+        needed_ids = {node.node_id for files in target_files.values() for f in files for node in f.nodes}
+        to_embed = [ParsedFile(file_payload=f.file_payload, nodes=[node for node in f.nodes if node.node_id in needed_ids])
+                    for f in parsed_files]
+        return to_embed, target_files
+
+    @staticmethod
+    def _embedded_targets(target_files: Dict[str, List[ParsedFile]], embedded_files: List[ParsedFile]) -> Dict[str, List[ParsedFile]]:
+        """
+        Keep, for every target, the files whose embedding succeeded. Each target gets its own graph of the files, so
+        targets extracting with different models do not see each other's extractions.
+        """
+        embedded_file_ids = {f.file_payload.file_id for f in embedded_files}
+        return {key: [dataclasses.replace(f, graph=dict(f.graph)) for f in files if f.file_payload.file_id in embedded_file_ids]
+                for key, files in target_files.items()}
+
+    def _files_with(self, documents: Dict[str, List]) -> List[FilePayload]:
+        return [file_payload for file_payload in self.payload.files if file_payload.file_id in documents]
@@ -0,0 +1,131 @@
+# app/pipelines/process_pool.py
+
+import asyncio
+import logging
+import multiprocessing
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.common import exceptions
+
+from app.common.metrics import MetricsRegistry
+from app.config import workmait_config
+
+logger = logging.getLogger(__name__)
+
+
+# --------------------------------------------------------------------------------------------------------------- #
+# Worker side. Everything below runs inside the pool's processes and must stay importable at module level.
+
+
+def _warm_worker() -> None:
+    """Register every strategy once per worker. Each is built by its first task and stays loaded between tasks."""
+    from app.common.initialization import initialize_strategies
+    from app.strategies import vector_strategies, graph_strategies
+
+    initialize_strategies(vector_strategies=vector_strategies, graph_strategies=graph_strategies)
+
+
+def _run_task(task: Callable, data: bytes) -> Tuple[bytes, float, float]:
+    """Unpickle the arguments, run the task and pickle its result, timing the compute and the serialization."""
+    args = pickle.loads(data)
+    started = time.perf_counter()
+    result = task(*args)
+    computed = time.perf_counter()
+    output = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+    return output, computed - started, time.perf_counter() - computed
+
+
+def load_task(strategy_name: str, file_payload, local_path: str, payload_metadata: Dict[str, Any]) -> List:
+    """Load a staged file with the strategy's reader."""
+    from app.pipelines.pipeline import BasePipeline
+
+    pipeline = BasePipeline.get_pipeline(strategy_name=strategy_name)
+    full_metadata = pipeline._create_file_metadata(file_payload, payload_metadata)
+    return pipeline._load_data(local_path, full_metadata)
+
+
+def parse_task(strategy_name: str, file_payload, documents: List, kwargs: Optional[Dict[str, Any]] = None):
+    """Chunk and transform a file's documents with the strategy's node parser."""
+    from app.pipelines.pipeline import BasePipeline
+
+    return BasePipeline.get_pipeline(strategy_name=strategy_name).parse_file(file_payload, documents, **(kwargs or {}))
+
+
+# --------------------------------------------------------------------------------------------------------------- #
+# Caller side.
+
+
+class ParseProcessPool:
+    """
+    Pool of warm worker processes for the CPU-bound reading, chunking and element parsing stages.
+
+    Arguments and results are pickled explicitly so the cost of moving them between processes is measured:
+    serialization time and payload size are recorded next to the compute time of every task.
+
+    A worker that dies breaks the whole pool and fails every task it held. The pool is then replaced and each of
+    those tasks is retried once on the new pool. A task that breaks the pool again raises a ProcessPoolException.
+    """
+    _executor: ProcessPoolExecutor = None
+
+    @classmethod
+    def enabled(cls) -> bool:
+        """Whether the stages should run in worker processes instead of threads."""
+        return workmait_config.PARSE_PROCESS_POOL_SIZE > 0
+
+    @classmethod
+    def get_executor(cls) -> ProcessPoolExecutor:
+        """Return the process pool, starting its workers if needed."""
+        if cls._executor is None:
+            # Spawned workers do not inherit the event loop, sockets or locks of this process
+            cls._executor = ProcessPoolExecutor(max_workers=workmait_config.PARSE_PROCESS_POOL_SIZE,
+                                                mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=_warm_worker)
+        return cls._executor
+
+    @classmethod
+    async def run(cls, task: Callable, *args: Any) -> Any:
+        """Run a task in a worker process and return its result."""
+        started = time.perf_counter()
+        data = pickle.dumps(args, protocol=pickle.HIGHEST_PROTOCOL)
+        serialize_s = time.perf_counter() - started
+
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            executor = cls.get_executor()
+            try:
+                output, compute_s, worker_serialize_s = await loop.run_in_executor(executor, _run_task, task, data)
+                break
+            except BrokenProcessPool as e:
+                cls._replace(executor)
+                if attempt:
+                    raise exceptions.ProcessPoolException(f"ProcessPoolException: Worker died running '{task.__name__}': {e}")
+                logger.warning(f"Process pool broke running '{task.__name__}', retrying on a new pool: {e}")
+
+        started = time.perf_counter()
+        result = pickle.loads(output)
+        serialize_s += worker_serialize_s + time.perf_counter() - started
+
+        name = task.__name__
+        MetricsRegistry.observe(f'process_pool.{name}.compute_seconds', compute_s)
+        MetricsRegistry.observe(f'process_pool.{name}.serialize_seconds', serialize_s)
+        MetricsRegistry.observe(f'process_pool.{name}.bytes', len(data) + len(output))
+        return result
+
+    @classmethod
+    def _replace(cls, executor: ProcessPoolExecutor) -> None:
+        """Drop a broken pool, once, so the next task starts a new one."""
+        if cls._executor is executor:
+            cls._executor = None
+            MetricsRegistry.increment('process_pool.restarts')
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @classmethod
+    def shutdown(cls) -> None:
+        """Stop the worker processes."""
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=False, cancel_futures=True)
+            cls._executor = None
@@ -0,0 +1,146 @@
+# app/pipelines/stages.py
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, Tuple
+
+from app.common import exceptions
+from app.config import workmait_config
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+class Stage:
+    """
+    A step of an asynchronous pipeline, connected to the stages after it by bounded queues.
+
+    Each of the stage's workers takes an item from the input queue, runs `fn` on it and puts the result on the
+    queue of every child stage, so a full child queue pauses the stages before it. A `None` result drops the item,
+    as does any exception raised for it, which is logged and recorded in `failed` so one bad file never fails the
+    rest of the payload.
+    """
+
+    def __init__(self,
+                 name: str,
+                 fn: Callable[[Any], Awaitable[Any]],
+                 workers: int = 1,
+                 queue_size: Optional[int] = None):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size or workmait_config.PIPELINE_STAGE_QUEUE_SIZE)
+        self.children: List['Stage'] = []
+        # Outputs of a stage without children
+        self.results: List[Any] = []
+        # Items dropped because `fn` raised, with the error
+        self.failed: List[Tuple[Any, Exception]] = []
+
+    def then(self, stage: 'Stage') -> 'Stage':
+        """Feed this stage's results into another stage and return that stage."""
+        self.children.append(stage)
+        return stage
+
+    async def run(self) -> None:
+        """Run the workers until the input is exhausted, then signal the end to the child stages."""
+        await asyncio.gather(*(self._work() for _ in range(self.workers)))
+        for child in self.children:
+            await child.queue.put(_DONE)
+
+    async def _next_item(self) -> Any:
+        item = await self.queue.get()
+        if item is _DONE:
+            # Leave the marker for the sibling workers
+            self.queue.put_nowait(_DONE)
+        return item
+
+    async def _work(self) -> None:
+        while True:
+            item = await self._next_item()
+            if item is _DONE:
+                return
+            await self._process(item)
+
+    async def _process(self, item: Any) -> None:
+        try:
+            result = await self.fn(item)
+        except exceptions.PipelineException as e:
+            logger.error(f"Stage '{self.name}' dropped an item: {e}")
+            self.failed.append((item, e))
+            return
+        except Exception as e:
+            logger.exception(f"Stage '{self.name}' dropped an item after an unexpected error: {e}")
+            self.failed.append((item, e))
+            return
+        if result is None:
+            return
+        if not self.children:
+            self.results.append(result)
+        for child in self.children:
+            await child.queue.put(result)
+
+
+class BatchStage(Stage):
+    """
+    A stage whose `fn` takes a list of items. A worker waits for one item, then adds whatever is already queued
+    until `max_weight` is reached, so batches grow when upstream stages run ahead and stay small when they do not.
+    """
+
+    def __init__(self,
+                 name: str,
+                 fn: Callable[[List[Any]], Awaitable[Any]],
+                 max_weight: int,
+                 weight: Callable[[Any], int] = lambda item: 1,
+                 workers: int = 1,
+                 queue_size: Optional[int] = None):
+        super().__init__(name, fn, workers=workers, queue_size=queue_size)
+        self.max_weight = max_weight
+        self.weight = weight
+
+    async def _work(self) -> None:
+        while True:
+            item = await self._next_item()
+            if item is _DONE:
+                return
+
+            batch, total = [item], self.weight(item)
+            while total < self.max_weight and not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is _DONE:
+                    self.queue.put_nowait(_DONE)
+                    break
+                batch.append(item)
+                total += self.weight(item)
+            await self._process(batch)
+
+
+def _all_stages(root: Stage) -> List[Stage]:
+    stages, pending = [], [root]
+    while pending:
+        stage = pending.pop()
+        if stage not in stages:
+            stages.append(stage)
+            pending.extend(stage.children)
+    return stages
+
+
+async def run_stages(root: Stage, items: Iterable[Any]) -> List[Any]:
+    """
+    Run a tree of stages over the items and return the results of every leaf stage.
+    """
+    stages = _all_stages(root)
+
+    async def feed() -> None:
+        for item in items:
+            await root.queue.put(item)
+        await root.queue.put(_DONE)
+
+    tasks = [asyncio.create_task(feed())] + [asyncio.create_task(stage.run()) for stage in stages]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return [result for stage in stages if not stage.children for result in stage.results]
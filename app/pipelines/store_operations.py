@@ -0,0 +1,106 @@
+# app/pipelines/store_operations.py
+
+import logging
+from typing import Dict, List, Set, Type
+
+from app.clients import BaseStoreClient, PineconeClient, Neo4jClient, NodeManifest
+from app.common import exceptions
+from app.common.utils import create_store_namespace, file_id_prefix
+
+logger = logging.getLogger(__name__)
+
+# Store client behind each type of store namespace
+STORE_CLIENTS: Dict[str, Type[BaseStoreClient]] = {
+    'vector': PineconeClient,
+    'graph': Neo4jClient,
+}
+
+
+def indexed_node_ids(store_namespace: str, store_client: Type[BaseStoreClient], file_ids: List[str]) -> Dict[str, Set[str]]:
+    """
+    Return the node IDs of each file in the store namespace from the manifest. Files indexed before the manifest
+    existed are looked up by ID prefix when the store supports listing.
+    """
+    node_ids = NodeManifest.get_many(store_namespace, file_ids)
+    if hasattr(store_client, 'list_ids'):
+        for file_id, ids in node_ids.items():
+            if not ids and not NodeManifest.has_file(store_namespace, file_id):
+                node_ids[file_id] = set(store_client.list_ids(store_namespace, prefix=file_id_prefix(file_id)))
+    return node_ids
+
+
+def delete_file_nodes(namespace: str, file_ids: List[str]) -> Dict[str, int]:
+    """
+    Delete the nodes of the files from every store namespace of the namespace, as batched deletes by ID.
+    Returns the number of nodes deleted per store namespace.
+    """
+    deleted = {}
+    for pipeline_type, store_client in STORE_CLIENTS.items():
+        store_namespace = create_store_namespace(namespace, pipeline_type=pipeline_type)
+        try:
+            node_ids = indexed_node_ids(store_namespace, store_client, file_ids)
+            ids = sorted(node_id for ids in node_ids.values() for node_id in ids)
+            if ids:
+                store_client.delete_ids(store_namespace, ids)
+            # Forgotten only once the store delete succeeded, so a failed delete can be retried
+            NodeManifest.drop(store_namespace, file_ids)
+        except Exception as e:
+            logger.error(f"Error deleting nodes of files {file_ids} from namespace '{store_namespace}': {e}")
+            raise exceptions.StoreException(f"StoreException: Error deleting nodes from namespace '{store_namespace}': {e}")
+        deleted[store_namespace] = len(ids)
+        logger.info(f"Deleted {len(ids)} nodes of {len(file_ids)} files from namespace '{store_namespace}'")
+    return deleted
+
+
+def delete_namespace(namespace: str) -> None:
+    """
+    Drop every store namespace of the namespace with namespace-level deletes, then clear its manifest.
+    """
+    for pipeline_type, store_client in STORE_CLIENTS.items():
+        store_namespace = create_store_namespace(namespace, pipeline_type=pipeline_type)
+        try:
+            store_client.delete_namespace(store_namespace)
+            file_count = NodeManifest.clear(store_namespace)
+        except Exception as e:
+            logger.error(f"Error deleting namespace '{store_namespace}': {e}")
+            raise exceptions.StoreException(f"StoreException: Error deleting namespace '{store_namespace}': {e}")
+        logger.info(f"Deleted namespace '{store_namespace}' holding {file_count} files")
+
+
+def move_file_nodes(source_namespace: str, target_namespace: str, file_ids: List[str]) -> Dict[str, int]:
+    """
+    Move the nodes of the files between namespaces by copying their stored vectors and graph nodes, so nothing is
+    parsed or embedded again. The source is only deleted from once the copy is confirmed.
+    Returns the number of nodes moved per target store namespace.
+
+    Store namespaces are moved one after the other, without rollback: if the graph move fails after the vector
+    move succeeded, the file is half-moved. The move is safe to run again, and the failed event is retried.
+    Copies are upserts by node ID, and a store namespace whose nodes already left the source has nothing to copy,
+    so a re-run finishes the remaining store namespaces. Moving to the same namespace is a no-op.
+    """
+    if source_namespace == target_namespace:
+        logger.warning(f"Ignoring move of files {file_ids} from namespace '{source_namespace}' to itself")
+        return {}
+
+    moved = {}
+    for pipeline_type, store_client in STORE_CLIENTS.items():
+        source = create_store_namespace(source_namespace, pipeline_type=pipeline_type)
+        target = create_store_namespace(target_namespace, pipeline_type=pipeline_type)
+        try:
+            node_ids = indexed_node_ids(source, store_client, file_ids)
+            ids = sorted(node_id for ids in node_ids.values() for node_id in ids)
+            if ids:
+                # Tracked in the target first, so a failed copy leaves nothing untracked there
+                for file_id, file_node_ids in node_ids.items():
+                    NodeManifest.add(target, file_id, file_node_ids)
+                copied = store_client.copy_ids(source, target, ids)
+                store_client.delete_ids(source, ids)
+            else:
+                copied = 0
+            NodeManifest.drop(source, file_ids)
+        except Exception as e:
+            logger.error(f"Error moving nodes of files {file_ids} from '{source}' to '{target}': {e}")
+            raise exceptions.StoreException(f"StoreException: Error moving nodes from '{source}' to '{target}': {e}")
+        moved[target] = copied
+        logger.info(f"Moved {copied} nodes of {len(file_ids)} files from '{source}' to '{target}'")
+    return moved
@@ -1,25 +1,29 @@
 # app/pipelines/vector_pipeline.py
 
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
+import asyncio
 import logging
 
 
-from app.pipelines.pipeline import BasePipeline
-from app.clients import PineconeClient, BaseAIClient, OpenAIClient, S3Client, RemoteFileServiceClient
+from app.pipelines.pipeline import BasePipeline, ParsedFile
+from app.clients import PineconeClient, BaseAIClient, OpenAIClient, S3Client, RemoteFileServiceClient, FileSpool, NodeManifest
 from app.payloads import FilePayload
 
-from app.common.llama import (LlamaParse,
-                              NodeParser,
+from app.common.llama import (NodeParser,
                               BaseReader,
                               BaseElementNodeParser,
                               MarkdownElementNodeParser,
                               TransformComponent,
-                              IngestionPipeline)
+                              IngestionPipeline,
+                              BaseEmbedding)
 
 from app.config import workmait_config
-from app.common.utils import read_from_file_service, id_func, add_embedding_model
+from app.common.utils import read_from_file_service, assign_node_ids, file_id_prefix
 from app.common import exceptions
+from app.pipelines.embedding import EmbeddingBatcher, EmbeddingMicroBatcher
+from app.pipelines.stages import Stage, BatchStage, run_stages
+from app.pipelines.process_pool import ParseProcessPool, load_task, parse_task
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +34,8 @@ logger = logging.getLogger(__name__)
 
 
 class VectorPipeline(BasePipeline):
+    PIPELINE_TYPE: str = 'vector'
+
     def __init__(self,
                  strategy_name: str,
                  file_parser: BaseReader,
@@ -41,13 +47,19 @@ class VectorPipeline(BasePipeline):
         """
         Initialize the Vector Pipeline.
         """
-        super().__init__(strategy_name, 'vector')
+        super().__init__(strategy_name, self.PIPELINE_TYPE)
 
         self.file_parser = file_parser
         self.node_parser = node_parser
-        self.embed_model = ai_client.embedding
-        self.store_client = store_client or PineconeClient.get_index()
-        self.transformations = list(set(transformations))
+        self.embed_model = ai_client.uncached_embedding
+        micro_batcher = EmbeddingMicroBatcher.for_client(ai_client) if workmait_config.EMBEDDING_MICRO_BATCH_WINDOW_MS > 0 else None
+        self.embedding_batcher = EmbeddingBatcher(self.embed_model,
+                                                  cache=ai_client.embedding_cache,
+                                                  micro_batcher=micro_batcher,
+                                                  rate_limiter=ai_client.embedding_rate_limiter)
+        self.store_client = store_client or PineconeClient
+        # Embedding is batched across files by the pipeline, never inside the per-file transformations
+        self.transformations = [t for t in dict.fromkeys(transformations) if not isinstance(t, BaseEmbedding)]
 
     @classmethod
     def create_pipeline(cls,
@@ -57,54 +69,223 @@ class VectorPipeline(BasePipeline):
                         node_parser: NodeParser,
                         transformations: List[TransformComponent],
                         store_client: Optional[PineconeClient] = None,
+                        **pipeline_kwargs: Any
                         ) -> 'VectorPipeline':
         """
         Build the pipeline.
         """
-        embed_model = ai_client.embedding
-        # Ensure unique transformations by converting to a set and back to a list
-        add_embedding_model(transformations, embed_model)
-        instance = cls(strategy_name, file_parser, node_parser, ai_client, transformations, store_client)
+        instance = cls(strategy_name, file_parser, node_parser, ai_client, transformations, store_client, **pipeline_kwargs)
         cls.register_pipeline(strategy_name, instance)
         return instance
 
-    def execute(self, store_namespace: str, file_payloads: List[FilePayload], payload_metadata: Dict[str, Any] = None, **kwargs) -> List[str]:
-        """Execute the pipeline."""
-        index_ids = []
+    def execute(self,
+                store_namespace: str,
+                file_payloads: List[FilePayload],
+                payload_metadata: Dict[str, Any] = None,
+                incremental: bool = False,
+                **kwargs) -> List[str]:
+        """
+        Execute the pipeline.
+
+        Files are parsed and transformed one by one, then the nodes of every file are embedded together so small
+        files share embedding requests, and finally each file is added to the store.
+
+        In incremental mode, only chunks whose deterministic ID is not already indexed are embedded and upserted,
+        and chunks of the previous version of the file that no longer exist are deleted.
+        """
+        parsed_files = []
+        with FileSpool.staged([file_payload.file_path for file_payload in file_payloads]):
+            for file_payload in file_payloads:
+                try:
+                    documents = self.load_documents(file_payload, payload_metadata)
+                    parsed_file = self.parse_file(file_payload, documents, **kwargs)
+                    if incremental:
+                        parsed_file = self.diff_indexed_nodes(store_namespace, parsed_file)
+                    parsed_files.append(parsed_file)
+                except exceptions.PipelineException as e:
+                    logger.error(f"Execution error for file '{file_payload.file_path}': {e}")
+                    continue
+
+        return self.store_files(store_namespace, self.extract_files(self.embed_files(parsed_files)))
+
+    async def aexecute(self,
+                       store_namespace: str,
+                       file_payloads: List[FilePayload],
+                       payload_metadata: Dict[str, Any] = None,
+                       incremental: bool = False,
+                       **kwargs) -> List[str]:
+        """
+        Execute the pipeline asynchronously with the stages overlapped.
+
+        Fetch, load, chunk, embed and store run concurrently and are connected by bounded queues, so one file can be
+        loading while the previous one is embedding and the one before is being stored. Embedding takes whatever
+        parsed files are queued, up to one request's worth of nodes, per batch.
+        """
+        root = Stage('fetch', self.afetch_file, workers=workmait_config.FILE_SPOOL_CONCURRENCY)
+
+        async def load(item: Tuple[FilePayload, Path]):
+            file_payload, local_path = item
+            try:
+                return file_payload, await self.aload_documents(file_payload, local_path, payload_metadata)
+            finally:
+                FileSpool.unpin([local_path])
+
+        async def chunk(item: Tuple[FilePayload, List]):
+            file_payload, documents = item
+            parsed_file = await self.aparse_file(file_payload, documents, **kwargs)
+            if incremental:
+                parsed_file = await asyncio.to_thread(self.diff_indexed_nodes, store_namespace, parsed_file)
+            return parsed_file
+
+        async def store(parsed_files: List[ParsedFile]):
+            parsed_files = await self.aextract_files(parsed_files)
+            return await asyncio.to_thread(self.store_files, store_namespace, parsed_files)
+
+        (root
+         .then(Stage('load', load, workers=workmait_config.PIPELINE_LOAD_WORKERS))
+         .then(Stage('chunk', chunk))
+         .then(BatchStage('embed', self.aembed_files,
+                          max_weight=self.embedding_batcher.limits.max_items,
+                          weight=lambda parsed_file: len(parsed_file.nodes)))
+         .then(Stage('store', store)))
+
+        results = await run_stages(root, file_payloads)
+        return [index_id for index_ids in results for index_id in index_ids]
+
+    # ---------------------------------------------------------------------------------------------------------- #
+    # Stages, also composed by the ExecutionPlanner to share work between strategies
+
+    def load_documents(self, file_payload: FilePayload, payload_metadata: Dict[str, Any] = None) -> List:
+        """Fetch a file and load it into documents."""
+        full_metadata = self._create_file_metadata(file_payload, payload_metadata)
+        local_path = self._read_from_file_service(file_payload.file_path)
+        return self._load_data(str(local_path), full_metadata)
+
+    async def afetch_file(self, file_payload: FilePayload) -> Tuple[FilePayload, Path]:
+        """Stage a file locally in a thread and pin it until it has been loaded."""
+        local_path = await asyncio.to_thread(self._read_from_file_service, file_payload.file_path, True)
+        return file_payload, local_path
+
+    async def aload_documents(self, file_payload: FilePayload, local_path: Path, payload_metadata: Dict[str, Any] = None) -> List:
+        """
+        Load a staged file, using the reader's async API when it has a real one. Local readers are CPU-bound and
+        run in the process pool when it is enabled, otherwise in a thread.
+        """
+        full_metadata = self._create_file_metadata(file_payload, payload_metadata)
+        if type(self.file_parser).aload_data is BaseReader.aload_data:
+            # The base implementation calls load_data directly and would block the loop
+            if ParseProcessPool.enabled():
+                return await ParseProcessPool.run(load_task, self.strategy_name, file_payload, str(local_path), payload_metadata)
+            return await asyncio.to_thread(self._load_data, str(local_path), full_metadata)
         try:
-            store = self.store_client.get_or_create_store(store_namespace)
+            return await self.file_parser.aload_data(file_path=str(local_path), extra_info=full_metadata)
         except Exception as e:
-            logger.error(f"Error getting or creating store for namespace '{store_namespace}': {e}")
-            raise exceptions.StoreException(f"StoreCreationException: Error getting or creating store for namespace '{store_namespace}': {e}")
+            logger.error(f"Error loading data from file '{file_payload.file_path}': {e}")
+            raise exceptions.FileLoadingException(f"FileLoadingException: Error loading data from file '{file_payload.file_path}': {e}")
 
-        for file_payload in file_payloads:
+    def parse_file(self, file_payload: FilePayload, documents: List, **kwargs) -> ParsedFile:
+        """Chunk documents into nodes, run the transformations and assign deterministic node IDs."""
+        raw_nodes = self._get_nodes_from_documents(file_id=file_payload.file_id, documents=documents)
+        nodes = self._ingest_nodes(raw_nodes, file_payload.file_id, **kwargs)
+        return ParsedFile(file_payload=file_payload, nodes=assign_node_ids(nodes, file_payload.file_id))
+
+    async def aparse_file(self, file_payload: FilePayload, documents: List, **kwargs) -> ParsedFile:
+        """Run `parse_file` in the process pool when it is enabled, otherwise in a thread."""
+        if ParseProcessPool.enabled():
+            return await ParseProcessPool.run(parse_task, self.strategy_name, file_payload, documents, kwargs)
+        return await asyncio.to_thread(self.parse_file, file_payload, documents, **kwargs)
+
+    def diff_indexed_nodes(self, store_namespace: str, parsed_file: ParsedFile) -> ParsedFile:
+        """
+        Return the part of a parsed file that is not indexed in the namespace yet, along with the indexed IDs of a
+        previous version of the file that are no longer produced.
+        """
+        file_id = parsed_file.file_payload.file_id
+        try:
+            indexed_ids = NodeManifest.get(store_namespace, file_id)
+            if not indexed_ids and not NodeManifest.has_file(store_namespace, file_id):
+                # Files indexed before the manifest existed are found by listing their ID prefix
+                indexed_ids = set(self.store_client.list_ids(store_namespace, prefix=file_id_prefix(file_id)))
+                NodeManifest.add(store_namespace, file_id, indexed_ids)
+        except Exception as e:
+            logger.error(f"Error listing indexed nodes for file '{file_id}': {e}")
+            raise exceptions.StoreException(f"StoreException: Error listing indexed nodes for file '{file_id}': {e}")
+
+        current_ids = {node.node_id for node in parsed_file.nodes}
+        diffed_file = ParsedFile(file_payload=parsed_file.file_payload,
+                                 nodes=[node for node in parsed_file.nodes if node.node_id not in indexed_ids],
+                                 stale_ids=sorted(indexed_ids - current_ids),
+                                 graph={node_id: elements for node_id, elements in parsed_file.graph.items() if node_id not in indexed_ids})
+        logger.info(f"Incremental ingestion of file '{file_id}': {len(diffed_file.nodes)} new or changed, "
+                    f"{len(diffed_file.stale_ids)} removed, {len(current_ids) - len(diffed_file.nodes)} unchanged")
+        return diffed_file
+
+    def embed_files(self, parsed_files: List[ParsedFile]) -> List[ParsedFile]:
+        """Embed the nodes of all files together, dropping files that have nodes whose embedding failed."""
+        all_nodes = [node for parsed_file in parsed_files for node in parsed_file.nodes]
+        failed_ids = {node.node_id for node in self.embedding_batcher.embed_nodes(all_nodes)} if all_nodes else set()
+        return self._drop_failed_files(parsed_files, failed_ids)
+
+    @staticmethod
+    def _drop_failed_files(parsed_files: List[ParsedFile], failed_ids) -> List[ParsedFile]:
+        embedded_files = []
+        for parsed_file in parsed_files:
+            if any(node.node_id in failed_ids for node in parsed_file.nodes):
+                logger.error(f"Embedding error for file '{parsed_file.file_payload.file_path}', skipping file")
+                continue
+            embedded_files.append(parsed_file)
+        return embedded_files
+
+    async def aembed_files(self, parsed_files: List[ParsedFile]) -> List[ParsedFile]:
+        """Async variant of `embed_files`."""
+        all_nodes = [node for parsed_file in parsed_files for node in parsed_file.nodes]
+        failed_ids = {node.node_id for node in await self.embedding_batcher.aembed_nodes(all_nodes)} if all_nodes else set()
+        return self._drop_failed_files(parsed_files, failed_ids)
+
+    def extract_files(self, parsed_files: List[ParsedFile]) -> List[ParsedFile]:
+        """Extract what the store needs besides the embedded nodes. Vector stores need nothing else."""
+        return parsed_files
+
+    async def aextract_files(self, parsed_files: List[ParsedFile]) -> List[ParsedFile]:
+        """Async variant of `extract_files`."""
+        return parsed_files
+
+    def store_files(self, store_namespace: str, parsed_files: List[ParsedFile]) -> List[str]:
+        """Add the embedded nodes of each file to the store and delete its stale nodes."""
+        index_ids = []
+        for parsed_file in parsed_files:
             try:
-                full_metadata = self._create_file_metadata(file_payload, payload_metadata)
-                self.read_from_file_service(file_payload.file_path)
-                documents = self._load_data(file_payload.file_path, full_metadata)
-                raw_nodes = self._get_nodes_from_documents(file_id=file_payload.file_id, documents=documents)
-                nodes_to_index = self._ingest_nodes(raw_nodes, file_payload.file_id, **kwargs)
-                index_ids.extend(self._add_nodes_to_store(store, nodes_to_index, file_payload.file_path))
-            except exceptions.PipelineStepException as e:
-                logger.error(f"Execution error for file '{file_payload.file_path}': {e}")
+                index_ids.extend(self.store_file(store_namespace, parsed_file))
+            except exceptions.PipelineException as e:
+                logger.error(f"Execution error for file '{parsed_file.file_payload.file_path}': {e}")
                 continue
+        return index_ids
 
+    def store_file(self, store_namespace: str, parsed_file: ParsedFile) -> List[str]:
+        """Add the embedded nodes of a file to the store and delete its stale nodes. Raises when the store fails."""
+        index_ids = []
+        if parsed_file.nodes:
+            index_ids.extend(self._add_nodes_to_store(store_namespace, parsed_file))
+        if parsed_file.stale_ids:
+            self._delete_stale_nodes(store_namespace, parsed_file)
         return index_ids
 
+    # ---------------------------------------------------------------------------------------------------------- #
+
     def _create_file_metadata(self, file_payload: FilePayload, payload_metadata: Dict[str, Any]) -> Dict[str, Any]:
         """Create full metadata from payload and file metadata."""
         try:
-            full_metadata = payload_metadata or {}
+            full_metadata = dict(payload_metadata or {})
             full_metadata.update(file_payload.file_metadata or {})
             return full_metadata
         except Exception as e:
             logger.error(f"Error creating file metadata for file '{file_payload.file_path}': {e}")
             raise exceptions.MetadataCreationException(f"MetadataCreationException: Error creating file metadata for file '{file_payload.file_path}': {e}")
 
-    def _read_from_file_service(self, file_path: str):
-        """Read from file service (placeholder implementation)."""
+    def _read_from_file_service(self, file_path: str, pin: bool = False) -> Path:
+        """Stage the file locally, served from the spool when it was prefetched."""
         try:
-            read_from_file_service(file_path)
+            return read_from_file_service(file_path, pin=pin)
         except Exception as e:
             logger.error(f"Error reading from file service for file '{file_path}': {e}")
             raise exceptions.FileServiceException(f"FileServiceException: Error reading from file service for file '{file_path}': {e}")
@@ -120,34 +301,48 @@ class VectorPipeline(BasePipeline):
     def _get_nodes_from_documents(self, file_id: str, documents: List):
         """Get nodes from documents."""
         try:
-            return self.node_parser.get_nodes_from_documents(documents=documents, id_func=id_func(file_id=file_id))
+            return self.node_parser.get_nodes_from_documents(documents=documents)
         except Exception as e:
             logger.error(f"Error getting nodes from documents: {e}")
             raise exceptions.NodeParsingException(f"NodeParsingException: Error getting nodes from documents: {e}")
 
     def _ingest_nodes(self, raw_nodes, file_id: str, **kwargs):
-        """Process raw nodes."""
+        """Run the non-embedding transformations over the raw nodes of a file."""
         try:
             node_pipeline = self._create_node_pipeline(file_id=file_id, **kwargs)
-            embedded_nodes = node_pipeline.run(nodes=raw_nodes)
+            transformed_nodes = node_pipeline.run(nodes=raw_nodes)
             if isinstance(self.node_parser, BaseElementNodeParser):
-                base_nodes, object_nodes = self.node_parser.get_nodes_and_objects(embedded_nodes)
+                base_nodes, object_nodes = self.node_parser.get_nodes_and_objects(transformed_nodes)
                 return base_nodes + object_nodes
-            return embedded_nodes
+            return transformed_nodes
         except Exception as e:
             logger.error(f"Node processing error: {e}")
             raise exceptions.NodeIngestionException(f"NodeIngestionException: Node processing error: {e}")
 
-    def _add_nodes_to_store(self, store, nodes_to_index, file_path: str):
-        """Add nodes to store."""
+    def _add_nodes_to_store(self, store_namespace: str, parsed_file: ParsedFile) -> List[str]:
+        """Record the nodes of a file in the manifest and upsert them to the store."""
+        file_payload = parsed_file.file_payload
         try:
-            return store.add(nodes=nodes_to_index)
+            # Recorded first, so a failed upsert leaves IDs that are safe to delete rather than untracked vectors
+            NodeManifest.add(store_namespace, file_payload.file_id, [node.node_id for node in parsed_file.nodes])
+            return self._upsert_nodes(store_namespace, parsed_file)
         except Exception as e:
-            logger.error(f"Error adding nodes to store for file '{file_path}': {e}")
-            raise exceptions.StoreAdditionException(f"StoreAdditionException: Error adding nodes to store for file '{file_path}': {e}")
+            logger.error(f"Error adding nodes to store for file '{file_payload.file_path}': {e}")
+            raise exceptions.StoreAdditionException(f"StoreAdditionException: Error adding nodes to store for file '{file_payload.file_path}': {e}")
+
+    def _upsert_nodes(self, store_namespace: str, parsed_file: ParsedFile) -> List[str]:
+        """Upsert the nodes of a file to the vector store in concurrent batches."""
+        return self.store_client.upsert_nodes(store_namespace, parsed_file.nodes)
+
+    def _delete_stale_nodes(self, store_namespace: str, parsed_file: ParsedFile) -> None:
+        """Delete the nodes of a previous version of the file that are no longer produced."""
+        try:
+            self.store_client.delete_ids(store_namespace, parsed_file.stale_ids)
+            NodeManifest.remove(store_namespace, parsed_file.file_payload.file_id, parsed_file.stale_ids)
+        except Exception as e:
+            logger.error(f"Error deleting stale nodes for file '{parsed_file.file_payload.file_path}': {e}")
+            raise exceptions.StoreException(f"StoreException: Error deleting stale nodes for file '{parsed_file.file_payload.file_path}': {e}")
 
     def _create_node_pipeline(self, **kwargs):
         """Create an ingestion pipeline."""
-        transformations = list(set(self.transformations))
-
-        return IngestionPipeline(transformations=transformations)
+        return IngestionPipeline(transformations=self.transformations)
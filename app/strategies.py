@@ -1,37 +1,38 @@
-from app.common.llama import *
-from app.clients import OpenAIClient, PineconeClient
+from app.common import llama
+from app.clients import OpenAIClient
 
 
+# Strategies are specs: callable values are factories, called when the strategy is first used
 vector_strategies = {
     "strategy_1": {
         "strategy_name": "strategy_1",
-        "ai_client": OpenAIClient(model_name='gpt-3.5-turbo'),
-        "file_parser": LlamaParse(),
-        "node_parser": NodeParser(),
-        "transformations": [TransformComponent()],
+        "ai_client": lambda: OpenAIClient(model_name='gpt-3.5-turbo'),
+        "file_parser": lambda: llama.LlamaParse(),
+        "node_parser": lambda: llama.NodeParser(),
+        "transformations": lambda: [llama.TransformComponent()],
     },
     "strategy_2": {
         "strategy_name": "strategy_2",
-        "ai_client": OpenAIClient(model_name='gpt-4'),
-        "file_parser": BaseReader(),
-        "node_parser": NodeParser(),
-        "transformations": [TransformComponent()],
+        "ai_client": lambda: OpenAIClient(model_name='gpt-4'),
+        "file_parser": lambda: llama.BaseReader(),
+        "node_parser": lambda: llama.NodeParser(),
+        "transformations": lambda: [llama.TransformComponent()],
     }
 }
 
 graph_strategies = {
     "strategy_3": {
         "strategy_name": "strategy_3",
-        "ai_client": OpenAIClient(model_name='gpt-3.5-turbo'),
-        "file_parser": BaseReader(),
-        "node_parser": NodeParser(),
-        "transformations": [TransformComponent()],
+        "ai_client": lambda: OpenAIClient(model_name='gpt-3.5-turbo'),
+        "file_parser": lambda: llama.BaseReader(),
+        "node_parser": lambda: llama.NodeParser(),
+        "transformations": lambda: [llama.TransformComponent()],
     },
     "strategy_4": {
         "strategy_name": "strategy_4",
-        "ai_client": OpenAIClient(model_name='gpt-4-turbo'),
-        "file_parser": BaseReader(),
-        "node_parser": NodeParser(),
-        "transformations": [TransformComponent()],
+        "ai_client": lambda: OpenAIClient(model_name='gpt-4-turbo'),
+        "file_parser": lambda: llama.BaseReader(),
+        "node_parser": lambda: llama.NodeParser(),
+        "transformations": lambda: [llama.TransformComponent()],
     }
 }
@@ -0,0 +1,93 @@
+"""
+Benchmark of the event envelope: encode and decode throughput of add nodes payloads, their encoded size, and the
+stream memory per event when a Redis server is reachable.
+
+    python -m benchmarks.events --files 1 10 100 --events 2000 --redis-url redis://localhost:6379/15
+"""
+
+import argparse
+import random
+import time
+import uuid
+
+import redis
+
+from app.clients.event_codec import EventCodec
+from app.config import workmait_config
+from app.payloads import AddNodesPayload, FilePayload, FileType
+
+
+def make_payload(files: int) -> AddNodesPayload:
+    return AddNodesPayload(
+        namespace='benchmark',
+        strategies=['vector_simple', 'graph_simple'],
+        files=[FilePayload(file_id=str(uuid.uuid4()),
+                           file_type=random.choice(list(FileType)),
+                           file_path=f"uploads/benchmark/{uuid.uuid4()}/report-{i}.pdf",
+                           file_metadata={'size': random.randint(10 ** 4, 10 ** 7),
+                                          'title': f"Quarterly report {i}",
+                                          'uploaded_by': 'benchmark@example.com',
+                                          'tags': ['finance', 'quarterly', 'internal']})
+               for i in range(files)],
+        payload_metadata={'source': 'benchmark', 'request_id': str(uuid.uuid4())})
+
+
+def pydantic_fields(payload: AddNodesPayload):
+    # Baseline, the whole model as one JSON field through pydantic
+    return {b'json': payload.model_dump_json().encode('utf-8')}
+
+
+def pydantic_decode(event) -> AddNodesPayload:
+    return AddNodesPayload.model_validate_json(event[b'json'])
+
+
+def envelope_decode(event) -> AddNodesPayload:
+    return AddNodesPayload(**EventCodec.decode(event))
+
+
+def measure(name: str, encode, decode, payloads, client) -> None:
+    started = time.perf_counter()
+    encoded = [encode(payload) for payload in payloads]
+    encode_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for event in encoded:
+        decode(event)
+    decode_s = time.perf_counter() - started
+
+    size = sum(len(value) for event in encoded for value in event.values()) / len(encoded)
+    line = (f"{name:<12} encode {len(payloads) / encode_s:>9.0f}/s  decode {len(payloads) / decode_s:>9.0f}/s  "
+            f"{size:>8.0f} bytes/event")
+
+    if client is not None:
+        stream = f"benchmark:events:{uuid.uuid4()}"
+        pipe = client.pipeline(transaction=False)
+        for event in encoded:
+            pipe.xadd(stream, event)
+        pipe.execute()
+        memory = client.memory_usage(stream, samples=0)
+        client.delete(stream)
+        line += f"  {memory / len(encoded):>8.0f} stream bytes/event"
+    print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--redis-url', default=None, help='Redis used to measure stream memory, skipped when unset')
+    args = parser.parse_args()
+
+    client = redis.Redis.from_url(args.redis_url) if args.redis_url else None
+    random.seed(0)
+    for files in args.files:
+        payloads = [make_payload(files) for _ in range(args.events)]
+        print(f"{files} files per event:")
+        measure('pydantic', pydantic_fields, pydantic_decode, payloads, client)
+        for compression in ('none', 'zstd'):
+            workmait_config.EVENT_COMPRESSION = compression
+            measure(f"envelope/{compression}", EventCodec.encode, envelope_decode, payloads, client)
+
+
+if __name__ == '__main__':
+    main()
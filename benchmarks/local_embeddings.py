@@ -0,0 +1,90 @@
+"""
+Offline benchmark of the local embedding engine against in-process inference, with a tiny randomly initialized
+BERT model built on the fly, so no network access is needed.
+
+    python -m benchmarks.local_embeddings --texts 2000 --workers 1 2 4 --callers 8
+"""
+
+import argparse
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from app.clients import LocalEmbeddingEngine
+
+
+def build_tiny_model(path: Path, vocab_size: int = 1000) -> str:
+    """Save a small random BERT and its tokenizer, loadable by sentence-transformers."""
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    vocab = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + [f"w{i}" for i in range(vocab_size)]
+    vocab_file = path / 'vocab.txt'
+    vocab_file.write_text('\n'.join(vocab))
+    BertTokenizerFast(vocab_file=str(vocab_file)).save_pretrained(str(path))
+
+    config = BertConfig(vocab_size=len(vocab), hidden_size=64, num_hidden_layers=2, num_attention_heads=2,
+                        intermediate_size=128, max_position_embeddings=512)
+    BertModel(config).save_pretrained(str(path))
+    return str(path)
+
+
+def make_texts(count: int, vocab_size: int = 1000):
+    # Mostly short chunks with a long tail, as produced by the node parsers
+    lengths = [min(500, int(random.paretovariate(1.5) * 20)) for _ in range(count)]
+    return [' '.join(f"w{random.randrange(vocab_size)}" for _ in range(length)) for length in lengths]
+
+
+def run_in_process(model_path: str, texts, batch_size: int) -> np.ndarray:
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_path, device='cpu')
+    started = time.perf_counter()
+    vectors = model.encode(texts, batch_size=batch_size, normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False)
+    elapsed = time.perf_counter() - started
+    print(f"in-process               {len(texts) / elapsed:>8.0f} texts/s")
+    return vectors
+
+
+def run_engine(model_path: str, texts, workers: int, callers: int, batch_size: int, expected: np.ndarray) -> None:
+    engine = LocalEmbeddingEngine(model_name=model_path, num_workers=workers, max_batch_size=batch_size)
+    # Warm the workers so model loading is not timed
+    engine.embed(texts[:workers * batch_size])
+
+    # Several callers submit their share concurrently, as concurrent pipelines do
+    shares = [texts[i::callers] for i in range(callers)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        results = list(executor.map(engine.embed, shares))
+    elapsed = time.perf_counter() - started
+    engine.close()
+
+    vectors = np.empty_like(expected)
+    for i, result in enumerate(results):
+        vectors[i::callers] = result
+    error = float(np.abs(vectors - expected).max())
+    print(f"engine workers={workers:<2} callers={callers:<2} {len(texts) / elapsed:>8.0f} texts/s  max abs error={error:.2e}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--texts', type=int, default=2000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--callers', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args()
+
+    random.seed(0)
+    texts = make_texts(args.texts)
+    with tempfile.TemporaryDirectory() as directory:
+        model_path = build_tiny_model(Path(directory))
+        expected = run_in_process(model_path, texts, args.batch_size)
+        for workers in args.workers:
+            run_engine(model_path, texts, workers, args.callers, args.batch_size, expected)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Offline throughput benchmark of the Pinecone upsert engine against the in-memory index.
+
+    python -m benchmarks.pinecone_upserts --vectors 5000 --latency-ms 40
+"""
+
+import argparse
+import random
+import time
+
+from app.clients import InMemoryIndex, PineconeClient
+from app.config import workmait_config
+
+
+def make_vectors(count: int, dimensions: int, text_bytes: int):
+    text = 'x' * text_bytes
+    return [
+        {'id': f"file#{i}#{i:016x}", 'values': [random.random() for _ in range(dimensions)], 'metadata': {'text': text, 'file_id': 'file'}}
+        for i in range(count)
+    ]
+
+
+def run(vectors, batch_size: int, concurrency: int, latency_s: float, failure_rate: float) -> None:
+    workmait_config.PC_UPSERT_BATCH_SIZE = batch_size
+    workmait_config.PC_UPSERT_CONCURRENCY = concurrency
+    workmait_config.PC_UPSERT_BACKOFF_S = 0.0
+    PineconeClient.close()
+    index = InMemoryIndex(latency_s=latency_s, failure_rate=failure_rate)
+    PineconeClient._index_instance = index
+
+    started = time.perf_counter()
+    upserted = PineconeClient.upsert_vectors('benchmark', vectors)
+    elapsed = time.perf_counter() - started
+
+    stored = index.describe_index_stats()['total_vector_count']
+    print(f"batch={batch_size:<5} concurrency={concurrency:<3} requests={index.requests:<5} "
+          f"upserted={upserted}/{stored} {upserted / elapsed:>10.0f} vectors/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vectors', type=int, default=5000)
+    parser.add_argument('--dimensions', type=int, default=1536)
+    parser.add_argument('--text-bytes', type=int, default=1500)
+    parser.add_argument('--latency-ms', type=float, default=40.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    vectors = make_vectors(args.vectors, args.dimensions, args.text_bytes)
+    for batch_size, concurrency in [(100, 1), (100, 4), (200, 4), (200, 8), (1000, 8)]:
+        run(vectors, batch_size, concurrency, args.latency_ms / 1000, args.failure_rate)
+    PineconeClient.close()
+
+
+if __name__ == '__main__':
+    main()
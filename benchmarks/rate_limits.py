@@ -0,0 +1,169 @@
+"""
+Benchmark of the rate limit controller against a local fake OpenAI embeddings server that enforces request and
+token budgets, answers 429 with `retry-after-ms` once they are spent and slows down when overloaded.
+
+    python -m benchmarks.rate_limits --requests 300 --rpm 1200 --tpm 120000
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from openai import AsyncOpenAI
+
+from app.clients.rate_limiter import RateLimitController
+from app.common.metrics import MetricsRegistry
+
+
+class FakeLimits:
+    """Server side request and token buckets, refilled per second from per-minute limits."""
+
+    def __init__(self, rpm: float, tpm: float, latency_s: float, capacity: int):
+        self.rpm, self.tpm = rpm, tpm
+        self.requests, self.tokens = rpm / 60, tpm / 60
+        self.latency_s = latency_s
+        self.capacity = capacity
+        self.in_flight = 0
+        self.updated = time.monotonic()
+        self.stats = {'ok': 0, 'throttled': 0}
+        self.lock = threading.Lock()
+
+    def admit(self, tokens: int):
+        """Return the status, rate limit headers and latency of a request."""
+        with self.lock:
+            now = time.monotonic()
+            elapsed, self.updated = now - self.updated, now
+            self.requests = min(self.rpm / 60, self.requests + elapsed * self.rpm / 60)
+            self.tokens = min(self.tpm / 60, self.tokens + elapsed * self.tpm / 60)
+
+            admitted = self.requests >= 1 and self.tokens >= tokens
+            if admitted:
+                self.requests -= 1
+                self.tokens -= tokens
+                self.in_flight += 1
+            self.stats['ok' if admitted else 'throttled'] += 1
+
+            wait_s = max((1 - self.requests) * 60 / self.rpm, (tokens - self.tokens) * 60 / self.tpm, 0)
+            headers = {
+                'x-ratelimit-limit-requests': str(int(self.rpm)),
+                'x-ratelimit-limit-tokens': str(int(self.tpm)),
+                'x-ratelimit-remaining-requests': str(max(0, int(self.requests))),
+                'x-ratelimit-remaining-tokens': str(max(0, int(self.tokens))),
+                'x-ratelimit-reset-requests': f"{int(max(0, 1 - self.requests) * 60000 / self.rpm)}ms",
+                'x-ratelimit-reset-tokens': f"{int(max(0, tokens - self.tokens) * 60000 / self.tpm)}ms",
+            }
+            if not admitted:
+                headers['retry-after-ms'] = str(int(wait_s * 1000) + 1)
+            # Requests beyond the server's capacity queue up and slow every request down
+            latency = self.latency_s * (1 + max(0, self.in_flight - self.capacity) / self.capacity)
+            return (200 if admitted else 429), headers, latency
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+
+def make_handler(limits: FakeLimits):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            texts = body['input'] if isinstance(body['input'], list) else [body['input']]
+            tokens = sum(len(text.split()) for text in texts)
+            status, headers, latency = limits.admit(tokens)
+            if status == 200:
+                time.sleep(latency)
+                limits.release()
+                payload = {'object': 'list', 'model': body['model'],
+                           'data': [{'object': 'embedding', 'index': i, 'embedding': [0.0] * 8} for i in range(len(texts))],
+                           'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}}
+            else:
+                payload = {'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}}
+
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def make_batches(count: int, texts_per_request: int):
+    return [[' '.join('word' for _ in range(random.randint(20, 80))) for _ in range(texts_per_request)] for _ in range(count)]
+
+
+async def run_naive(base_url: str, batches, concurrency: int):
+    """Fixed concurrency with the SDK's own retries, as the clients behave without the controller."""
+    client = AsyncOpenAI(api_key='test', base_url=base_url, max_retries=5)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(texts):
+        async with semaphore:
+            await client.embeddings.create(model='text-embedding-3-small', input=texts)
+
+    return await asyncio.gather(*(call(texts) for texts in batches), return_exceptions=True)
+
+
+async def run_controlled(base_url: str, batches, concurrency: int):
+    controller = RateLimitController('benchmark', requests_per_minute=3500, tokens_per_minute=1000000,
+                                     initial_concurrency=4, max_concurrency=concurrency, max_retries=10)
+
+    async def on_response(response):
+        controller.on_response(response)
+
+    http_client = httpx.AsyncClient(event_hooks={'response': [on_response]})
+    client = AsyncOpenAI(api_key='test', base_url=base_url, max_retries=0, http_client=http_client)
+
+    async def call(texts):
+        tokens = sum(len(text.split()) for text in texts)
+        await controller.arun(lambda: client.embeddings.create(model='text-embedding-3-small', input=texts), tokens)
+
+    results = await asyncio.gather(*(call(texts) for texts in batches), return_exceptions=True)
+    print(f"  final concurrency limit {controller.stats()['limit']:.1f}")
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--texts-per-request', type=int, default=4)
+    parser.add_argument('--rpm', type=float, default=1200)
+    parser.add_argument('--tpm', type=float, default=120000)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--server-capacity', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=64)
+    args = parser.parse_args()
+
+    random.seed(0)
+    batches = make_batches(args.requests, args.texts_per_request)
+    for name, runner in (('naive', run_naive), ('controlled', run_controlled)):
+        limits = FakeLimits(args.rpm, args.tpm, args.latency_ms / 1000, args.server_capacity)
+        server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(limits))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+        print(f"{name}:")
+        started = time.perf_counter()
+        results = asyncio.run(runner(base_url, batches, args.concurrency))
+        elapsed = time.perf_counter() - started
+        server.shutdown()
+
+        failed = sum(1 for result in results if isinstance(result, Exception))
+        print(f"  {len(results) - failed}/{len(results)} succeeded in {elapsed:.1f}s "
+              f"({(len(results) - failed) / elapsed:.1f} requests/s), {limits.stats['throttled']} answered 429")
+    print(MetricsRegistry.summarize('rate_limit.benchmark.latency_seconds'))
+
+
+if __name__ == '__main__':
+    main()
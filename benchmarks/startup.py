@@ -0,0 +1,88 @@
+"""
+Startup benchmark: import time of the service and time until the first event's strategies are built and planned.
+
+Every measurement runs in a fresh interpreter so module caches are cold. No network calls are made: clients are
+built but never used.
+
+    python -m benchmarks.startup --runs 3 --strategies strategy_1 strategy_3
+    python -m benchmarks.startup --top 15
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+# Runs in the child interpreter, timing each phase from the first line of the script
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+
+import app.app
+from app.common.initialization import initialize_strategies
+from app.strategies import vector_strategies, graph_strategies
+imported = time.perf_counter()
+
+initialize_strategies(vector_strategies=vector_strategies, graph_strategies=graph_strategies, materialize={preload})
+registered = time.perf_counter()
+
+from app.payloads import AddNodesPayload
+from app.pipelines import ExecutionPlan
+payload = AddNodesPayload(namespace='benchmark', strategies={strategies!r}, files=[], payload_metadata={{}})
+ExecutionPlan(payload)
+planned = time.perf_counter()
+
+print(json.dumps({{
+    'import_s': imported - started,
+    'register_s': registered - imported,
+    'first_event_s': planned - registered,
+    'ready_s': planned - started,
+    'modules': len(sys.modules),
+}}))
+"""
+
+
+def run_child(strategies, preload: bool) -> dict:
+    code = CHILD.format(preload=preload, strategies=list(strategies))
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(top: int):
+    """Return the imports with the largest cumulative time, from `-X importtime`."""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app.app'],
+                            check=True, capture_output=True, text=True).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Only top-level imports, nested ones are indented and included in their parent's cumulative time
+        name = name[1:]
+        if not name.startswith(' '):
+            imports.append((int(cumulative), name))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--strategies', nargs='+', default=['strategy_1'])
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    for preload in (False, True):
+        results = [run_child(args.strategies, preload) for _ in range(args.runs)]
+        summary = {key: statistics.median(result[key] for result in results) for key in results[0]}
+        print(f"preload={str(preload):<5} import={summary['import_s']:.3f}s register={summary['register_s']:.3f}s "
+              f"first_event={summary['first_event_s']:.3f}s ready={summary['ready_s']:.3f}s modules={summary['modules']:.0f}")
+
+    print("\nSlowest top-level imports of app.app:")
+    for cumulative_us, name in slowest_imports(args.top):
+        print(f"  {cumulative_us / 1e6:>7.3f}s  {name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""A local fake of the OpenAI embeddings API, enforcing request and token budgets as the real API does."""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Tuple
+
+
+class FakeLimits:
+    """Server side request and token buckets, refilled per second from per-minute limits."""
+
+    def __init__(self, rpm: float, tpm: float, latency_s: float = 0.0):
+        self.rpm, self.tpm = rpm, tpm
+        self.requests, self.tokens = rpm / 60, tpm / 60
+        self.latency_s = latency_s
+        self.updated = time.monotonic()
+        self.stats = {'ok': 0, 'throttled': 0}
+        self.lock = threading.Lock()
+
+    def admit(self, tokens: int) -> Tuple[int, Dict[str, str], float]:
+        """Return the status, rate limit headers and latency of a request."""
+        with self.lock:
+            now = time.monotonic()
+            elapsed, self.updated = now - self.updated, now
+            self.requests = min(self.rpm / 60, self.requests + elapsed * self.rpm / 60)
+            self.tokens = min(self.tpm / 60, self.tokens + elapsed * self.tpm / 60)
+
+            admitted = self.requests >= 1 and self.tokens >= tokens
+            if admitted:
+                self.requests -= 1
+                self.tokens -= tokens
+            self.stats['ok' if admitted else 'throttled'] += 1
+
+            wait_s = max((1 - self.requests) * 60 / self.rpm, (tokens - self.tokens) * 60 / self.tpm, 0)
+            headers = {
+                'x-ratelimit-limit-requests': str(int(self.rpm)),
+                'x-ratelimit-limit-tokens': str(int(self.tpm)),
+                'x-ratelimit-remaining-requests': str(max(0, int(self.requests))),
+                'x-ratelimit-remaining-tokens': str(max(0, int(self.tokens))),
+                'x-ratelimit-reset-requests': f"{int(max(0, 1 - self.requests) * 60000 / self.rpm)}ms",
+                'x-ratelimit-reset-tokens': f"{int(max(0, tokens - self.tokens) * 60000 / self.tpm)}ms",
+            }
+            if not admitted:
+                headers['retry-after-ms'] = str(int(wait_s * 1000) + 1)
+            return (200 if admitted else 429), headers, self.latency_s
+
+
+class ScriptedLimits(FakeLimits):
+    """Answers the scripted statuses first, without rate limit headers, then admits every request."""
+
+    def __init__(self, statuses, retry_after_ms: int = 200):
+        super().__init__(rpm=6000, tpm=10 ** 7)
+        self.statuses = list(statuses)
+        self.retry_after_ms = retry_after_ms
+
+    def admit(self, tokens: int) -> Tuple[int, Dict[str, str], float]:
+        status, headers, latency = super().admit(tokens)
+        if self.statuses:
+            status = self.statuses.pop(0)
+            headers = {'retry-after-ms': str(self.retry_after_ms)} if status == 429 else {}
+        return status, headers, latency
+
+
+def make_handler(limits: FakeLimits):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            texts = body['input'] if isinstance(body['input'], list) else [body['input']]
+            tokens = sum(len(text.split()) for text in texts)
+            status, headers, latency = limits.admit(tokens)
+            if status == 200:
+                time.sleep(latency)
+                payload = {'object': 'list', 'model': body['model'],
+                           'data': [{'object': 'embedding', 'index': i, 'embedding': [0.0] * 8} for i in range(len(texts))],
+                           'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}}
+            else:
+                payload = {'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}}
+
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+@contextmanager
+def fake_server(limits: FakeLimits) -> Iterator[str]:
+    """Serve the fake API on a free local port and yield its base URL."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(limits))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,74 @@
+"""Fakes shared by the unit tests."""
+
+import asyncio
+import hashlib
+from typing import Any, List
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.llms import MockLLM
+
+
+class FakeEmbedding(BaseEmbedding):
+    """
+    Deterministic embedding model that records every batch it is asked to embed. The responses to the calls listed
+    in `short_calls`, by position, miss their last vector, as a faulty provider's would.
+    """
+    dimensions: int = 4
+    short_calls: List[int] = Field(default_factory=list)
+    calls: List[List[str]] = Field(default_factory=list)
+
+    def __init__(self, **kwargs: Any):
+        kwargs.setdefault('model_name', 'fake-embedding')
+        super().__init__(**kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return 'FakeEmbedding'
+
+    def vector(self, text: str) -> List[float]:
+        """The vector the model returns for a text."""
+        digest = hashlib.sha256(f"{self.model_name}\x00{text}".encode('utf-8')).digest()
+        # Multiples of 1/256 survive the float32 round trip of the cache exactly
+        return [byte / 256 for byte in digest[:self.dimensions]]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        short = len(self.calls) in self.short_calls
+        self.calls.append(list(texts))
+        vectors = [self.vector(text) for text in texts]
+        return vectors[:-1] if short else vectors
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._get_text_embeddings(texts)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embedding(text)
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self.vector(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self.vector(query)
+
+
+class FakeLLM(MockLLM):
+    """
+    LLM whose structured predictions are knowledge graph triplets linking `person` to the organisation named on the
+    last line of the chunk. Predictions yield to the event loop first, so concurrent extractions interleave.
+    """
+    model: str = 'fake-llm'
+    person: str = 'Ada'
+
+    def __init__(self, model: str = 'fake-llm', person: str = 'Ada', **kwargs: Any):
+        super().__init__(**kwargs)
+        self.model = model
+        self.person = person
+
+    async def astructured_predict(self, output_cls: Any, prompt: Any, **prompt_args: Any) -> Any:
+        await asyncio.sleep(0.01)
+        return output_cls.parse_obj({'triplets': [{'subject': {'type': 'PERSON', 'name': self.person},
+                                                   'relation': {'type': 'PART_OF'},
+                                                   'object': {'type': 'ORGANIZATION', 'name': prompt_args['text'].splitlines()[-1]}}]})
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('pydantic')
+
+from app.clients.admission import AdmissionController, AdmissionCost
+
+
+def make_controller(**kwargs) -> AdmissionController:
+    kwargs = {'max_files': 4, 'max_bytes': 1000, 'max_tokens': 1000, 'max_event_share': 0.5, **kwargs}
+    return AdmissionController(**kwargs)
+
+
+def test_event_cost_is_capped_by_its_share():
+    controller = make_controller()
+
+    held = controller.reserve(AdmissionCost(files=10, bytes=5000, tokens=100))
+
+    assert held == AdmissionCost(files=2, bytes=500, tokens=100)
+    assert controller.in_flight == held
+
+
+def test_anything_fits_when_nothing_is_in_flight():
+    controller = make_controller(max_event_share=1.0)
+
+    assert controller.fits(AdmissionCost(files=100, bytes=10 ** 6, tokens=10 ** 6))
+
+
+def test_acquire_waits_for_room():
+    controller = make_controller()
+
+    async def scenario():
+        first = await controller.acquire(AdmissionCost(files=2, bytes=400))
+        second = await controller.acquire(AdmissionCost(files=1, bytes=400))
+        waiting = asyncio.create_task(controller.acquire(AdmissionCost(files=1, bytes=400)))
+        await asyncio.sleep(0.01)
+        blocked = not waiting.done()
+
+        controller.release(first)
+        third = await asyncio.wait_for(waiting, timeout=1)
+        return blocked, [first, second, third]
+
+    blocked, held = asyncio.run(scenario())
+
+    assert blocked
+    assert controller.in_flight == AdmissionCost(files=2, bytes=800)
+    for cost in held[1:]:
+        controller.release(cost)
+    assert controller.in_flight == AdmissionCost()
+
+
+def test_cancelled_acquire_holds_nothing():
+    controller = make_controller()
+
+    async def scenario():
+        held = [await controller.acquire(AdmissionCost(bytes=500)) for _ in range(2)]
+        waiting = asyncio.create_task(controller.acquire(AdmissionCost(bytes=1)))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        for cost in held:
+            controller.release(cost)
+
+    asyncio.run(scenario())
+
+    assert controller.in_flight == AdmissionCost()
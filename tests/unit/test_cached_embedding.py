@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('llama_index.core')
+
+from app.clients.cached_embedding import CachedEmbedding
+from app.common.exceptions import EmbeddingException
+from app.common.embedding_cache import EmbeddingCache, MemoryTier
+from tests.unit.fakes import FakeEmbedding
+
+
+def make_cached(embed_model: FakeEmbedding, memory_tier: MemoryTier = None) -> CachedEmbedding:
+    cache = EmbeddingCache(model_name=embed_model.model_name,
+                           dimensions=embed_model.dimensions,
+                           memory_tier=memory_tier or MemoryTier(max_bytes=10 ** 6))
+    return CachedEmbedding(embed_model, cache)
+
+
+def test_miss_then_hit():
+    embed_model = FakeEmbedding()
+    cached = make_cached(embed_model)
+
+    first = cached.get_text_embedding('alpha')
+    second = cached.get_text_embedding('alpha')
+
+    assert first == second == embed_model.vector('alpha')
+    assert embed_model.calls == [['alpha']]
+    assert (cached.cache.hits, cached.cache.misses) == (1, 1)
+
+
+def test_partial_hit_embeds_only_new_texts_once():
+    embed_model = FakeEmbedding()
+    cached = make_cached(embed_model)
+    cached.get_text_embedding_batch(['alpha', 'beta'])
+
+    vectors = cached.get_text_embedding_batch(['gamma', 'alpha', 'delta', 'gamma', 'beta'])
+
+    assert vectors == [embed_model.vector(text) for text in ['gamma', 'alpha', 'delta', 'gamma', 'beta']]
+    assert embed_model.calls[1:] == [['gamma', 'delta']]
+
+
+def test_async_batch_reads_and_writes_the_cache():
+    embed_model = FakeEmbedding()
+    cached = make_cached(embed_model)
+    cached.get_text_embedding('alpha')
+
+    vectors = asyncio.run(cached.aget_text_embedding_batch(['alpha', 'beta']))
+    again = asyncio.run(cached.aget_text_embedding('beta'))
+
+    assert vectors == [embed_model.vector('alpha'), embed_model.vector('beta')]
+    assert again == embed_model.vector('beta')
+    assert embed_model.calls == [['alpha'], ['beta']]
+
+
+@pytest.mark.parametrize('other', [{'model_name': 'other-embedding'}, {'dimensions': 8}])
+def test_entries_are_keyed_by_model_and_dimensions(other):
+    memory_tier = MemoryTier(max_bytes=10 ** 6)
+    embed_model, other_model = FakeEmbedding(), FakeEmbedding(**other)
+    make_cached(embed_model, memory_tier).get_text_embedding('alpha')
+
+    vector = make_cached(other_model, memory_tier).get_text_embedding('alpha')
+
+    assert vector == other_model.vector('alpha')
+    assert other_model.calls == [['alpha']]
+
+
+def test_short_response_is_not_cached():
+    embed_model = FakeEmbedding(short_calls=[0])
+    cached = make_cached(embed_model)
+
+    with pytest.raises(EmbeddingException):
+        cached.get_text_embedding_batch(['alpha', 'beta'])
+
+    assert cached.get_text_embedding_batch(['alpha', 'beta']) == [embed_model.vector('alpha'), embed_model.vector('beta')]
+    assert embed_model.calls == [['alpha', 'beta'], ['alpha', 'beta']]
+
+
+def test_queries_bypass_the_cache():
+    embed_model = FakeEmbedding()
+    cached = make_cached(embed_model)
+
+    cached.get_query_embedding('alpha')
+    cached.get_text_embedding('alpha')
+
+    assert embed_model.calls == [['alpha']]
+    assert cached.cache.misses == 1
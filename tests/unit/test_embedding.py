@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('llama_index.core')
+
+from llama_index.core.schema import TextNode
+
+from app.common.embedding_cache import EmbeddingCache, MemoryTier
+from app.common.exceptions import EmbeddingException
+from app.pipelines.embedding import EmbeddingBatcher, EmbeddingLimits, EmbeddingMicroBatcher
+from tests.unit.fakes import FakeEmbedding
+
+
+def make_nodes(count: int):
+    return [TextNode(text=f"chunk {i}") for i in range(count)]
+
+
+def make_batcher(embed_model: FakeEmbedding, cache: EmbeddingCache = None) -> EmbeddingBatcher:
+    return EmbeddingBatcher(embed_model, limits=EmbeddingLimits(max_items=3, max_tokens=10 ** 6), cache=cache)
+
+
+def make_cache(embed_model: FakeEmbedding) -> EmbeddingCache:
+    return EmbeddingCache(model_name=embed_model.model_name, dimensions=embed_model.dimensions, memory_tier=MemoryTier(max_bytes=10 ** 6))
+
+
+def test_vectors_land_on_their_nodes():
+    embed_model = FakeEmbedding()
+    nodes = make_nodes(7)
+
+    failed = make_batcher(embed_model).embed_nodes(nodes)
+
+    assert failed == []
+    assert [node.embedding for node in nodes] == [embed_model.vector(node.text) for node in nodes]
+    assert [len(batch) for batch in embed_model.calls] == [3, 3, 1]
+
+
+def test_short_response_fails_its_batch():
+    embed_model = FakeEmbedding(short_calls=[0])
+    cache = make_cache(embed_model)
+    nodes = make_nodes(4)
+
+    failed = make_batcher(embed_model, cache).embed_nodes(nodes)
+
+    assert failed == nodes[:3]
+    assert all(node.embedding is None for node in nodes[:3])
+    assert nodes[3].embedding == embed_model.vector(nodes[3].text)
+    assert list(cache.get_many([node.text for node in nodes])) == [3]
+
+
+def test_short_async_response_fails_its_batch():
+    embed_model = FakeEmbedding(short_calls=[1])
+    cache = make_cache(embed_model)
+    nodes = make_nodes(4)
+
+    failed = asyncio.run(make_batcher(embed_model, cache).aembed_nodes(nodes))
+
+    assert failed == nodes[3:]
+    assert [node.embedding for node in nodes[:3]] == [embed_model.vector(node.text) for node in nodes[:3]]
+    assert nodes[3].embedding is None
+    # Only the vectors of the complete batch are cached, each under its own text
+    cached = cache.get_many([node.text for node in nodes])
+    assert cached == {i: pytest.approx(embed_model.vector(nodes[i].text), abs=1e-6) for i in range(3)}
+
+
+def make_micro_batcher(embed_model: FakeEmbedding) -> EmbeddingMicroBatcher:
+    return EmbeddingMicroBatcher(embed_model, limits=EmbeddingLimits(max_items=100, max_tokens=10 ** 6), window_s=0.01, max_concurrency=1)
+
+
+def test_concurrent_callers_get_their_own_vectors():
+    embed_model = FakeEmbedding()
+    micro_batcher = make_micro_batcher(embed_model)
+    requests = [[f"caller {i} text {j}" for j in range(i + 1)] for i in range(4)]
+
+    async def scenario():
+        return await asyncio.gather(*(micro_batcher.aembed(texts, len(texts)) for texts in requests))
+
+    results = asyncio.run(scenario())
+
+    assert results == [[embed_model.vector(text) for text in texts] for texts in requests]
+    assert len(embed_model.calls) == 1
+
+
+def test_short_response_fails_every_caller_of_the_window():
+    embed_model = FakeEmbedding(short_calls=[0])
+    micro_batcher = make_micro_batcher(embed_model)
+
+    async def scenario():
+        return await asyncio.gather(micro_batcher.aembed(['a', 'b'], 2), micro_batcher.aembed(['c'], 1), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+
+    assert [type(result) for result in results] == [EmbeddingException, EmbeddingException]
@@ -0,0 +1,93 @@
+import pytest
+
+pytest.importorskip('llama_index.core')
+pytest.importorskip('zstandard')
+
+from pydantic import BaseModel
+
+from app.clients import EventCodec
+from app.config import workmait_config
+from app.payloads import AddNodesPayload, FilePayload, FileType
+
+
+class Ping(BaseModel):
+    n: int
+
+
+@pytest.fixture
+def zstd(monkeypatch):
+    monkeypatch.setattr(workmait_config, 'EVENT_COMPRESSION', 'zstd')
+    monkeypatch.setattr(workmait_config, 'EVENT_COMPRESSION_MIN_BYTES', 64)
+
+
+def make_payload(files: int = 20) -> AddNodesPayload:
+    return AddNodesPayload(namespace='tenant',
+                           strategies=['default', 'graph'],
+                           files=[FilePayload(file_id=f"file-{i}",
+                                              file_type=FileType.PDF,
+                                              file_path=f"uploads/tenant/file-{i}.pdf",
+                                              file_metadata={'size': 1024 * i, 'tags': ['report', 'q3'], 'owner': {'id': i}})
+                                  for i in range(files)],
+                           payload_metadata={'source': 'upload', 'nested': {'depth': [1, 2]}},
+                           incremental=True)
+
+
+def flags(fields) -> int:
+    return fields[EventCodec.FIELD][1]
+
+
+def test_round_trip_uncompressed(monkeypatch):
+    monkeypatch.setattr(workmait_config, 'EVENT_COMPRESSION', 'none')
+    payload = make_payload()
+
+    fields = EventCodec.encode(payload)
+
+    assert list(fields) == [EventCodec.FIELD]
+    assert fields[EventCodec.FIELD][0] == EventCodec.VERSION
+    assert flags(fields) == 0
+    assert AddNodesPayload(**EventCodec.decode(fields)) == payload
+
+
+def test_round_trip_compressed(zstd):
+    payload = make_payload()
+
+    fields = EventCodec.encode(payload)
+
+    assert flags(fields) & EventCodec.FLAG_ZSTD
+    assert AddNodesPayload(**EventCodec.decode(fields)) == payload
+    # Entries read back from Redis with decode_responses have string keys
+    assert AddNodesPayload(**EventCodec.decode({EventCodec.FIELD.decode('utf-8'): fields[EventCodec.FIELD]})) == payload
+
+
+def test_body_that_grows_when_compressed_is_kept_raw(zstd, monkeypatch):
+    # The zstd frame adds more to a tiny body than compressing it saves
+    monkeypatch.setattr(workmait_config, 'EVENT_COMPRESSION_MIN_BYTES', 0)
+    payload = Ping(n=1)
+
+    fields = EventCodec.encode(payload)
+
+    assert flags(fields) == 0
+    assert bytes(fields[EventCodec.FIELD][2:]) == b'{"n":1}'
+    assert Ping(**EventCodec.decode(fields)) == payload
+
+
+def test_body_below_the_threshold_is_kept_raw(zstd, monkeypatch):
+    monkeypatch.setattr(workmait_config, 'EVENT_COMPRESSION_MIN_BYTES', 10 ** 6)
+
+    fields = EventCodec.encode(make_payload())
+
+    assert flags(fields) == 0
+
+
+def test_legacy_flat_fields_are_decoded():
+    event = {b'namespace': b'tenant', b'parent_id': b'ADD_NODES_EVENT:1-0', 'children': '2'}
+
+    assert EventCodec.decode(event) == {'namespace': 'tenant', 'parent_id': 'ADD_NODES_EVENT:1-0', 'children': '2'}
+
+
+def test_unknown_version_is_rejected():
+    fields = EventCodec.encode(make_payload(files=1))
+    envelope = bytes((EventCodec.VERSION + 1,)) + fields[EventCodec.FIELD][1:]
+
+    with pytest.raises(ValueError, match='version'):
+        EventCodec.decode({EventCodec.FIELD: envelope})
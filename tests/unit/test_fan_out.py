@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('llama_index.core')
+
+from app.clients import EventCodec, FanOutTracker, RedisClient
+from app.config import WorkmaitConfig, workmait_config
+from app.payloads import AddNodesPayload, AddNodesWorkPayload, FilePayload, FileType
+
+PARENT_ID = 'ADD_NODES_EVENT:1-0'
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    redis_client = fakeredis.FakeRedis()
+    monkeypatch.setattr(RedisClient(), 'redis', redis_client)
+    return redis_client
+
+
+def test_redelivered_child_is_counted_once(redis_client):
+    FanOutTracker.start(PARENT_ID, 2)
+
+    assert FanOutTracker.complete(PARENT_ID, '0') is None
+    assert FanOutTracker.complete(PARENT_ID, '0') is None
+    assert FanOutTracker.complete(PARENT_ID, '1') == 2
+
+
+def test_completion_is_reported_once_while_the_lease_is_held(redis_client):
+    FanOutTracker.start(PARENT_ID, 1)
+
+    assert FanOutTracker.complete(PARENT_ID, '0') == 1
+    # The child is redelivered before the completion is forgotten
+    assert FanOutTracker.complete(PARENT_ID, '0') is None
+
+
+def test_reopen_lets_the_retry_report_the_completion(redis_client):
+    FanOutTracker.start(PARENT_ID, 1)
+    FanOutTracker.complete(PARENT_ID, '0')
+
+    FanOutTracker.reopen(PARENT_ID)
+
+    assert FanOutTracker.complete(PARENT_ID, '0') == 1
+
+
+def test_expired_lease_lets_the_retry_report_the_completion(redis_client):
+    FanOutTracker.start(PARENT_ID, 1)
+    FanOutTracker.complete(PARENT_ID, '0')
+    assert redis_client.ttl(FanOutTracker.claim_key(PARENT_ID)) == workmait_config.FAN_OUT_CLAIM_TTL_S
+
+    # The holder died before reporting, its lease runs out
+    redis_client.pexpire(FanOutTracker.claim_key(PARENT_ID), 1)
+    time.sleep(0.01)
+
+    assert FanOutTracker.complete(PARENT_ID, '0') == 1
+
+
+def test_forgotten_parent_has_nothing_to_report(redis_client):
+    FanOutTracker.start(PARENT_ID, 1)
+    FanOutTracker.complete(PARENT_ID, '0', ['file-0'])
+
+    FanOutTracker.forget(PARENT_ID)
+
+    assert redis_client.keys(f"fanout:{{{PARENT_ID}}}:*") == []
+    assert FanOutTracker.complete(PARENT_ID, '0') is None
+
+
+def test_failed_files_follow_the_latest_run_of_each_child(redis_client):
+    FanOutTracker.start(PARENT_ID, 3)
+
+    FanOutTracker.complete(PARENT_ID, '0', ['file-0'])
+    FanOutTracker.complete(PARENT_ID, '1', ['file-1'])
+    # Split by strategy, another child of the same file fails too
+    FanOutTracker.complete(PARENT_ID, '2', ['file-1'])
+    # A retry of the first child adds its file
+    FanOutTracker.complete(PARENT_ID, '0')
+
+    assert FanOutTracker.failed_file_ids(PARENT_ID) == ['file-1']
+
+
+def test_dead_lettered_child_completes_its_parent_as_failed(redis_client):
+    from app.consumers.add_nodes_work import COMPLETED_EVENT_NAME, add_nodes_work_dead_letter
+
+    files = [FilePayload(file_id=f"file-{i}", file_type=FileType.PDF, file_path=f"file-{i}.pdf", file_metadata={}) for i in range(2)]
+    works = [AddNodesWorkPayload(parent_id=PARENT_ID,
+                                 child_id=str(i),
+                                 payload=AddNodesPayload(namespace='tenant', strategies=['default'], files=[file], payload_metadata={}))
+             for i, file in enumerate(files)]
+    FanOutTracker.start(PARENT_ID, 2)
+    FanOutTracker.complete(PARENT_ID, '0')
+
+    asyncio.run(add_nodes_work_dead_letter(EventCodec.decode(EventCodec.encode(works[1]))))
+
+    [(_, fields)] = redis_client.xrange(COMPLETED_EVENT_NAME)
+    assert EventCodec.decode(fields) == {'parent_id': PARENT_ID, 'namespace': 'tenant', 'children': 2, 'failed_file_ids': ['file-1']}
+    assert redis_client.keys(f"fanout:{{{PARENT_ID}}}:*") == []
+
+
+def test_claim_lease_must_expire_before_entries_are_claimed():
+    with pytest.raises(ValueError):
+        WorkmaitConfig(FAN_OUT_CLAIM_TTL_S=60, REDIS_STREAM_CLAIM_IDLE_MS=60000)
+
+    assert WorkmaitConfig(FAN_OUT_CLAIM_TTL_S=30, REDIS_STREAM_CLAIM_IDLE_MS=60000).FAN_OUT_CLAIM_TTL_S == 30
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('llama_index.core')
+
+from llama_index.core.schema import TextNode
+
+from app.common.llama import KG_NODES_KEY, KG_RELATIONS_KEY, SchemaLLMPathExtractor
+from app.config import workmait_config
+from app.pipelines.graph_extraction import GraphExtractor
+from tests.unit.fakes import FakeLLM
+
+
+@pytest.fixture(autouse=True)
+def memory_cache(monkeypatch):
+    monkeypatch.setattr(workmait_config, 'GRAPH_EXTRACTION_CACHE_PERSISTENT', False)
+    monkeypatch.setattr(GraphExtractor, '_memory_tier', None)
+    monkeypatch.setattr(GraphExtractor, '_persistent_tier', None)
+
+
+@pytest.fixture(scope='module')
+def kg_schema_cls():
+    # The extractor registers a validator when it builds its schema class, which pydantic only allows once per process
+    return SchemaLLMPathExtractor(llm=FakeLLM(), num_workers=1).kg_schema_cls
+
+
+def make_extractor(kg_schema_cls, **kwargs) -> GraphExtractor:
+    return GraphExtractor(FakeLLM(**kwargs), schema={'kg_schema_cls': kg_schema_cls})
+
+
+def names(extraction):
+    entities, _ = extraction
+    return sorted(entity.name for entity in entities)
+
+
+def test_targets_sharing_nodes_keep_their_own_extractions(kg_schema_cls):
+    nodes = [TextNode(text=f"Org {i}", metadata={'page': i}) for i in range(4)]
+    ada = make_extractor(kg_schema_cls, model='model-a', person='Ada')
+    bob = make_extractor(kg_schema_cls, model='model-b', person='Bob')
+
+    async def scenario():
+        return await asyncio.gather(ada.aextract(nodes), bob.aextract(nodes))
+
+    by_ada, by_bob = asyncio.run(scenario())
+
+    for i, node in enumerate(nodes):
+        assert names(by_ada[node.node_id]) == sorted(['Ada', f"Org {i}"])
+        assert names(by_bob[node.node_id]) == sorted(['Bob', f"Org {i}"])
+        entities, relations = by_ada[node.node_id]
+        assert all(entity.properties == {'page': i} for entity in entities)
+        assert all(relation.properties == {'page': i} for relation in relations)
+        # The shared nodes are left untouched
+        assert node.metadata == {'page': i}
+
+    # Each model's cache holds its own extraction
+    cached = asyncio.run(bob.aextract(nodes))
+    assert {node_id: names(extraction) for node_id, extraction in cached.items()} == \
+           {node_id: names(extraction) for node_id, extraction in by_bob.items()}
+
+
+def test_extraction_ignores_graph_metadata_already_on_the_node(kg_schema_cls):
+    node = TextNode(text='Org', metadata={KG_NODES_KEY: ['stale'], KG_RELATIONS_KEY: ['stale']})
+
+    extraction = asyncio.run(make_extractor(kg_schema_cls).aextract([node]))[node.node_id]
+
+    assert names(extraction) == ['Ada', 'Org']
+    assert all(entity.properties == {} for entity in extraction[0])
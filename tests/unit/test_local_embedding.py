@@ -0,0 +1,70 @@
+import random
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('transformers')
+pytest.importorskip('sentence_transformers')
+
+from app.clients import LocalEmbeddingEngine
+from tests.unit.tiny_bert import build_tiny_model, make_texts
+
+
+@pytest.fixture(scope='module')
+def model_path(tmp_path_factory):
+    return build_tiny_model(tmp_path_factory.mktemp('tiny-bert'))
+
+
+@pytest.fixture(scope='module')
+def engine(model_path):
+    # Small buckets, so a request is spread over several buckets and workers
+    engine = LocalEmbeddingEngine(model_name=model_path, num_workers=2, max_batch_size=4, max_batch_tokens=256)
+    yield engine
+    engine.close()
+
+
+def test_matches_in_process_model(engine, model_path):
+    from sentence_transformers import SentenceTransformer
+
+    random.seed(0)
+    texts = make_texts(50)
+    expected = SentenceTransformer(model_path, device='cpu').encode(texts, normalize_embeddings=True, convert_to_numpy=True)
+
+    vectors = engine.embed(texts)
+
+    assert vectors.shape == expected.shape
+    np.testing.assert_allclose(vectors, expected, atol=1e-5)
+
+
+def test_rows_follow_input_order_across_buckets(engine):
+    random.seed(1)
+    texts = make_texts(40)
+    # Lengths are shuffled, so buckets sorted by length hold texts from all over the request
+    single = np.stack([engine.embed([text])[0] for text in texts])
+
+    vectors = engine.embed(texts)
+
+    np.testing.assert_allclose(vectors, single, atol=1e-5)
+
+
+def test_concurrent_requests_get_their_own_rows(engine):
+    random.seed(2)
+    requests = [make_texts(random.randint(1, 12)) for _ in range(8)]
+    futures = [engine.submit(texts) for texts in requests]
+
+    for texts, future in zip(requests, futures):
+        np.testing.assert_allclose(future.result(), engine.embed(texts), atol=1e-5)
+
+
+def test_vectors_are_contiguous_float32(engine):
+    vectors = engine.embed(make_texts(10))
+
+    assert vectors.dtype == np.float32
+    assert vectors.flags['C_CONTIGUOUS']
+
+
+def test_empty_input(engine):
+    vectors = engine.embed([])
+
+    assert vectors.shape[0] == 0
+    assert vectors.dtype == np.float32
@@ -0,0 +1,126 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('llama_index.core')
+
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+
+from app.clients.node_manifest import NodeManifest
+from app.common.utils import assign_node_ids, content_hash, id_func
+from app.payloads import FilePayload, FileType
+from app.pipelines.pipeline import ParsedFile
+from app.pipelines.vector_pipelines import VectorPipeline
+
+FILE_ID = 'file-1'
+NAMESPACE = 'tenant:vector'
+
+
+def parse(texts, metadata=None):
+    """Nodes as a parser produces them: random IDs, linked to their neighbours."""
+    nodes = [TextNode(text=text, metadata=dict(metadata or {})) for text in texts]
+    for previous, node in zip(nodes, nodes[1:]):
+        previous.relationships[NodeRelationship.NEXT] = RelatedNodeInfo(node_id=node.node_id)
+        node.relationships[NodeRelationship.PREVIOUS] = RelatedNodeInfo(node_id=previous.node_id)
+    return assign_node_ids(nodes, FILE_ID)
+
+
+def ids(nodes):
+    return [node.node_id for node in nodes]
+
+
+def test_content_hash_covers_text_and_metadata():
+    assert content_hash('text') == content_hash('text', {})
+    assert content_hash('text', {'a': 1, 'b': 2}) == content_hash('text', {'b': 2, 'a': 1})
+    assert content_hash('text', {'a': 1}) != content_hash('text', {'a': 2})
+    assert content_hash('text') != content_hash('text!')
+
+
+def test_id_func_is_deterministic():
+    assert id_func(FILE_ID, 0, 'text') == f"{FILE_ID}#0#{content_hash('text')}"
+    assert id_func(FILE_ID, 0, 'text') != id_func(FILE_ID, 1, 'text')
+    assert id_func(FILE_ID, 0, 'text') != id_func('file-2', 0, 'text')
+
+
+def test_unchanged_file_gets_identical_ids():
+    texts = ['first chunk', 'second chunk', 'third chunk']
+
+    assert ids(parse(texts, {'page': 1})) == ids(parse(texts, {'page': 1}))
+
+
+def test_edit_changes_only_the_affected_ids():
+    before = ids(parse(['first chunk', 'second chunk', 'third chunk']))
+    after = ids(parse(['first chunk', 'second chunk, edited', 'third chunk']))
+
+    assert [old == new for old, new in zip(before, after)] == [True, False, True]
+
+
+def test_metadata_change_changes_the_ids():
+    assert ids(parse(['chunk'], {'page': 1})) != ids(parse(['chunk'], {'page': 2}))
+
+
+def test_relationships_point_at_the_remapped_ids():
+    first, second, third = parse(['first chunk', 'second chunk', 'third chunk'])
+
+    assert first.relationships[NodeRelationship.NEXT].node_id == second.node_id
+    assert second.relationships[NodeRelationship.PREVIOUS].node_id == first.node_id
+    assert second.relationships[NodeRelationship.NEXT].node_id == third.node_id
+    assert third.relationships[NodeRelationship.PREVIOUS].node_id == second.node_id
+
+
+def test_relationships_outside_the_file_are_kept():
+    node = TextNode(text='chunk')
+    node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id='document-1')
+
+    assign_node_ids([node], FILE_ID)
+
+    assert node.relationships[NodeRelationship.SOURCE].node_id == 'document-1'
+
+
+# ---------------------------------------------------------------------------------------------------------- #
+# Incremental ingestion
+
+
+@pytest.fixture
+def manifest(monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    redis_client = fakeredis.FakeRedis()
+    monkeypatch.setattr(NodeManifest, '_redis', staticmethod(lambda: redis_client))
+    return NodeManifest
+
+
+def diff(nodes, store_ids=()):
+    pipeline = SimpleNamespace(store_client=SimpleNamespace(list_ids=lambda namespace, prefix: list(store_ids)))
+    file_payload = FilePayload(file_id=FILE_ID, file_type=FileType.PDF, file_path='file.pdf', file_metadata={})
+    return VectorPipeline.diff_indexed_nodes(pipeline, NAMESPACE, ParsedFile(file_payload=file_payload, nodes=nodes))
+
+
+def test_diff_keeps_changed_nodes_and_reports_stale_ids(manifest):
+    before = parse(['first chunk', 'second chunk', 'third chunk'])
+    manifest.add(NAMESPACE, FILE_ID, ids(before))
+    after = parse(['first chunk', 'second chunk, edited'])
+
+    diffed = diff(after)
+
+    assert ids(diffed.nodes) == [after[1].node_id]
+    assert diffed.stale_ids == sorted([before[1].node_id, before[2].node_id])
+
+
+def test_diff_of_unchanged_file_is_empty(manifest):
+    nodes = parse(['first chunk', 'second chunk'])
+    manifest.add(NAMESPACE, FILE_ID, ids(nodes))
+
+    diffed = diff(parse(['first chunk', 'second chunk']))
+
+    assert diffed.nodes == []
+    assert diffed.stale_ids == []
+
+
+def test_diff_lists_the_store_for_files_missing_from_the_manifest(manifest):
+    before = parse(['first chunk', 'second chunk'])
+
+    diffed = diff(parse(['first chunk']), store_ids=ids(before))
+
+    assert diffed.nodes == []
+    assert diffed.stale_ids == [before[1].node_id]
+    assert manifest.get(NAMESPACE, FILE_ID) == set(ids(before))
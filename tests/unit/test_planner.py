@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('llama_index.core')
+
+from app.common import exceptions
+from app.payloads import AddNodesPayload, FilePayload, FileType
+from app.pipelines.pipeline import ParsedFile
+from app.pipelines.planner import ChunkStage, EmbedStage, ExecutionPlan, LoadStage
+
+
+class FlakyStore:
+    """Store pipeline failing the files it is told to."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+
+    def store_file(self, store_namespace, parsed_file):
+        if parsed_file.file_payload.file_id in self.failing:
+            raise exceptions.StoreException('store unavailable')
+        return [f"{parsed_file.file_payload.file_id}#0"]
+
+
+def make_plan(file_ids, targets) -> ExecutionPlan:
+    files = [FilePayload(file_id=file_id, file_type=FileType.PDF, file_path=f"{file_id}.pdf", file_metadata={}) for file_id in file_ids]
+    plan = ExecutionPlan(AddNodesPayload(namespace='tenant', strategies=[], files=files, payload_metadata={}), pipelines=[])
+    embed_stage = EmbedStage(key='embed', pipeline=None, targets={key: ('tenant:vector', store) for key, store in targets.items()})
+    chunk_stage = ChunkStage(key='chunk', pipeline=None, embed_stages={'embed': embed_stage})
+    plan.load_stages['load'] = LoadStage(key='load', pipeline=None, chunk_stages={'chunk': chunk_stage})
+    return plan
+
+
+def store(plan: ExecutionPlan, key: str, file_ids):
+    store_namespace, pipeline = plan.load_stages['load'].chunk_stages['chunk'].embed_stages['embed'].targets[key]
+    files = [ParsedFile(file_payload=SimpleNamespace(file_id=file_id, file_path=f"{file_id}.pdf"), nodes=[]) for file_id in file_ids]
+    return plan._store_files(key, store_namespace, pipeline, files)
+
+
+def test_files_stored_by_every_target_succeed():
+    plan = make_plan(['a', 'b'], {'vector': FlakyStore(), 'graph': FlakyStore()})
+
+    assert store(plan, 'vector', ['a', 'b']) == ['a#0', 'b#0']
+    store(plan, 'graph', ['a', 'b'])
+
+    assert plan.failed_file_ids() == []
+
+
+def test_files_a_target_failed_or_never_got_are_failed():
+    plan = make_plan(['a', 'b', 'c'], {'vector': FlakyStore(failing=['b']), 'graph': FlakyStore()})
+
+    assert store(plan, 'vector', ['a', 'b', 'c']) == ['a#0', 'c#0']
+    # File 'c' was dropped before reaching the graph target
+    store(plan, 'graph', ['a', 'b'])
+
+    assert plan.failed_file_ids() == ['b', 'c']
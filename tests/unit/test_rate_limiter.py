@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+import pytest
+
+httpx = pytest.importorskip('httpx')
+openai = pytest.importorskip('openai')
+
+from app.clients.rate_limiter import RateLimitController
+from tests.unit.fake_openai import FakeLimits, ScriptedLimits, fake_server
+
+
+def make_caller(base_url: str, controller: RateLimitController):
+    async def on_response(response):
+        controller.on_response(response)
+
+    client = openai.AsyncOpenAI(api_key='test', base_url=base_url, max_retries=0,
+                                http_client=httpx.AsyncClient(event_hooks={'response': [on_response]}))
+
+    async def call(texts=('word word word',)):
+        return await controller.arun(lambda: client.embeddings.create(model='text-embedding-3-small', input=list(texts)), 3)
+
+    return call
+
+
+def make_controller(**kwargs) -> RateLimitController:
+    kwargs = {'requests_per_minute': 6000, 'tokens_per_minute': 10 ** 7, 'initial_concurrency': 4, **kwargs}
+    return RateLimitController('test', **kwargs)
+
+
+def test_rate_limited_call_is_retried_after_retry_after_and_halves_the_limit():
+    limits = ScriptedLimits([200, 429], retry_after_ms=200)
+    controller = make_controller()
+
+    async def scenario():
+        call = make_caller(base_url, controller)
+        await call()
+        limit = controller.stats()['limit']
+        started = time.monotonic()
+        await call()
+        return limit, time.monotonic() - started
+
+    with fake_server(limits) as base_url:
+        limit_before, elapsed = asyncio.run(scenario())
+
+    assert limits.statuses == []
+    # The retry waited for retry-after, with room for timer resolution
+    assert elapsed >= 0.2 * 0.9
+    # Halved by the 429, then grown by the successful retry
+    halved = limit_before * RateLimitController.RATE_LIMIT_DECREASE
+    assert controller.stats()['limit'] == pytest.approx(halved + 1 / halved)
+
+
+def test_rate_limit_headers_resync_the_buckets():
+    # Two requests per second server side, far below what the controller starts with
+    limits = FakeLimits(rpm=120, tpm=60000)
+    controller = make_controller()
+
+    async def scenario():
+        call = make_caller(base_url, controller)
+        await call()
+        first = controller.stats()
+        for _ in range(3):
+            await call()
+        return first
+
+    with fake_server(limits) as base_url:
+        first = asyncio.run(scenario())
+
+    assert first['requests_available'] <= 1
+    assert first['tokens_available'] < 60000 / 60
+    # Once the request budget is spent, calls wait for its reset instead of being answered 429
+    assert limits.stats == {'ok': 4, 'throttled': 0}
+
+
+def test_cancelled_calls_release_their_slots():
+    limits = FakeLimits(rpm=6000, tpm=10 ** 7, latency_s=5.0)
+    controller = make_controller()
+
+    async def scenario():
+        call = make_caller(base_url, controller)
+        tasks = [asyncio.create_task(call()) for _ in range(3)]
+        while controller.stats()['in_flight'] < 3:
+            await asyncio.sleep(0.01)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    with fake_server(limits) as base_url:
+        asyncio.run(scenario())
+
+    assert controller.stats()['in_flight'] == 0
@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+from app.clients.redis import RedisClient, StreamWorkerPool
+
+EVENT_NAME = 'TEST_EVENT'
+GROUP_NAME = 'test_group'
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = RedisClient()
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(client, 'redis', fakeredis.FakeRedis(server=server))
+    monkeypatch.setattr(client, 'async_redis', fakeredis.aioredis.FakeRedis(server=server))
+    return client
+
+
+def dead_letter(client: RedisClient, on_dead_letter):
+    async def scenario():
+        pool = StreamWorkerPool(client=client, event_name=EVENT_NAME, group_name=GROUP_NAME, callback=lambda event: None,
+                                max_in_flight=1, on_dead_letter=on_dead_letter)
+        client.redis.xgroup_create(EVENT_NAME, GROUP_NAME, id='0', mkstream=True)
+        client.redis.xadd(EVENT_NAME, {'key': 'value'})
+        [[_, [(event_id, event)]]] = client.redis.xreadgroup(GROUP_NAME, 'consumer', {EVENT_NAME: '>'})
+        await client.dead_letter(pool, event_id, event, deliveries=6)
+    asyncio.run(scenario())
+    return client.redis.xpending(EVENT_NAME, GROUP_NAME)['pending'], client.redis.xlen(f"{EVENT_NAME}:dead")
+
+
+def test_dead_letter_callback_gets_the_payload_fields(client):
+    received = []
+
+    async def on_dead_letter(event):
+        received.append(event)
+
+    pending, dead = dead_letter(client, on_dead_letter)
+
+    assert received == [{'key': 'value'}]
+    assert (pending, dead) == (0, 1)
+
+
+def test_failed_dead_letter_callback_leaves_the_entry_pending(client):
+    def on_dead_letter(event):
+        raise RuntimeError('unavailable')
+
+    pending, dead = dead_letter(client, on_dead_letter)
+
+    assert (pending, dead) == (1, 0)
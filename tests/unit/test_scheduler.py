@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('llama_index.core')
+pytest.importorskip('redis')
+
+from app.clients.admission import AdmissionController, AdmissionCost
+from app.consumers.scheduler import FairScheduler
+
+
+def run(scenario):
+    # A slot that is never returned fails the test instead of hanging it
+    return asyncio.run(asyncio.wait_for(scenario(), timeout=5))
+
+
+def make_scheduler(**kwargs) -> FairScheduler:
+    kwargs = {'small_slots': 4, 'large_slots': 1, 'large_cost': 1000, **kwargs}
+    return FairScheduler(**kwargs)
+
+
+def test_granted_payloads_wait_for_admission_room():
+    admission = AdmissionController(max_files=2, max_bytes=10 ** 6, max_tokens=10 ** 6, max_event_share=1.0)
+    scheduler = make_scheduler(admission=admission)
+    running, peak = 0, 0
+
+    async def work():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    async def scenario():
+        await asyncio.gather(*(scheduler.run('tenant', 1, work, admission_cost=AdmissionCost(files=1)) for _ in range(6)))
+
+    run(scenario)
+
+    # Four lane slots, but only two files of admission budget
+    assert peak == 2
+    assert admission.in_flight == AdmissionCost()
+
+
+def test_namespaces_get_their_weighted_share():
+    scheduler = make_scheduler(small_slots=1, weights={'heavy': 2.0})
+    order = []
+
+    def work(namespace):
+        async def call():
+            order.append(namespace)
+            await asyncio.sleep(0)
+        return call
+
+    async def scenario():
+        await asyncio.gather(*(scheduler.run(namespace, 1, work(namespace)) for _ in range(6) for namespace in ('heavy', 'light')))
+
+    run(scenario)
+
+    # While both namespaces are backlogged, the heavy one runs two payloads for every light one
+    assert order[:9].count('heavy') == 6
+    assert order[:9].count('light') == 3
+
+
+def test_large_payloads_never_hold_up_small_ones():
+    scheduler = make_scheduler(small_slots=1, large_slots=1, large_cost=1000)
+    order = []
+
+    async def scenario():
+        release_large = asyncio.Event()
+
+        async def large():
+            order.append('large started')
+            await release_large.wait()
+            order.append('large done')
+
+        async def small():
+            order.append('small')
+
+        large_tasks = [asyncio.create_task(scheduler.run('tenant', 5000, large)) for _ in range(2)]
+        await asyncio.sleep(0)
+        await asyncio.gather(*(scheduler.run('tenant', 10, small) for _ in range(3)))
+        release_large.set()
+        await asyncio.gather(*large_tasks)
+
+    run(scenario)
+
+    # One large slot: the second large payload waits, the small ones run meanwhile
+    assert order == ['large started', 'small', 'small', 'small', 'large done', 'large started', 'large done']
+
+
+def test_cancelled_waiter_returns_a_granted_slot():
+    scheduler = make_scheduler(small_slots=1)
+    lane = scheduler._lanes['small']
+
+    async def scenario():
+        # Hold the only slot, as a running payload would
+        holder = lane.enqueue('other', 1)
+        assert holder.future.done()
+
+        cancelled = asyncio.create_task(scheduler.run('tenant', 1, asyncio.sleep))
+        waiting = asyncio.create_task(scheduler.run('tenant', 1, lambda: asyncio.sleep(0, result='ran')))
+        await asyncio.sleep(0)
+
+        # The slot is granted to the first waiter, which is cancelled before it resumes
+        lane.release()
+        cancelled.cancel()
+        results = await asyncio.gather(cancelled, waiting, return_exceptions=True)
+        return results
+
+    cancelled_result, waiting_result = run(scenario)
+
+    assert isinstance(cancelled_result, asyncio.CancelledError)
+    assert waiting_result == 'ran'
+    assert lane.running == 0
+
+
+def test_finish_tags_of_idle_namespaces_are_pruned():
+    scheduler = make_scheduler(small_slots=10 ** 6)
+    lane = scheduler._lanes['small']
+
+    async def scenario():
+        for i in range(2000):
+            lane.enqueue(f"once-{i}", 1)
+        # A backlogged namespace moves the virtual time past every one-off namespace
+        lane.enqueue('bulk', 5)
+        lane.enqueue('bulk', 5)
+        return lane.enqueue('once-0', 1)
+
+    ticket = run(scenario)
+
+    assert set(lane._finish_tags) == {'bulk', 'once-0'}
+    # A pruned namespace starts afresh at the virtual time
+    assert ticket.start == lane.virtual_time == 5
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('pydantic')
+
+from app.common import exceptions
+from app.pipelines.stages import BatchStage, Stage, run_stages
+
+
+async def identity(item):
+    return item
+
+
+def run(root, items):
+    return asyncio.run(asyncio.wait_for(run_stages(root, items), timeout=5))
+
+
+def test_every_item_reaches_the_leaves_with_several_workers():
+    async def double(item):
+        await asyncio.sleep(0.001 * (item % 3))
+        return item * 2
+
+    async def increment(item):
+        return item + 1
+
+    root = Stage('double', double, workers=4, queue_size=2)
+    root.then(Stage('increment', increment, workers=3, queue_size=2))
+
+    results = run(root, range(50))
+
+    assert sorted(results) == [item * 2 + 1 for item in range(50)]
+
+
+def test_results_fan_out_to_every_child():
+    root = Stage('root', identity, workers=2)
+    left = root.then(Stage('left', identity, workers=2))
+    right = root.then(Stage('right', identity))
+
+    run(root, range(10))
+
+    assert sorted(left.results) == sorted(right.results) == list(range(10))
+
+
+def test_batches_are_capped_by_weight():
+    batches = []
+
+    async def collect(batch):
+        batches.append(list(batch))
+        return batch
+
+    root = Stage('root', identity)
+    batch_stage = root.then(BatchStage('batch', collect, max_weight=5, weight=lambda item: item, queue_size=100))
+
+    async def scenario():
+        # Queue every item before the batch worker starts, so batches are only limited by weight
+        for item in [2, 2, 2, 1, 4, 3]:
+            batch_stage.queue.put_nowait(item)
+        await run_stages(root, [])
+
+    asyncio.run(scenario())
+
+    # An item is added while the batch is below the cap, the last one may take it over
+    assert batches == [[2, 2, 2], [1, 4], [3]]
+
+
+def test_batch_worker_waits_for_items_instead_of_spinning():
+    batches = []
+
+    async def slow(item):
+        await asyncio.sleep(0.01)
+        return item
+
+    async def collect(batch):
+        batches.append(batch)
+        return batch
+
+    root = Stage('slow', slow)
+    root.then(BatchStage('batch', collect, max_weight=10))
+
+    run(root, range(3))
+
+    assert [item for batch in batches for item in batch] == [0, 1, 2]
+
+
+@pytest.mark.parametrize('error', [exceptions.PipelineException('bad item'), ValueError('unexpected')])
+def test_failed_items_are_dropped_and_recorded(error):
+    async def fail_odd(item):
+        if item % 2:
+            raise error
+        return item
+
+    root = Stage('fail_odd', fail_odd, workers=2)
+    leaf = root.then(Stage('leaf', identity))
+
+    results = run(root, range(6))
+
+    assert sorted(results) == [0, 2, 4]
+    assert sorted(item for item, _ in root.failed) == [1, 3, 5]
+    assert all(e is error for _, e in root.failed)
+    assert leaf.failed == []
+
+
+def test_none_results_are_dropped_without_failing():
+    async def keep_even(item):
+        return item if item % 2 == 0 else None
+
+    root = Stage('keep_even', keep_even)
+
+    assert run(root, range(5)) == [0, 2, 4]
+    assert root.failed == []
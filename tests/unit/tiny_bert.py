@@ -0,0 +1,26 @@
+"""A tiny randomly initialized BERT model, built on the fly so the local embedding tests need no network access."""
+
+import random
+from pathlib import Path
+from typing import List
+
+
+def build_tiny_model(path: Path, vocab_size: int = 1000) -> str:
+    """Save a small random BERT and its tokenizer, loadable by sentence-transformers."""
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    vocab = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + [f"w{i}" for i in range(vocab_size)]
+    vocab_file = path / 'vocab.txt'
+    vocab_file.write_text('\n'.join(vocab))
+    BertTokenizerFast(vocab_file=str(vocab_file)).save_pretrained(str(path))
+
+    config = BertConfig(vocab_size=len(vocab), hidden_size=64, num_hidden_layers=2, num_attention_heads=2,
+                        intermediate_size=128, max_position_embeddings=512)
+    BertModel(config).save_pretrained(str(path))
+    return str(path)
+
+
+def make_texts(count: int, vocab_size: int = 1000) -> List[str]:
+    """Mostly short texts with a long tail, as produced by the node parsers."""
+    lengths = [min(500, int(random.paretovariate(1.5) * 20)) for _ in range(count)]
+    return [' '.join(f"w{random.randrange(vocab_size)}" for _ in range(length)) for length in lengths]